@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_file, abort, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, abort, redirect, url_for, Response
 import os
 import re
 import uuid
@@ -9,12 +9,54 @@ import tempfile
 import subprocess
 import time
 import random
+import atexit
+import signal
 import threading
 from datetime import datetime
-from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs, quote
+from werkzeug.exceptions import HTTPException
 
 # Import Tor controller
-from utils.tor_controller import get_tor_controller, init_tor, stop_tor
+from utils.tor_controller import get_tor_controller
+# Import pool of Tor instances
+from utils.tor_pool import get_tor_pool
+# Import embedded yt-dlp engine
+from utils.ytdlp_engine import get_ytdlp_engine, FORMAT_PRESETS, YtDlpError, DownloadAborted
+# Import supervision of yt-dlp and ffmpeg processes
+from utils.process_supervisor import get_process_supervisor
+# Import download job queue
+from utils.job_queue import get_job_queue, Job, QueueFullError, NotJobWaiterError
+# Import download job scheduling
+from utils.scheduler import FairScheduler
+# Import worker pool admission control
+from utils.worker_pool import PoolSaturatedError, SlotPool
+# Import download cache
+from utils.download_cache import get_download_cache
+# Import source stream cache and local derivation of presets
+from utils.stream_cache import get_stream_cache, StreamCache
+from utils.transcode import derive_output, TranscodeError
+# Import request coalescing
+from utils.single_flight import get_single_flight
+# Import metadata cache
+from utils.metadata_cache import get_metadata_cache
+# Import background health probes
+from utils.health_monitor import get_health_monitor
+# Import streaming download pipeline
+from utils.media_stream import open_media_stream, STREAM_PRESETS
+# Import streaming ZIP archives
+from utils.zip_stream import stream_zip
+# Import download folder retention
+from utils.retention import get_retention_sweeper
+# Import pooled HTTP sessions
+from utils.http_pool import get_http_pool
+# Import per-process SQLite connections
+from utils.shared_db import reopen_shared_databases
+# Import adaptive upstream rate control
+from utils.rate_controller import get_rate_controller
+# Import Prometheus metrics
+from utils.metrics import (registry, Gauge, STAGE_SECONDS, YTDLP_RETRIES, YTDLP_RATE_LIMITED, BYTES_SERVED,
+                           TRANSCODES, TRANSCODE_CPU_SECONDS)
 
 # Configure logging
 logging.basicConfig(
@@ -30,18 +72,130 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['DOWNLOAD_FOLDER'] = 'downloads'
+app.config['SHARED_STATE_DB'] = os.path.join(app.config['DOWNLOAD_FOLDER'], '.state.db')  # SQLite file sharing caches and jobs between worker processes
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB
 app.config['USE_TOR'] = True  # Enable Tor by default
+app.config['TOR_READY_TIMEOUT'] = 30  # seconds a request waits for Tor to finish starting
+app.config['TOR_INSTANCES'] = 2  # tor processes on ports 9050/9051, 9052/9053, ...
+app.config['UPSTREAM_RATE'] = 2.0  # initial upstream yt-dlp calls per second, adapted to 429s at runtime
+app.config['UPSTREAM_MIN_RATE'] = 0.2  # lowest rate after repeated 429s
+app.config['UPSTREAM_MAX_RATE'] = 10.0  # highest rate reached while the upstream is healthy
+app.config['UPSTREAM_BURST'] = 5  # calls allowed back to back before spacing starts
+app.config['UPSTREAM_MAX_WAIT'] = 30  # seconds an interactive request waits for its turn before a 503
+app.config['YT_DLP_METADATA_WORKERS'] = 4  # Concurrent video info lookups
+app.config['YT_DLP_METADATA_QUEUE'] = 16  # Info lookups allowed to wait for a worker before rejecting
+app.config['YT_DLP_MEDIA_WORKERS'] = 2  # Concurrent yt-dlp downloads, should match DOWNLOAD_JOB_WORKERS
+app.config['YT_DLP_MEDIA_QUEUE'] = 8  # Downloads allowed to wait for a worker before rejecting
+app.config['DOWNLOAD_JOB_WORKERS'] = 2  # Concurrent download jobs
+app.config['DOWNLOAD_JOB_QUEUE_SIZE'] = 20  # Maximum queued or running download jobs
+app.config['CLIENT_WEIGHTS'] = {}  # client address -> share of download workers relative to the default of 1
+app.config['SCHEDULER_AGING'] = 60  # seconds a queued job waits before moving up one priority class
+app.config['LARGE_DOWNLOAD_BYTES'] = 500 * 1024 * 1024  # expected sizes above this drop one priority class
+app.config['DEFAULT_VIDEO_DURATION'] = 600  # seconds assumed for size estimates without cached metadata
+app.config['SSE_KEEPALIVE'] = 15  # seconds between keep-alive comments on idle event streams
+app.config['BATCH_PARALLELISM'] = 3  # Concurrent downloads per batch request
+app.config['BATCH_MAX_ITEMS'] = 50  # Maximum videos in one batch
+app.config['DOWNLOAD_CACHE_ENABLED'] = True  # Reuse finished downloads of the same video and format
+app.config['DOWNLOAD_CACHE_MAX_BYTES'] = 5 * 1024 * 1024 * 1024  # 5 GB
+app.config['STREAM_CACHE_ENABLED'] = True  # Fetch each video/audio stream once and derive every preset from it
+app.config['STREAM_CACHE_MAX_BYTES'] = 5 * 1024 * 1024 * 1024  # 5 GB
+app.config['FFMPEG_THREADS'] = 2  # threads each ffmpeg merge/transcode may use
+app.config['FFMPEG_TIMEOUT'] = 30 * 60  # seconds an ffmpeg run may take before it is killed
+app.config['DOWNLOAD_TIMEOUT'] = 60 * 60  # seconds one yt-dlp download may take before it is stopped
+app.config['STREAM_TIMEOUT'] = 4 * 60 * 60  # seconds a /stream pipeline may run before it is killed
+app.config['MAX_STREAMS'] = 8  # concurrent /stream pipelines per process, each a yt-dlp and usually an ffmpeg
+app.config['STREAM_RETRY_AFTER'] = 10  # Retry-After seconds when every stream slot is taken
+app.config['ASGI_THREADS'] = 32  # threads running Flask views and reading response bodies under asgi.py
+app.config['YT_DLP_SOCKET_TIMEOUT'] = 30  # seconds before yt-dlp gives up on a stalled connection
+app.config['PROCESS_CPU_LIMIT'] = 60 * 60  # CPU seconds per yt-dlp/ffmpeg process (RLIMIT_CPU)
+app.config['PROCESS_MEMORY_LIMIT'] = 4 * 1024 * 1024 * 1024  # address space per process (RLIMIT_AS), 4 GB
+app.config['PROCESS_NICE'] = 10  # niceness added to yt-dlp/ffmpeg processes
+app.config['METADATA_CACHE_TTL'] = 1800  # seconds
+app.config['METADATA_CACHE_SIZE'] = 256  # video info entries kept in memory
+app.config['METADATA_CACHE_DB'] = None  # SQLite file for the persistent metadata tier, defaults to SHARED_STATE_DB
+app.config['HEALTH_CHECK_INTERVAL'] = 30  # seconds between yt-dlp/ffmpeg/Tor probes
+app.config['DOWNLOAD_MAX_AGE'] = 24 * 60 * 60  # Cache-Control max-age for /downloads/<file_id>, in seconds
+app.config['RETENTION_MAX_AGE'] = 24 * 60 * 60  # Delete downloads not served for this many seconds
+app.config['RETENTION_MAX_BYTES'] = 10 * 1024 * 1024 * 1024  # 10 GB quota for DOWNLOAD_FOLDER
+app.config['RETENTION_PARTIAL_MAX_AGE'] = 60 * 60  # Delete stale .part/.webm/.m4a intermediates after this long
+app.config['RETENTION_INTERVAL'] = 600  # seconds between retention sweeps
+app.config['RETENTION_DRY_RUN'] = False  # Only report what would be deleted
 
 # Create downloads directory if it doesn't exist
 os.makedirs(app.config['DOWNLOAD_FOLDER'], exist_ok=True)
 
-# Initialize Tor when the app starts
-if app.config['USE_TOR']:
-    tor_thread = threading.Thread(target=init_tor)
-    tor_thread.daemon = True
-    tor_thread.start()
-    logger.info("Tor initialization started in background thread")
+# Limits for every yt-dlp and ffmpeg process the app starts
+process_supervisor = get_process_supervisor(
+    timeout=app.config['FFMPEG_TIMEOUT'],
+    cpu_seconds=app.config['PROCESS_CPU_LIMIT'],
+    memory_bytes=app.config['PROCESS_MEMORY_LIMIT'],
+    nice=app.config['PROCESS_NICE']
+)
+
+# Start the embedded yt-dlp engine
+ytdlp_engine = get_ytdlp_engine(
+    metadata_workers=app.config['YT_DLP_METADATA_WORKERS'],
+    metadata_queue=app.config['YT_DLP_METADATA_QUEUE'],
+    media_workers=app.config['YT_DLP_MEDIA_WORKERS'],
+    media_queue=app.config['YT_DLP_MEDIA_QUEUE'],
+    ffmpeg_threads=app.config['FFMPEG_THREADS'],
+    socket_timeout=app.config['YT_DLP_SOCKET_TIMEOUT'],
+    download_timeout=app.config['DOWNLOAD_TIMEOUT']
+)
+
+# Space upstream calls across every worker, slowing down only when the upstream answers 429
+rate_controller = get_rate_controller(
+    rate=app.config['UPSTREAM_RATE'],
+    burst=app.config['UPSTREAM_BURST'],
+    min_rate=app.config['UPSTREAM_MIN_RATE'],
+    max_rate=app.config['UPSTREAM_MAX_RATE']
+)
+
+# Streams hold their yt-dlp/ffmpeg pipeline for as long as the client reads, outside the media pool
+stream_slots = SlotPool('stream', app.config['MAX_STREAMS'], retry_after=app.config['STREAM_RETRY_AFTER'])
+
+# Start the download job queue
+job_queue = get_job_queue(
+    max_workers=app.config['DOWNLOAD_JOB_WORKERS'],
+    max_pending=app.config['DOWNLOAD_JOB_QUEUE_SIZE'],
+    scheduler=FairScheduler(weights=app.config['CLIENT_WEIGHTS'], aging=app.config['SCHEDULER_AGING']),
+    db_path=app.config['SHARED_STATE_DB']
+)
+
+# Load the download cache
+download_cache = get_download_cache(
+    app.config['DOWNLOAD_FOLDER'],
+    max_bytes=app.config['DOWNLOAD_CACHE_MAX_BYTES'],
+    db_path=app.config['SHARED_STATE_DB']
+)
+
+# Load the source stream cache; it lives in a dot-directory the retention sweeper skips
+stream_cache = get_stream_cache(
+    os.path.join(app.config['DOWNLOAD_FOLDER'], '.streams'),
+    max_bytes=app.config['STREAM_CACHE_MAX_BYTES'],
+    db_path=app.config['SHARED_STATE_DB']
+)
+
+# Keep DOWNLOAD_FOLDER within its age and size quotas
+retention_sweeper = get_retention_sweeper(
+    app.config['DOWNLOAD_FOLDER'],
+    download_cache,
+    max_age=app.config['RETENTION_MAX_AGE'],
+    max_bytes=app.config['RETENTION_MAX_BYTES'],
+    partial_max_age=app.config['RETENTION_PARTIAL_MAX_AGE'],
+    interval=app.config['RETENTION_INTERVAL'],
+    dry_run=app.config['RETENTION_DRY_RUN']
+)
+
+# Coalesce identical concurrent yt-dlp calls
+single_flight = get_single_flight()
+
+# Cache video metadata between requests
+metadata_cache = get_metadata_cache(
+    ttl=app.config['METADATA_CACHE_TTL'],
+    max_entries=app.config['METADATA_CACHE_SIZE'],
+    db_path=app.config['METADATA_CACHE_DB'] or app.config['SHARED_STATE_DB']
+)
 
 # Helper function to extract video ID from YouTube URL
 def extract_video_id(url):
@@ -107,79 +261,539 @@ def is_tor_installed():
     except (subprocess.SubprocessError, FileNotFoundError):
         return False
 
-# Function to run yt-dlp with Tor proxy
-def run_yt_dlp_with_tor(cmd, max_retries=3, initial_delay=1):
-    logger.debug(f"Running yt-dlp command with Tor: {' '.join(cmd)}")
+# Tor instances that yt-dlp traffic is spread over
+tor_pool = get_tor_pool(size=app.config['TOR_INSTANCES'])
+
+# Probe the Tor connection, returning the exit IP of the first working instance
+def probe_tor():
+    for controller in tor_pool.controllers:
+        status, ip = controller.test_connection()
+        if status:
+            return ip
+    return None
+
+# Background health probes, started by create_app(); routes read the cached results
+health_monitor = get_health_monitor(interval=app.config['HEALTH_CHECK_INTERVAL'])
+health_monitor.register('yt_dlp', get_yt_dlp_version)
+health_monitor.register('ffmpeg', is_ffmpeg_installed)
+health_monitor.register('tor', probe_tor, enabled=lambda: app.config['USE_TOR'])
+tor_pool.on_ready(health_monitor.refresh)
+
+# Export upstream rate control, pool and queue depth as gauges, read only when /metrics is scraped
+registry.register(Gauge(
+    'ytshortpro_upstream_rate', 'Upstream yt-dlp calls per second currently allowed', lambda: rate_controller.rate
+))
+registry.register(Gauge(
+    'ytshortpro_upstream_backoff_seconds', 'Seconds until the next upstream call may start',
+    rate_controller.backoff
+))
+registry.register(Gauge(
+    'ytshortpro_pool_tasks', 'Tasks running or waiting in each yt-dlp worker pool',
+    lambda: {(pool, state): stats[state]
+             for pool, stats in ytdlp_engine.pool_stats().items() for state in ('active', 'queued')},
+    ['pool', 'state']
+))
+registry.register(Gauge(
+    'ytshortpro_streams_active', 'Stream pipelines currently running', lambda: stream_slots.stats()['active']
+))
+registry.register(Gauge(
+    'ytshortpro_download_jobs', 'Download jobs known to the job queue by state',
+    lambda: {(state,): count for state, count in job_queue.stats().items()
+             if state in (Job.QUEUED, Job.RUNNING, Job.FINISHED, Job.FAILED)},
+    ['state']
+))
+
+# Get the Tor probe result, waiting for a Tor startup in progress to finish
+def get_tor_health():
+    tor_health = health_monitor.get('tor')
+    if not tor_health['ok'] and tor_pool.wait_until_ready(timeout=app.config['TOR_READY_TIMEOUT']):
+        tor_health = health_monitor.check('tor')
+    return tor_health
+
+# Lease the least loaded Tor instance, waiting for a Tor startup in progress
+def acquire_tor_lease():
+    if not app.config['USE_TOR']:
+        return None
+    tor_pool.wait_until_ready(timeout=app.config['TOR_READY_TIMEOUT'])
+    return tor_pool.acquire()
+
+# Function to run a yt-dlp engine operation through the Tor proxy
+def run_yt_dlp_with_tor(operation, max_retries=3, measure=None, lease=None, max_wait=None):
+    """Call operation(proxy, referer) with retries, rotating the Tor IP on failures
+
+    The call goes through the least loaded Tor instance; measure(result) returns the
+    bytes transferred, for that instance's throughput estimate. A caller passing its
+    own lease is responsible for releasing it. Every attempt takes a token from the
+    shared rate controller; RateLimitedError is raised rather than waiting longer
+    than max_wait seconds for one.
+    """
+    # Add random referer
+    referers = [
+        'https://www.google.com/',
+        'https://www.bing.com/',
+        'https://www.yahoo.com/',
+        'https://www.reddit.com/',
+        'https://www.facebook.com/'
+    ]
+    referer = random.choice(referers)
     
-    # Add options to help avoid rate limiting
-    if '--sleep-interval' not in ' '.join(cmd):
-        cmd.extend(['--sleep-interval', '2', '--max-sleep-interval', '5'])
+    # Add Tor proxy if enabled
+    owns_lease = lease is None
+    if owns_lease:
+        lease = acquire_tor_lease()
+    proxy_url = lease.proxy_url if lease else None
     
-    if '--no-cache-dir' not in ' '.join(cmd):
-        cmd.append('--no-cache-dir')
+    logger.debug(f"Running yt-dlp operation with proxy: {proxy_url}")
     
-    if '--user-agent' not in ' '.join(cmd):
-        cmd.extend(['--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'])
+    last_error = None
+    result = None
+    succeeded = False
     
-    # Add random referer
-    if '--referer' not in ' '.join(cmd):
-        referers = [
-            'https://www.google.com/',
-            'https://www.bing.com/',
-            'https://www.yahoo.com/',
-            'https://www.reddit.com/',
-            'https://www.facebook.com/'
-        ]
-        cmd.extend(['--referer', random.choice(referers)])
+    try:
+        for attempt in range(max_retries):
+            try:
+                logger.debug(f"Attempt {attempt + 1}/{max_retries}")
+                
+                # If using Tor, rotate IP before each attempt
+                if attempt > 0:
+                    YTDLP_RETRIES.inc()
+                if lease and attempt > 0:
+                    new_ip = lease.controller.renew_tor_ip()
+                    logger.info(f"Rotated Tor IP for retry: {new_ip}")
+                
+                rate_controller.acquire(max_wait=max_wait)
+                result = operation(proxy_url, referer)
+                rate_controller.on_success()
+                succeeded = True
+                return result
+            except YtDlpError as e:
+                last_error = e
+                logger.warning(f"yt-dlp failed (attempt {attempt + 1}/{max_retries}): {e.stderr}")
+                
+                # Rate limiting slows every worker down; the next attempt waits for its token
+                if e.is_rate_limited:
+                    YTDLP_RATE_LIMITED.inc()
+                    rate_controller.on_rate_limited()
+                    logger.warning("Rate limiting detected, rotating Tor IP and retrying")
+                    if lease:
+                        new_ip = lease.controller.renew_tor_ip()
+                        logger.info(f"Rotated Tor IP after rate limit: {new_ip}")
+    finally:
+        if owns_lease and lease:
+            lease.release(measure(result) if succeeded and measure else 0, ok=succeeded)
     
-    # Add Tor proxy if enabled
-    if app.config['USE_TOR']:
-        tor_controller = get_tor_controller()
-        proxy_url = tor_controller.get_proxy_url()
+    # If we get here, all retries failed
+    logger.error(f"All {max_retries} attempts failed")
+    raise last_error
+
+# Build the 503 response for work rejected by a saturated pool
+def busy_response(e, error_message):
+    logger.warning(f"Rejecting request: {e}")
+    response = jsonify({
+        'success': False,
+        'error': error_message,
+        'retry_after': e.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# Build the JSON error payload for a failed yt-dlp operation
+def yt_dlp_error_response(e, error_message, context=''):
+    suffix = f" {context}" if context else ''
+    
+    # Check if it's a rate limiting issue
+    if e.is_rate_limited:
+        logger.error(f"YouTube rate limiting detected{suffix}")
+        return {
+            'success': False, 
+            'error': 'YouTube rate limiting detected. Using Tor to bypass...',
+            'details': e.stderr,
+            'rate_limited': True,
+            'using_tor': app.config['USE_TOR']
+        }
+    elif e.is_bad_request:
+        logger.error(f"YouTube bad request error{suffix}")
+        return {
+            'success': False, 
+            'error': 'YouTube rejected the request. Using Tor to bypass...',
+            'details': e.stderr,
+            'rate_limited': True,
+            'using_tor': app.config['USE_TOR']
+        }
+    else:
+        logger.error(f"Error running yt-dlp{suffix}: {e.stderr}")
+        return {
+            'success': False, 
+            'error': error_message,
+            'details': e.stderr
+        }
+
+# Get the yt-dlp info dict for a URL, using the metadata cache when possible
+def get_video_metadata(url, max_wait=None):
+    video_id = extract_video_id(url)
+    if video_id:
+        video_data = metadata_cache.get(video_id)
+        if video_data is not None:
+            logger.debug(f"Metadata cache hit for video ID: {video_id}")
+            return video_data
+    
+    video_data = single_flight.do(
+        (video_id or url, 'info', None),
+        lambda: run_yt_dlp_with_tor(
+            lambda proxy, referer: ytdlp_engine.extract_info(url, proxy=proxy, referer=referer),
+            max_wait=max_wait
+        )
+    )
+    
+    if video_id:
+        metadata_cache.put(video_id, video_data)
+    return video_data
+
+# Download one elementary stream with yt-dlp, returning the path of the file it wrote
+def download_source_stream(url, stream, temp_path, info, progress, cancel_event=None):
+    with STAGE_SECONDS.time(handler='download_job', stage='fetch_stream'):
+        result = run_yt_dlp_with_tor(
+            lambda proxy, referer: ytdlp_engine.download_stream(
+                url, stream, temp_path, proxy=proxy, referer=referer, info=info, progress=progress,
+                cancel_event=cancel_event
+            ),
+            measure=lambda result: os.path.getsize(result['filepath']) if os.path.exists(result['filepath']) else 0
+        )
+    return result['filepath']
+
+# Download one elementary stream into the stream cache
+def fetch_source_stream(url, video_id, stream, info, progress, cancel_event=None):
+    temp_path = os.path.join(app.config['DOWNLOAD_FOLDER'], str(uuid.uuid4()))
+    filepath = download_source_stream(url, stream, temp_path, info, progress, cancel_event)
+    return stream_cache.put(video_id, stream['format_id'], filepath)
+
+# Get the path of a cached elementary stream, fetching it first on a miss; the stream is left pinned
+def get_cached_stream(url, video_id, stream, info, progress, cancel_event=None):
+    path = stream_cache.get(video_id, stream['format_id'])
+    if path is not None:
+        logger.info(f"Stream cache hit for {video_id} format {stream['format_id']}")
+        return path
+    
+    fetch = lambda: fetch_source_stream(url, video_id, stream, info, progress, cancel_event)
+    try:
+        single_flight.do((video_id, 'stream', stream['format_id']), fetch)
+    except DownloadAborted as e:
+        # The job that led the shared fetch was cancelled, not this one
+        if e.reason != 'cancelled' or cancel_event is None or cancel_event.is_set():
+            raise
+        single_flight.do((video_id, 'stream', stream['format_id']), fetch)
+    path = stream_cache.pin(video_id, stream['format_id'])
+    if path is None:
+        raise TranscodeError(f"Source stream {stream['format_id']} was evicted before use")
+    return path
+
+# Build a preset from its elementary streams with a supervised ffmpeg run
+def download_derived(url, video_id, format_id, output_path, info, progress, cancel_event=None,
+                     use_stream_cache=True):
+    """With use_stream_cache, only streams not cached yet are fetched; otherwise every stream is
+    downloaded to a temporary file next to output_path and removed once the preset is built."""
+    if info is None:
+        info = get_video_metadata(url)
+    streams = ytdlp_engine.select_streams(info, format_id)
+    
+    inputs = []
+    try:
+        for index, stream in enumerate(streams):
+            # Each missing stream fills an equal share of the download progress
+            def report(stage, percent, speed, eta, index=index):
+                if percent is not None:
+                    percent = (index + percent / 100) / len(streams) * 100
+                progress(stage, percent, speed, eta)
+            
+            if use_stream_cache:
+                path = get_cached_stream(url, video_id, stream, info, report, cancel_event)
+            else:
+                safe_format = re.sub(r'[^\w-]', '_', str(stream['format_id']))
+                path = download_source_stream(url, stream, f"{output_path}.{safe_format}", info, report,
+                                              cancel_event)
+            inputs.append((path, stream))
         
-        # Add proxy to yt-dlp command
-        if '--proxy' not in ' '.join(cmd):
-            cmd.extend(['--proxy', proxy_url])
+        progress('transcode' if FORMAT_PRESETS[format_id]['ext'] == 'mp3' else 'merge', None, None, None)
+        with STAGE_SECONDS.time(handler='download_job', stage='ffmpeg'):
+            filepath, transcode_report = derive_output(inputs, format_id, output_path,
+                                                       threads=app.config['FFMPEG_THREADS'],
+                                                       cancel_event=cancel_event)
+    finally:
+        for path, stream in inputs:
+            if use_stream_cache:
+                stream_cache.unpin(video_id, stream['format_id'])
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
     
-    delay = initial_delay
-    last_error = None
+    TRANSCODES.inc(path=transcode_report['path'])
+    if transcode_report['cpu_seconds'] is not None:
+        TRANSCODE_CPU_SECONDS.inc(transcode_report['cpu_seconds'], path=transcode_report['path'])
+    return dict(info, filepath=filepath, transcode=transcode_report)
+
+# Download a video for a queued job and build the result payload
+@STAGE_SECONDS.timed(handler='download_job', stage='total')
+def run_download_job(job, url, format_id):
+    logger.info(f"Starting download job {job.id} - URL: {url}, Format: {format_id}")
+    
+    # Create a unique filename
+    unique_id = str(uuid.uuid4())
+    output_path = os.path.join(app.config['DOWNLOAD_FOLDER'], unique_id)
+    
+    # Reuse metadata already fetched by /api/video-info so the download skips extraction
+    video_id = extract_video_id(url)
+    cached_info = metadata_cache.get(video_id) if video_id else None
     
-    for attempt in range(max_retries):
+    # Download progress fills 0-90%; merge/transcode stages report 90%
+    def report_progress(stage, percent, speed, eta):
+        progress = percent * 0.9 if percent is not None else 90
+        job.update(stage=stage, progress=progress, speed=speed, eta=eta)
+    
+    # Download the video using yt-dlp with Tor
+    try:
+        job.update(stage='download')
+        logger.debug(f"Running yt-dlp to download video with preset {format_id} to {output_path} "
+                     f"({'cached' if cached_info else 'fresh'} metadata)")
+        
         try:
-            logger.debug(f"Attempt {attempt + 1}/{max_retries}")
-            
-            # If using Tor, rotate IP before each attempt
-            if app.config['USE_TOR'] and attempt > 0:
-                tor_controller = get_tor_controller()
-                new_ip = tor_controller.renew_tor_ip()
-                logger.info(f"Rotated Tor IP for retry: {new_ip}")
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            return result
-        except subprocess.CalledProcessError as e:
-            last_error = e
-            logger.warning(f"yt-dlp failed (attempt {attempt + 1}/{max_retries}): {e.stderr}")
+            # Every merge and transcode runs as a supervised ffmpeg, never inside yt-dlp. Only
+            # well-formed IDs name files in the stream cache; other downloads use temporary files.
+            info = download_derived(url, video_id, format_id, output_path, cached_info, report_progress,
+                                    job.cancel_event,
+                                    use_stream_cache=(app.config['STREAM_CACHE_ENABLED']
+                                                      and StreamCache.valid_video_id(video_id)))
+        except YtDlpError as e:
+            return yt_dlp_error_response(e, 'Error processing video', 'during download')
+        except DownloadAborted as e:
+            process_supervisor.record_abort('yt-dlp', e.reason)
+            logger.warning(f"Download job {job.id} stopped: {e}")
+            return {'success': False, 'error': 'Download cancelled' if e.reason == 'cancelled' else 'Download timed out'}
+        except TranscodeError as e:
+            logger.error(f"Error deriving {format_id} from its source streams: {e}")
+            return {'success': False, 'error': 'Error processing video', 'details': str(e)}
+        
+        # Title, extension and final path all come from the same info dict
+        job.update(stage='finalize', progress=95)
+        title = info.get('title') or f"video_{video_id or 'video'}"
+        final_file = info['filepath']
+        final_ext = os.path.splitext(final_file)[1].lstrip('.')
+        
+        # Clean the title for use in a filename
+        title = re.sub(r'[^\w\s-]', '', title)
+        title = re.sub(r'[-\s]+', '-', title).strip('-_')
+        
+        if not os.path.exists(final_file):
+            logger.error(f"Downloaded file not found: {final_file}")
+            return {'success': False, 'error': 'Error processing video: File not found after download'}
+        
+        logger.info(f"Video downloaded successfully: {final_file}")
+        
+        # Publish into the download cache under its content-addressed file ID
+        file_id = unique_id
+        if app.config['DOWNLOAD_CACHE_ENABLED'] and video_id:
+            file_id = download_cache.put(video_id, format_id, final_file, title)['file_id']
+        else:
+            download_cache.register_file(file_id, final_file)
+        
+        # Generate download URL
+        download_url = f"/downloads/{file_id}?download_name={title}.{final_ext}"
+        
+        return {
+            'success': True,
+            'download_url': download_url,
+            'file_id': file_id,
+            'filename': f"{title}.{final_ext}",
+            'transcode': info['transcode'],
+            'using_tor': app.config['USE_TOR']
+        }
+    
+    except PoolSaturatedError:
+        raise
+    except Exception as e:
+        logger.exception(f"Error in download process: {str(e)}")
+        return {'success': False, 'error': f'Error processing video: {str(e)}'}
+
+# Resolve a batch request to the URLs to download, flat-extracting a playlist or channel URL
+def resolve_batch_urls(data):
+    limit = min(int(data.get('limit') or app.config['BATCH_MAX_ITEMS']), app.config['BATCH_MAX_ITEMS'])
+    urls = data.get('urls')
+    if urls:
+        return [url.strip() for url in urls if url.strip()][:limit]
+    
+    url = data.get('url', '')
+    entries = run_yt_dlp_with_tor(
+        lambda proxy, referer: ytdlp_engine.extract_entries(url, proxy=proxy, referer=referer, limit=limit),
+        max_wait=app.config['UPSTREAM_MAX_WAIT']
+    )
+    return [entry['url'] for entry in entries]
+
+# Run a download job, waiting for room whenever the media pool is saturated instead of failing it
+def run_download_job_when_ready(job, url, format_id, attempts=None):
+    attempt = 0
+    while True:
+        try:
+            return run_download_job(job, url, format_id)
+        except PoolSaturatedError as e:
+            attempt += 1
+            if attempts is not None and attempt >= attempts:
+                return {'success': False, 'error': 'The server is busy processing other downloads'}
+            logger.debug(f"Media pool busy, retrying download job {job.id} in {e.retry_after}s")
+            job.update(stage='waiting')
+            if job.cancel_event.wait(e.retry_after):
+                return {'success': False, 'error': 'Download cancelled'}
+
+# Download one batch entry, giving up if the media pool stays saturated
+def run_batch_item(url, format_id, cancel_event, attempts=5):
+    video_id = extract_video_id(url)
+    if app.config['DOWNLOAD_CACHE_ENABLED'] and video_id:
+        entry = download_cache.get(video_id, format_id)
+        if entry:
+            return {'success': True, 'file_id': entry['file_id'], 'filename': f"{entry['title']}.{entry['ext']}"}
+    
+    job = Job('batch', params={'url': url, 'format': format_id}, cancel_event=cancel_event)
+    return run_download_job_when_ready(job, url, format_id, attempts=attempts)
+
+# Yield (name, path) for batch downloads as they finish, then an errors.txt listing failures
+def iter_batch_files(urls, format_id):
+    executor = ThreadPoolExecutor(max_workers=app.config['BATCH_PARALLELISM'], thread_name_prefix='batch')
+    cancel_event = threading.Event()
+    futures = {executor.submit(run_batch_item, url, format_id, cancel_event): (index, url)
+               for index, url in enumerate(urls, 1)}
+    errors = []
+    try:
+        for future in as_completed(futures):
+            index, url = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"Batch item {url} failed: {e}")
+                result = {'success': False, 'error': str(e)}
             
-            # Check if it's a rate limiting issue
-            if "HTTP Error 429" in e.stderr or "Too Many Requests" in e.stderr:
-                logger.warning("Rate limiting detected, rotating Tor IP and retrying")
-                if app.config['USE_TOR']:
-                    tor_controller = get_tor_controller()
-                    new_ip = tor_controller.renew_tor_ip()
-                    logger.info(f"Rotated Tor IP after rate limit: {new_ip}")
-                delay = 1  # With Tor, we can retry quickly with a new IP
-            else:
-                # For other errors, use exponential backoff
-                delay *= 2
+            info = download_cache.resolve(result['file_id']) if result.get('success') else None
+            if info is None:
+                errors.append(f"{url}\t{result.get('error', 'File not found after download')}")
+                continue
             
-            # Sleep before retrying
-            sleep_time = delay + random.uniform(0, 1)  # Add jitter
-            logger.debug(f"Sleeping for {sleep_time:.2f} seconds before retry")
-            time.sleep(sleep_time)
+            download_cache.record_access(result['file_id'])
+            yield f"{index:03d}-{result['filename']}", info['path']
+        
+        if errors:
+            yield 'errors.txt', ('\n'.join(errors) + '\n').encode('utf-8')
+        logger.info(f"Batch of {len(urls)} finished with {len(errors)} failures")
+    finally:
+        # Stops queued items, and downloads and ffmpeg runs in progress, if the client went away mid-archive
+        cancel_event.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+# Estimate the size of a download from cached metadata, for scheduling
+def estimate_download_bytes(video_id, format_id):
+    info = metadata_cache.get(video_id) if video_id else None
+    duration = (info or {}).get('duration') or app.config['DEFAULT_VIDEO_DURATION']
+    return duration * FORMAT_PRESETS[format_id]['kbps'] * 1000 / 8
+
+# Validate a /stream request; returns the error or redirect response, or None if it can be streamed
+def check_stream_request(url, format_id, video_id):
+    if not url or not format_id:
+        return jsonify({'success': False, 'error': 'URL and format are required'}), 400
     
-    # If we get here, all retries failed
-    logger.error(f"All {max_retries} attempts failed")
-    raise last_error
+    if format_id not in STREAM_PRESETS:
+        logger.warning(f"Invalid stream format requested: {format_id}")
+        return jsonify({'success': False, 'error': 'Invalid format'}), 400
+    
+    if not video_id:
+        return jsonify({'success': False, 'error': 'Invalid YouTube URL'}), 400
+    
+    # A finished download of the same video and format is already on disk
+    if app.config['DOWNLOAD_CACHE_ENABLED']:
+        entry = download_cache.get(video_id, format_id)
+        if entry:
+            logger.info(f"Download cache hit for stream {video_id} ({format_id})")
+            return redirect(f"/downloads/{entry['file_id']}?download_name={entry['title']}.{entry['ext']}")
+    
+    if not health_monitor.get('yt_dlp')['ok']:
+        return jsonify({
+            'success': False,
+            'error': 'yt-dlp is not installed. Please install yt-dlp to use this application.',
+            'solution': 'Install yt-dlp using pip: pip install -U yt-dlp'
+        }), 503
+    
+    if 'transcode' in STREAM_PRESETS[format_id] and not health_monitor.get('ffmpeg')['ok']:
+        return jsonify({
+            'success': False,
+            'error': 'ffmpeg is not installed. Please install ffmpeg to use this application.',
+            'solution': 'Install ffmpeg from https://ffmpeg.org/download.html'
+        }), 503
+    
+    if app.config['USE_TOR'] and not get_tor_health()['ok']:
+        return jsonify({
+            'success': False,
+            'error': 'Tor proxy is not working properly. Please check your Tor installation.',
+            'solution': 'Make sure Tor is installed and running correctly.'
+        }), 503
+    
+    return None
+
+# Start the media pipeline for a /stream request; returns (stream, None) or (None, error response)
+def start_stream(url, format_id, opener=open_media_stream):
+    # A stream slot is held until the pipeline has been closed
+    try:
+        release_slot = stream_slots.acquire()
+    except PoolSaturatedError as e:
+        return None, busy_response(e, 'The server is busy streaming other videos. Please try again shortly.')
+    
+    # Retries are only possible until the first byte has been produced
+    lease = acquire_tor_lease()
+    try:
+        stream = run_yt_dlp_with_tor(
+            lambda proxy, referer: opener(url, format_id, proxy=proxy, referer=referer,
+                                          timeout=app.config['STREAM_TIMEOUT']),
+            lease=lease,
+            max_wait=app.config['UPSTREAM_MAX_WAIT']
+        )
+    except YtDlpError as e:
+        release_slot()
+        if lease:
+            lease.release(ok=False)
+        return None, (jsonify(yt_dlp_error_response(e, 'Error streaming video', 'while streaming')), 502)
+    except PoolSaturatedError as e:
+        # The upstream rate limiter would make the first byte wait too long
+        release_slot()
+        if lease:
+            lease.release(ok=False)
+        return None, busy_response(e, 'The server is busy streaming other videos. Please try again shortly.')
+    except BaseException:
+        # e.g. FileNotFoundError when yt-dlp or ffmpeg is missing; the lease must not stay in flight
+        release_slot()
+        if lease:
+            lease.release(ok=False)
+        raise
+    
+    # The Tor instance stays busy until the client has received the whole stream
+    if lease:
+        stream.on_close(lambda: lease.release(stream.bytes_sent))
+    stream.on_close(release_slot)
+    stream.on_close(lambda: BYTES_SERVED.inc(stream.bytes_sent, route='stream'))
+    return stream, None
+
+# Response headers for a streamed download
+def stream_headers(video_id, format_id):
+    # Use a title only if the metadata is already cached, fetching it would delay the first byte
+    info = metadata_cache.get(video_id) or {}
+    title = re.sub(r'[^\w\s-]', '', info.get('title') or f"video_{video_id}")
+    title = re.sub(r'[-\s]+', '-', title).strip('-_')
+    
+    preset = STREAM_PRESETS[format_id]
+    return {
+        'Content-Disposition': f"attachment; filename=\"video_{video_id}.{preset['ext']}\"; "
+                               f"filename*=UTF-8''{quote(title)}.{preset['ext']}",
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    }
 
 # Routes
 @app.route('/')
@@ -187,18 +801,15 @@ def index():
     logger.info("Rendering index page")
     
     # Check yt-dlp version
-    yt_dlp_version = get_yt_dlp_version()
+    yt_dlp_version = health_monitor.get('yt_dlp')['value']
     
     # Check Tor status
     tor_status = False
     tor_ip = None
     
     if app.config['USE_TOR']:
-        try:
-            tor_controller = get_tor_controller()
-            tor_status, tor_ip = tor_controller.test_connection()
-        except Exception as e:
-            logger.error(f"Error checking Tor status: {e}")
+        tor_health = health_monitor.get('tor')
+        tor_status, tor_ip = tor_health['ok'], tor_health['value']
     
     return render_template('index.html', 
                           yt_dlp_version=yt_dlp_version,
@@ -233,6 +844,7 @@ def validate_url():
         return jsonify({'valid': False, 'error': f'Error validating URL: {str(e)}'})
 
 @app.route('/api/video-info', methods=['POST'])
+@STAGE_SECONDS.timed(handler='get_video_info', stage='total')
 def get_video_info():
     logger.info("Getting video info")
     try:
@@ -246,8 +858,7 @@ def get_video_info():
             return jsonify({'success': False, 'error': 'URL is required'})
         
         # Check if yt-dlp is installed
-        yt_dlp_version = get_yt_dlp_version()
-        if not yt_dlp_version:
+        if not health_monitor.get('yt_dlp')['ok']:
             logger.error("yt-dlp is not installed")
             return jsonify({
                 'success': False, 
@@ -257,8 +868,9 @@ def get_video_info():
         
         # Check Tor status if enabled
         if app.config['USE_TOR']:
-            tor_controller = get_tor_controller()
-            tor_status, tor_ip = tor_controller.test_connection()
+            with STAGE_SECONDS.time(handler='get_video_info', stage='tor_check'):
+                tor_health = get_tor_health()
+            tor_status, tor_ip = tor_health['ok'], tor_health['value']
             
             if not tor_status:
                 logger.warning("Tor is not working properly")
@@ -274,47 +886,13 @@ def get_video_info():
         try:
             logger.debug(f"Running yt-dlp to get video info for URL: {url}")
             
-            # Use yt-dlp to get video info in JSON format
-            cmd = [
-                'yt-dlp', 
-                '-j', 
-                '--no-cache-dir',
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                '--sleep-interval', '2',
-                '--max-sleep-interval', '5',
-                url
-            ]
-            
             try:
-                result = run_yt_dlp_with_tor(cmd)
-                video_data = json.loads(result.stdout)
-            except subprocess.CalledProcessError as e:
-                # Check if it's a rate limiting issue
-                if "HTTP Error 429" in e.stderr or "Too Many Requests" in e.stderr:
-                    logger.error("YouTube rate limiting detected")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'YouTube rate limiting detected. Using Tor to bypass...',
-                        'details': e.stderr,
-                        'rate_limited': True,
-                        'using_tor': app.config['USE_TOR']
-                    })
-                elif "HTTP Error 400" in e.stderr or "Bad Request" in e.stderr:
-                    logger.error("YouTube bad request error")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'YouTube rejected the request. Using Tor to bypass...',
-                        'details': e.stderr,
-                        'rate_limited': True,
-                        'using_tor': app.config['USE_TOR']
-                    })
-                else:
-                    logger.error(f"Error running yt-dlp: {e.stderr}")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'Error retrieving video information',
-                        'details': e.stderr
-                    })
+                with STAGE_SECONDS.time(handler='get_video_info', stage='extract'):
+                    video_data = get_video_metadata(url, max_wait=app.config['UPSTREAM_MAX_WAIT'])
+            except YtDlpError as e:
+                return jsonify(yt_dlp_error_response(e, 'Error retrieving video information'))
+            except PoolSaturatedError as e:
+                return busy_response(e, 'The server is busy looking up other videos. Please try again shortly.')
             
             logger.debug(f"Video data retrieved successfully")
             
@@ -362,8 +940,7 @@ def get_video_info():
             # Get current Tor IP if using Tor
             current_ip = None
             if app.config['USE_TOR']:
-                tor_controller = get_tor_controller()
-                _, current_ip = tor_controller.test_connection()
+                current_ip = health_monitor.get('tor')['value']
             
             logger.info(f"Video info retrieved successfully for video ID: {video_id}")
             
@@ -382,7 +959,7 @@ def get_video_info():
                 'tor_ip': current_ip
             })
         
-        except json.JSONDecodeError as e:
+        except (KeyError, TypeError, ValueError) as e:
             logger.error(f"Error parsing yt-dlp output: {str(e)}")
             return jsonify({'success': False, 'error': 'Error parsing video information'})
     
@@ -391,6 +968,7 @@ def get_video_info():
         return jsonify({'success': False, 'error': f'Error retrieving video information: {str(e)}'})
 
 @app.route('/download', methods=['POST'])
+@STAGE_SECONDS.timed(handler='download_video', stage='total')
 def download_video():
     logger.info("Processing download request")
     try:
@@ -403,9 +981,25 @@ def download_video():
             logger.warning("Missing URL or format in download request")
             return jsonify({'success': False, 'error': 'URL and format are required'})
         
+        if format_id not in FORMAT_PRESETS:
+            logger.warning(f"Invalid format requested: {format_id}")
+            return jsonify({'success': False, 'error': 'Invalid format'})
+        
+        # Serve straight from the download cache when possible
+        video_id = extract_video_id(url)
+        if app.config['DOWNLOAD_CACHE_ENABLED'] and video_id:
+            entry = download_cache.get(video_id, format_id)
+            if entry:
+                logger.info(f"Download cache hit for {video_id} ({format_id})")
+                return jsonify({
+                    'success': True,
+                    'cached': True,
+                    'download_url': f"/downloads/{entry['file_id']}?download_name={entry['title']}.{entry['ext']}",
+                    'using_tor': app.config['USE_TOR']
+                })
+        
         # Check if yt-dlp is installed
-        yt_dlp_version = get_yt_dlp_version()
-        if not yt_dlp_version:
+        if not health_monitor.get('yt_dlp')['ok']:
             logger.error("yt-dlp is not installed")
             return jsonify({
                 'success': False, 
@@ -413,7 +1007,7 @@ def download_video():
                 'solution': 'Install yt-dlp using pip: pip install -U yt-dlp'
             })
         
-        if not is_ffmpeg_installed():
+        if not health_monitor.get('ffmpeg')['ok']:
             logger.error("ffmpeg is not installed")
             return jsonify({
                 'success': False, 
@@ -423,8 +1017,9 @@ def download_video():
         
         # Check Tor status if enabled
         if app.config['USE_TOR']:
-            tor_controller = get_tor_controller()
-            tor_status, tor_ip = tor_controller.test_connection()
+            with STAGE_SECONDS.time(handler='download_video', stage='tor_check'):
+                tor_health = get_tor_health()
+            tor_status, tor_ip = tor_health['ok'], tor_health['value']
             
             if not tor_status:
                 logger.warning("Tor is not working properly")
@@ -436,122 +1031,215 @@ def download_video():
             
             logger.info(f"Using Tor with IP: {tor_ip}")
         
-        # Create a unique filename
-        unique_id = str(uuid.uuid4())
-        output_path = os.path.join(app.config['DOWNLOAD_FOLDER'], unique_id)
-        
-        # Set yt-dlp command based on format
-        cmd = ['yt-dlp']
-        
-        # Add common options
-        cmd.extend([
-            '--no-cache-dir',
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            '--sleep-interval', '2',
-            '--max-sleep-interval', '5'
-        ])
-        
-        if format_id == 'mp4-hd':
-            cmd.extend(['-f', 'bestvideo[height<=1080]+bestaudio/best[height<=1080]'])
-            cmd.extend(['--merge-output-format', 'mp4'])
-            final_ext = 'mp4'
-        elif format_id == 'mp4-sd':
-            cmd.extend(['-f', 'bestvideo[height<=480]+bestaudio/best[height<=480]'])
-            cmd.extend(['--merge-output-format', 'mp4'])
-            final_ext = 'mp4'
-        elif format_id == 'mp3':
-            cmd.extend(['-f', 'bestaudio/best'])
-            cmd.extend(['--extract-audio', '--audio-format', 'mp3', '--audio-quality', '192'])
-            final_ext = 'mp3'
-        else:
-            logger.warning(f"Invalid format requested: {format_id}")
-            return jsonify({'success': False, 'error': 'Invalid format'})
-        
-        cmd.extend(['-o', f'{output_path}.%(ext)s'])
-        cmd.append(url)
+        # Cheap formats run first; large downloads drop a class so they cannot hold up the rest
+        expected_bytes = estimate_download_bytes(video_id, format_id)
+        priority = FORMAT_PRESETS[format_id]['priority']
+        if expected_bytes > app.config['LARGE_DOWNLOAD_BYTES']:
+            priority += 1
         
-        # Download the video using yt-dlp with Tor
+        # Queue the download and return immediately; identical in-flight downloads share one job
         try:
-            logger.debug(f"Running yt-dlp to download video with command: {' '.join(cmd)}")
-            
-            try:
-                run_yt_dlp_with_tor(cmd)
-            except subprocess.CalledProcessError as e:
-                # Check if it's a rate limiting issue
-                if "HTTP Error 429" in e.stderr or "Too Many Requests" in e.stderr:
-                    logger.error("YouTube rate limiting detected during download")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'YouTube rate limiting detected. Using Tor to bypass...',
-                        'details': e.stderr,
-                        'rate_limited': True,
-                        'using_tor': app.config['USE_TOR']
-                    })
-                elif "HTTP Error 400" in e.stderr or "Bad Request" in e.stderr:
-                    logger.error("YouTube bad request error during download")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'YouTube rejected the request. Using Tor to bypass...',
-                        'details': e.stderr,
-                        'rate_limited': True,
-                        'using_tor': app.config['USE_TOR']
-                    })
-                else:
-                    logger.error(f"Error running yt-dlp for download: {e.stderr}")
-                    return jsonify({
-                        'success': False, 
-                        'error': 'Error processing video',
-                        'details': e.stderr
-                    })
-            
-            # Get the title for the filename
-            info_cmd = [
-                'yt-dlp', 
-                '--get-title',
-                '--no-cache-dir',
-                '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                url
-            ]
-            
-            try:
-                result = run_yt_dlp_with_tor(info_cmd)
-                title = result.stdout.strip()
-            except subprocess.CalledProcessError:
-                # If getting title fails, use a generic name
-                video_id = extract_video_id(url) or 'video'
-                title = f"video_{video_id}"
-            
-            # Clean the title for use in a filename
-            title = re.sub(r'[^\w\s-]', '', title)
-            title = re.sub(r'[-\s]+', '-', title).strip('-_')
-            
-            # Final file path
-            final_file = f"{output_path}.{final_ext}"
-            
-            if not os.path.exists(final_file):
-                logger.error(f"Downloaded file not found: {final_file}")
-                return jsonify({'success': False, 'error': 'Error processing video: File not found after download'})
-            
-            logger.info(f"Video downloaded successfully: {final_file}")
-            
-            # Generate download URL
-            download_url = f"/downloads/{unique_id}?download_name={title}.{final_ext}"
-            
-            return jsonify({
-                'success': True,
-                'download_url': download_url,
-                'using_tor': app.config['USE_TOR']
-            })
+            with STAGE_SECONDS.time(handler='download_video', stage='enqueue'):
+                job = job_queue.submit(
+                    'download',
+                    lambda job: run_download_job_when_ready(job, url, format_id),
+                    params={'url': url, 'format': format_id},
+                    dedupe_key=(video_id or url, 'download', format_id),
+                    client=request.remote_addr,
+                    priority=priority,
+                    cost=expected_bytes / (1024 * 1024)
+                )
+        except QueueFullError as e:
+            return busy_response(e, 'The server is busy processing other downloads. Please try again shortly.')
         
-        except Exception as e:
-            logger.exception(f"Error in download process: {str(e)}")
-            return jsonify({'success': False, 'error': f'Error processing video: {str(e)}'})
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': f"/api/jobs/{job.id}",
+            'using_tor': app.config['USE_TOR']
+        }), 202
     
     except Exception as e:
         logger.exception(f"Error downloading video: {str(e)}")
         return jsonify({'success': False, 'error': f'Error processing video: {str(e)}'})
 
+@app.route('/api/batch', methods=['POST'])
+def batch_download():
+    """Download a list of URLs or a playlist/channel and stream the results as a ZIP archive"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
+    
+    # A string would otherwise be iterated one character at a time
+    urls = data.get('urls')
+    if urls is not None and not (isinstance(urls, list) and all(isinstance(url, str) for url in urls)):
+        return jsonify({'success': False, 'error': 'urls must be a list of strings'}), 400
+    if not isinstance(data.get('url', ''), str):
+        return jsonify({'success': False, 'error': 'url must be a string'}), 400
+    
+    format_id = data.get('format', '')
+    logger.info(f"Batch request - {len(urls or [])} URLs, playlist: {data.get('url')}, Format: {format_id}")
+    
+    if not urls and not data.get('url'):
+        return jsonify({'success': False, 'error': 'A list of URLs or a playlist URL is required'}), 400
+    
+    if format_id not in FORMAT_PRESETS:
+        return jsonify({'success': False, 'error': 'Invalid format'}), 400
+    
+    if not str(data.get('limit') or 0).isdigit():
+        return jsonify({'success': False, 'error': 'limit must be a positive integer'}), 400
+    
+    if not health_monitor.get('yt_dlp')['ok'] or not health_monitor.get('ffmpeg')['ok']:
+        return jsonify({
+            'success': False,
+            'error': 'yt-dlp and ffmpeg are required for batch downloads.'
+        }), 503
+    
+    if app.config['USE_TOR'] and not get_tor_health()['ok']:
+        return jsonify({
+            'success': False,
+            'error': 'Tor proxy is not working properly. Please check your Tor installation.',
+            'solution': 'Make sure Tor is installed and running correctly.'
+        }), 503
+    
+    try:
+        urls = resolve_batch_urls(data)
+    except YtDlpError as e:
+        return jsonify(yt_dlp_error_response(e, 'Error resolving playlist', 'while resolving playlist')), 502
+    except PoolSaturatedError as e:
+        return busy_response(e, 'The server is busy looking up other videos. Please try again shortly.')
+    
+    if not urls:
+        return jsonify({'success': False, 'error': 'No videos found'}), 404
+    
+    logger.info(f"Starting batch of {len(urls)} videos ({format_id})")
+    return Response(
+        stream_zip(iter_batch_files(urls, format_id)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f"attachment; filename=\"batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip\"",
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/jobs/<job_id>')
+def get_job_status(job_id):
+    """Get the state and progress of a download job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running download job, killing its yt-dlp and ffmpeg work
+
+    Clients coalesced into the same job only detach from it; the work itself
+    is cancelled once the last of them has cancelled.
+    """
+    try:
+        job = job_queue.cancel(job_id, client=request.remote_addr)
+    except NotJobWaiterError:
+        return jsonify({'success': False, 'error': 'Job was not submitted by this client'}), 403
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def generate():
+        version = -1
+        while True:
+            version, snapshot = job.wait_for_change(version, timeout=app.config['SSE_KEEPALIVE'])
+            if snapshot is None:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            
+            yield f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+            if snapshot['state'] in ('finished', 'failed'):
+                yield f"event: {snapshot['state']}\ndata: {json.dumps(snapshot)}\n\n"
+                return
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/jobs')
+def list_jobs():
+    """Get job queue statistics"""
+    return jsonify({'success': True, 'stats': job_queue.stats()})
+
+@app.route('/api/pools')
+def pool_stats():
+    """Get worker pool utilisation, upstream rate control and process supervision state"""
+    return jsonify({
+        'success': True,
+        'pools': ytdlp_engine.pool_stats(),
+        'streams': stream_slots.stats(),
+        'jobs': job_queue.stats(),
+        'upstream_rate': rate_controller.stats(),
+        'processes': process_supervisor.stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Expose metrics in the Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Get cache hit/miss statistics"""
+    return jsonify({
+        'success': True,
+        'download': download_cache.stats(),
+        'streams': stream_cache.stats(),
+        'metadata': metadata_cache.stats(),
+        'single_flight': single_flight.stats(),
+        'retention': retention_sweeper.stats()
+    })
+
+@app.route('/api/storage/sweep', methods=['POST'])
+def sweep_downloads():
+    """Run a retention sweep now; pass dry_run to only report what would be deleted"""
+    data = request.get_json(silent=True) or {}
+    try:
+        report = retention_sweeper.sweep(dry_run=data.get('dry_run'))
+        return jsonify({'success': True, 'report': report})
+    except Exception as e:
+        logger.exception(f"Error sweeping downloads: {str(e)}")
+        return jsonify({'success': False, 'error': f'Error sweeping downloads: {str(e)}'})
+
+@app.route('/stream')
+def stream_video():
+    """Stream a video to the client while yt-dlp is still downloading it"""
+    url = request.args.get('url', '')
+    format_id = request.args.get('format', '')
+    logger.info(f"Streaming request - URL: {url}, Format: {format_id}")
+    
+    video_id = extract_video_id(url)
+    error = check_stream_request(url, format_id, video_id)
+    if error is not None:
+        return error
+    
+    stream, error = start_stream(url, format_id)
+    if error is not None:
+        return error
+    
+    return Response(stream, mimetype=STREAM_PRESETS[format_id]['mimetype'], headers=stream_headers(video_id, format_id))
+
 @app.route('/downloads/<file_id>')
+@STAGE_SECONDS.timed(handler='serve_download', stage='total')
 def serve_download(file_id):
     logger.info(f"Serving download for file ID: {file_id}")
     try:
@@ -562,24 +1250,54 @@ def serve_download(file_id):
             logger.warning(f"Invalid file ID requested: {file_id}")
             abort(404)
         
-        # Find the file with the given ID
-        for ext in ['mp4', 'mp3']:
-            file_path = os.path.join(app.config['DOWNLOAD_FOLDER'], f"{file_id}.{ext}")
-            if os.path.exists(file_path):
-                logger.info(f"Serving file: {file_path} as {download_name}")
-                return send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=download_name
-                )
+        # Look the file up in the download index instead of probing each extension
+        with STAGE_SECONDS.time(handler='serve_download', stage='resolve'):
+            file_info = download_cache.resolve(file_id)
+        if file_info is None:
+            logger.warning(f"File not found for ID: {file_id}")
+            abort(404)
+        
+        logger.info(f"Serving file: {file_info['path']} as {download_name}")
+        download_cache.record_access(file_id)
         
-        logger.warning(f"File not found for ID: {file_id}")
-        abort(404)
+        # send_file answers Range (206), If-Range and If-None-Match (304) from these validators
+        with STAGE_SECONDS.time(handler='serve_download', stage='send_file'):
+            response = send_file(
+                file_info['path'],
+                as_attachment=True,
+                download_name=download_name,
+                conditional=True,
+                etag=file_info['etag'],
+                last_modified=file_info['last_modified'],
+                max_age=app.config['DOWNLOAD_MAX_AGE']
+            )
+        response.cache_control.public = True
+        if file_info['cached']:
+            # Cached downloads never change under the same file ID and ETag
+            response.cache_control.immutable = True
+        # Full and partial (Range) responses carry the body length; 304s send nothing
+        if response.status_code in (200, 206) and response.content_length:
+            BYTES_SERVED.inc(response.content_length, route='downloads')
+        return response
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Error serving download: {str(e)}")
         abort(500)
 
+@app.route('/api/health')
+def health():
+    """Get the cached health probe results for yt-dlp, ffmpeg and Tor"""
+    return jsonify({
+        'success': True,
+        'healthy': health_monitor.is_healthy(),
+        'use_tor': app.config['USE_TOR'],
+        'interval': health_monitor.interval,
+        'probes': health_monitor.snapshot(),
+        'http_pool': get_http_pool().stats()
+    })
+
 @app.route('/api/tor/status')
 def tor_status():
     """Get the current Tor status and IP"""
@@ -591,16 +1309,27 @@ def tor_status():
         })
     
     try:
-        tor_controller = get_tor_controller()
-        status, ip = tor_controller.test_connection()
+        tor_health = health_monitor.get('tor')
+        status, ip = tor_health['ok'], tor_health['value']
         
         if status:
             return jsonify({
                 'enabled': True,
                 'status': 'connected',
                 'ip': ip,
+                'circuits': get_tor_controller().circuit_status(),
+                'instances': tor_pool.stats(),
                 'message': f'Tor is connected with IP: {ip}'
             })
+        
+        startup = get_tor_controller().startup_status()
+        if startup['running'] and not startup['ready']:
+            return jsonify({
+                'enabled': True,
+                'status': 'starting',
+                'startup': startup,
+                'message': f"Tor is starting ({startup['bootstrap_progress']}% bootstrapped)"
+            })
         else:
             return jsonify({
                 'enabled': True,
@@ -625,13 +1354,14 @@ def rotate_tor_ip():
         })
     
     try:
-        tor_controller = get_tor_controller()
-        new_ip = tor_controller.renew_tor_ip()
+        new_ips = tor_pool.renew_all()
+        new_ip = new_ips[0]
         
         if new_ip:
             return jsonify({
                 'success': True,
                 'ip': new_ip,
+                'ips': new_ips,
                 'message': f'Tor IP rotated to: {new_ip}'
             })
         else:
@@ -653,19 +1383,30 @@ def toggle_tor():
         data = request.get_json()
         enable = data.get('enable', True)
         
+        if tor_pool.attached:
+            # One Tor serves every worker; a toggle would only reach the worker handling this request
+            return jsonify({
+                'success': False,
+                'enabled': app.config['USE_TOR'],
+                'message': 'Tor is shared by all workers and cannot be toggled at runtime'
+            }), 409
+        
         if enable and not app.config['USE_TOR']:
             # Enable Tor
             app.config['USE_TOR'] = True
-            init_tor()
+            tor_pool.start()
+            health_monitor.refresh()
             return jsonify({
                 'success': True,
                 'enabled': True,
-                'message': 'Tor enabled'
+                'startup': get_tor_controller().startup_status(),
+                'message': 'Tor enabled, starting in the background'
             })
         elif not enable and app.config['USE_TOR']:
             # Disable Tor
             app.config['USE_TOR'] = False
-            stop_tor()
+            tor_pool.stop()
+            health_monitor.refresh()
             return jsonify({
                 'success': True,
                 'enabled': False,
@@ -694,6 +1435,7 @@ def update_yt_dlp():
         
         if result.returncode == 0:
             new_version = get_yt_dlp_version()
+            health_monitor.refresh()
             logger.info(f"yt-dlp updated successfully to version {new_version}")
             return jsonify({
                 'success': True,
@@ -729,13 +1471,74 @@ def server_error(e):
     logger.error(f"500 error: {str(e)}")
     return render_template('500.html'), 500
 
-@app.teardown_appcontext
-def shutdown_tor(exception=None):
-    """Shutdown Tor when the application exits"""
+# Stop the Tor processes this process started
+def shutdown_tor():
+    if tor_pool.attached:
+        return
+    logger.info("Shutting down Tor...")
+    tor_pool.stop()
+
+# Give a forked process its own database and HTTP connections instead of its parent's
+def reopen_connections():
+    reopen_shared_databases()
+    get_http_pool().reopen()
+
+_services_started = False
+
+# App factory: start the background services and return the application
+def create_app(shared_services=False, worker_count=1):
+    """Start health probes, Tor and retention sweeps for this process and return the app
+
+    With shared_services, Tor and retention sweeps run once in the process
+    run_shared_services() runs (gunicorn.conf.py starts it from the master), and
+    this worker only attaches to that Tor. worker_count splits the upstream rate
+    budget between worker processes. Module import starts no threads, so the app
+    can be preloaded before the workers are forked; a forked worker must call
+    reopen_connections() first. Calling this again in the same process does nothing.
+    """
+    global _services_started
+    if _services_started:
+        return app
+    _services_started = True
+
+    if worker_count > 1:
+        # Each worker paces its own upstream calls; together they keep to UPSTREAM_RATE
+        rate_controller.scale(1 / worker_count)
+    health_monitor.start()
+    if shared_services:
+        if app.config['USE_TOR']:
+            tor_pool.attach()
+            logger.info("Attaching to the shared Tor instances")
+    else:
+        retention_sweeper.start()
+        # Initialize Tor when the app starts; it bootstraps in the background
+        if app.config['USE_TOR']:
+            tor_pool.start()
+            logger.info("Tor initialization started")
+        atexit.register(shutdown_tor)
+    return app
+
+# Run Tor and retention sweeps for every worker until SIGTERM/SIGINT or the parent process exits
+def run_shared_services():
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    parent = os.getppid()
+    reopen_connections()
+    logger.info(f"Shared services started in process {os.getpid()}")
+    
+    retention_sweeper.start()
     if app.config['USE_TOR']:
-        logger.info("Shutting down Tor...")
-        stop_tor()
+        tor_pool.start()
+    try:
+        # A master that died without stopping us would otherwise leave Tor holding its ports
+        while not stopping.is_set() and os.getppid() == parent:
+            time.sleep(1)
+    finally:
+        retention_sweeper.stop()
+        shutdown_tor()
+        logger.info("Shared services stopped")
 
 if __name__ == '__main__':
     logger.info("Starting application")
-    app.run(debug=True)
+    create_app().run(debug=True)
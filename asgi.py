@@ -0,0 +1,270 @@
+"""ASGI entry point: serve the app from an asyncio event loop
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Long-lived responses are handled on the event loop: /stream runs its yt-dlp and
+ffmpeg pipeline with asyncio subprocesses and job event streams poll without a
+thread. Every other route runs the unchanged Flask view on a bounded thread
+pool, and response bodies (including files from /downloads) are pulled from it
+one chunk at a time, so a slow client holds no thread between chunks.
+"""
+import io
+import re
+import sys
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.wsgi import FileWrapper
+
+from app import (create_app, job_queue, extract_video_id, check_stream_request, start_stream,
+                 stream_headers)
+from utils.media_stream import open_async_media_stream, STREAM_PRESETS
+
+logger = logging.getLogger(__name__)
+
+# A single uvicorn process runs Tor and the other background services itself
+flask_app = create_app()
+
+# Marks the end of a WSGI response body
+_END = object()
+
+
+def _file_wrapper(file, block_size=8192):
+    # Larger blocks than Werkzeug's default mean fewer thread pool hops per file
+    return FileWrapper(file, max(block_size, 256 * 1024))
+
+
+class AsgiApp:
+    """ASGI application with native async handlers in front of the Flask WSGI app"""
+
+    def __init__(self, wsgi_app, threads=32, sse_poll_interval=0.25):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.sse_poll_interval = sse_poll_interval  # seconds between job change checks on event streams
+        self.routes = [
+            ('GET', re.compile(r'^/stream$'), self.stream_video),
+            ('GET', re.compile(r'^/api/jobs/(?P<job_id>[^/]+)/events$'), self.job_events),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        for method, pattern, handler in self.routes:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                await handler(scope, receive, send, **match.groupdict())
+                return
+        await self.call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _run(self, func, *args):
+        """Run a blocking function on the thread pool"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    async def _read_body(receive):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(body)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    def _environ(self, scope, body):
+        """Build the WSGI environ for an ASGI HTTP request"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0] if client else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': _file_wrapper,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+            else:
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def call_wsgi(self, scope, receive, send):
+        """Run the Flask app for one request, pulling the response body a chunk at a time"""
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return lambda data: None
+
+        iterable = await self._run(self.wsgi_app, self._environ(scope, body), start_response)
+        iterator = iter(iterable)
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            # start_response may only be called once the first chunk is produced
+            chunk = await self._run(next, iterator, _END)
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not _END and not disconnect.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await self._run(next, iterator, _END)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            if hasattr(iterable, 'close'):
+                await self._run(iterable.close)
+
+    async def _send_flask_response(self, send, result):
+        """Send a view return value (response or (response, status)) built from Flask helpers"""
+        def build():
+            with flask_app.app_context():
+                response = flask_app.make_response(result)
+                return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+        status, headers, body = await self._run(build)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stream_video(self, scope, receive, send):
+        """/stream with the yt-dlp/ffmpeg pipeline on the event loop"""
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        url = query.get('url', [''])[0]
+        format_id = query.get('format', [''])[0]
+        logger.info(f"Streaming request - URL: {url}, Format: {format_id}")
+
+        loop = asyncio.get_event_loop()
+
+        def prepare():
+            video_id = extract_video_id(url)
+            with flask_app.app_context():
+                error = check_stream_request(url, format_id, video_id)
+                if error is not None:
+                    return video_id, None, error
+                # Retries and Tor rotation stay in the shared helper; each attempt starts the pipeline on the loop
+                stream, error = start_stream(url, format_id, opener=lambda *args, **kwargs: (
+                    asyncio.run_coroutine_threadsafe(open_async_media_stream(*args, **kwargs), loop).result()
+                ))
+                return video_id, stream, error
+
+        video_id, stream, error = await self._run(prepare)
+        if error is not None:
+            await self._send_flask_response(send, error)
+            return
+
+        headers = dict(stream_headers(video_id, format_id), **{'Content-Type': STREAM_PRESETS[format_id]['mimetype']})
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers.items()]})
+
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        chunks = stream.__aiter__()
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({next_chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_chunk.done():
+                    # Client went away while waiting for media; the pipeline is killed below
+                    next_chunk.cancel()
+                    await asyncio.wait({next_chunk})
+                    break
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnect.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            await stream.aclose()
+
+    async def job_events(self, scope, receive, send, job_id):
+        """/api/jobs/<job_id>/events without a thread parked per subscriber
+
+        Job lookups and change checks go to the thread pool: for a job of another
+        worker process they read the shared SQLite database.
+        """
+        job = await self._run(job_queue.get, job_id)
+        if job is None:
+            await self._send_flask_response(send, ({'success': False, 'error': 'Job not found'}, 404))
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        keepalive = flask_app.config['SSE_KEEPALIVE']
+        version = -1
+        idle = 0.0
+        try:
+            while not disconnect.done():
+                version, snapshot = await self._run(job.wait_for_change, version, 0)
+                if snapshot is None:
+                    await asyncio.sleep(self.sse_poll_interval)
+                    idle += self.sse_poll_interval
+                    if idle >= keepalive:
+                        # Comment line keeps proxies from closing an idle connection
+                        await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                        idle = 0.0
+                    continue
+
+                idle = 0.0
+                event = f"event: progress\ndata: {json.dumps(snapshot)}\n\n"
+                if snapshot['state'] in ('finished', 'failed'):
+                    event += f"event: {snapshot['state']}\ndata: {json.dumps(snapshot)}\n\n"
+                    await send({'type': 'http.response.body', 'body': event.encode('utf-8')})
+                    return
+                await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        finally:
+            disconnect.cancel()
+
+
+application = AsgiApp(flask_app, threads=flask_app.config['ASGI_THREADS'])
@@ -0,0 +1,97 @@
+"""Load generator comparing FIFO and fair scheduling of download jobs
+
+Drives JobQueue directly with simulated jobs whose run time is proportional to the
+expected download size, so it needs neither network access nor yt-dlp. One heavy
+client floods the queue with HD downloads while light clients submit a mix of
+presets; the report shows p50/p99 job latency (submit to finish) per preset and
+per client group.
+
+    python benchmarks/bench_scheduler.py --workers 2 --heavy-jobs 30
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.job_queue import JobQueue
+from utils.scheduler import FairScheduler, FifoScheduler
+from utils.ytdlp_engine import FORMAT_PRESETS
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def expected_mb(format_id, duration):
+    return duration * FORMAT_PRESETS[format_id]['kbps'] * 1000 / 8 / (1024 * 1024)
+
+
+def run(policy, args):
+    scheduler = FairScheduler(aging=args.aging) if policy == 'fair' else FifoScheduler()
+    queue = JobQueue(max_workers=args.workers, max_pending=10000, scheduler=scheduler)
+    rng = random.Random(args.seed)
+    jobs = []
+
+    def submit(client, group, format_id):
+        duration = rng.uniform(120, 900)
+        cost = expected_mb(format_id, duration)
+        seconds = cost * args.seconds_per_mb
+        priority = FORMAT_PRESETS[format_id]['priority'] if policy == 'fair' else 0
+        job = queue.submit('download', lambda job: time.sleep(seconds) or {'success': True},
+                           client=client, priority=priority, cost=cost)
+        jobs.append((group, format_id, job))
+
+    # The heavy client queues all of its HD downloads at once
+    for _ in range(args.heavy_jobs):
+        submit('heavy', 'heavy', 'mp4-hd')
+
+    # Light clients keep arriving while the backlog drains
+    light_presets = ['mp3', 'mp3', 'mp4-sd', 'mp4-hd']
+    for index in range(args.light_jobs):
+        time.sleep(args.arrival_interval)
+        submit(f'light-{index % args.light_clients}', 'light', rng.choice(light_presets))
+
+    deadline = time.time() + args.timeout
+    while time.time() < deadline and not all(job.is_done for _, _, job in jobs):
+        time.sleep(0.05)
+
+    results = {}
+    for group, format_id, job in jobs:
+        if job.is_done:
+            latency = job.finished_at - job.created_at
+            results.setdefault(f'{group}/{format_id}', []).append(latency)
+            results.setdefault(group, []).append(latency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--heavy-jobs', type=int, default=30)
+    parser.add_argument('--light-jobs', type=int, default=40)
+    parser.add_argument('--light-clients', type=int, default=5)
+    parser.add_argument('--arrival-interval', type=float, default=0.05, help='seconds between light submissions')
+    parser.add_argument('--seconds-per-mb', type=float, default=0.0005, help='simulated job time per expected MB')
+    parser.add_argument('--aging', type=float, default=60)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'policy':<6} {'group':<18} {'jobs':>5} {'p50 (s)':>9} {'p99 (s)':>9}")
+    for policy in ('fifo', 'fair'):
+        results = run(policy, args)
+        for group in sorted(results):
+            latencies = results[group]
+            print(f"{policy:<6} {group:<18} {len(latencies):>5} "
+                  f"{percentile(latencies, 0.5):>9.2f} {percentile(latencies, 0.99):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
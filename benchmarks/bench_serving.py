@@ -0,0 +1,172 @@
+"""Load generator comparing sync WSGI workers with the ASGI entry point under slow clients
+
+Starts each server command, creates a test file in the downloads folder and
+opens --slow-clients connections to /downloads that read it at a trickle, the
+way mobile clients on bad links do. While they are held open it times
+--probes requests to /api/health and reports how many succeeded and their
+p50/p99 latency. With sync workers every slow reader pins a worker, so the
+probes queue or time out; the ASGI server keeps answering.
+
+    python benchmarks/bench_serving.py --workers 4 --slow-clients 32
+
+Needs gunicorn and uvicorn installed; pass --server NAME='command' to compare
+other setups ({port} and {workers} are substituted).
+"""
+import os
+import time
+import uuid
+import shlex
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # gunicorn.conf.py sets threads = 8, which would turn -k sync into gthread
+    'gunicorn-sync': 'gunicorn -k sync --threads 1 -w {workers} -b 127.0.0.1:{port}',
+    'uvicorn-asgi': 'uvicorn asgi:application --host 127.0.0.1 --port {port}',
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def wait_for_server(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/api/health')
+            connection.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def slow_reader(port, file_id, stop, read_bytes, interval):
+    """Request a download and read it a few bytes at a time until told to stop"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A small receive window makes the server block on send, like a slow link would
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.settimeout(30)
+        sock.connect(('127.0.0.1', port))
+        sock.sendall(f"GET /downloads/{file_id} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1'))
+        while not stop.is_set():
+            if not sock.recv(read_bytes):
+                break
+            time.sleep(interval)
+        sock.close()
+    except OSError:
+        pass
+
+
+def probe(port, timeout):
+    """Time one /api/health request; returns seconds or None when it failed"""
+    started = time.perf_counter()
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        connection.request('GET', '/api/health')
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            return None
+    except OSError:
+        return None
+    return time.perf_counter() - started
+
+
+def run(name, command, args, file_id):
+    cmd = shlex.split(command.format(port=args.port, workers=args.workers))
+    server = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stop = threading.Event()
+    readers = []
+    try:
+        if not wait_for_server(args.port, args.startup_timeout):
+            print(f"{name}: server did not start ({command})")
+            return None
+
+        for _ in range(args.slow_clients):
+            reader = threading.Thread(target=slow_reader,
+                                      args=(args.port, file_id, stop, args.read_bytes, args.read_interval))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+        # Let the slow readers get their requests in and fill the socket buffers
+        time.sleep(args.settle)
+
+        latencies = []
+        failures = 0
+        for _ in range(args.probes):
+            latency = probe(args.port, args.probe_timeout)
+            if latency is None:
+                failures += 1
+            else:
+                latencies.append(latency)
+            time.sleep(args.probe_interval)
+        return latencies, failures
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', action='append', default=[], metavar='NAME=COMMAND',
+                        help='server to benchmark, may be repeated (default: gunicorn-sync and uvicorn-asgi)')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--workers', type=int, default=4, help='sync worker processes for gunicorn')
+    parser.add_argument('--slow-clients', type=int, default=32)
+    parser.add_argument('--file-mb', type=int, default=64, help='size of the test download')
+    parser.add_argument('--read-bytes', type=int, default=1024, help='bytes a slow client reads per step')
+    parser.add_argument('--read-interval', type=float, default=0.5, help='seconds between slow client reads')
+    parser.add_argument('--settle', type=float, default=3, help='seconds to wait before probing')
+    parser.add_argument('--probes', type=int, default=50)
+    parser.add_argument('--probe-interval', type=float, default=0.1)
+    parser.add_argument('--probe-timeout', type=float, default=5)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    servers = dict(SERVERS)
+    if args.server:
+        servers = dict(server.split('=', 1) for server in args.server)
+
+    # A file the download index finds by probing the downloads folder
+    file_id = f"bench-{uuid.uuid4()}"
+    path = os.path.join(ROOT, 'downloads', f"{file_id}.mp4")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.file_mb):
+            f.write(block)
+
+    try:
+        print(f"{'server':<16} {'slow':>5} {'ok':>5} {'failed':>7} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+        for name, command in servers.items():
+            result = run(name, command, args, file_id)
+            if result is None:
+                continue
+            latencies, failures = result
+            print(f"{name:<16} {args.slow_clients:>5} {len(latencies):>5} {failures:>7} "
+                  f"{percentile(latencies, 0.5) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Gunicorn configuration for production
+
+    gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master (preload_app) and every worker is forked
+from it. Tor and retention sweeps run exactly once, in a process the master
+forks before the workers; each worker attaches to that Tor. Download and stream
+cache indexes, video metadata and job state are shared between the workers
+through the SQLite file in SHARED_STATE_DB, so the worker count can be raised to
+the number of cores.
+"""
+import os
+import time
+import signal
+import multiprocessing
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Threads per worker; downloads and streams spend most of their time waiting on the network
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+
+_services_pid = None
+
+
+def on_starting(server):
+    """Fork the process running Tor and retention sweeps before any worker is forked
+
+    A plain fork, so it shares the Tor control passwords generated when the app
+    was loaded with the workers.
+    """
+    global _services_pid
+    import app
+
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            app.run_shared_services()
+        except BaseException:
+            server.log.exception("Shared services failed")
+            status = 1
+        finally:
+            # Never return into the arbiter's code in the child
+            os._exit(status)
+    _services_pid = pid
+    server.log.info(f"Started shared services (pid: {pid})")
+
+
+def post_fork(server, worker):
+    """Give this worker its own connections, start its background threads and attach it to the shared Tor"""
+    import app
+
+    # SQLite and pooled HTTP connections opened while the master loaded the app are not fork safe
+    app.reopen_connections()
+    app.create_app(shared_services=True, worker_count=server.num_workers)
+
+
+def on_exit(server):
+    """Stop the shared services, and with them Tor"""
+    if _services_pid is None:
+        return
+    try:
+        os.kill(_services_pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    deadline = time.time() + graceful_timeout
+    while time.time() < deadline:
+        try:
+            pid, _ = os.waitpid(_services_pid, os.WNOHANG)
+        except ChildProcessError:
+            # Already reaped by the arbiter
+            return
+        if pid:
+            return
+        time.sleep(0.2)
+    server.log.warning("Shared services did not stop in time, killing them")
+    os.kill(_services_pid, signal.SIGKILL)
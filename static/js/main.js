@@ -292,6 +292,7 @@ document.addEventListener("DOMContentLoaded", () => {
                                 <span class="format-name">${format.name}</span>
                                 <span class="format-quality">${format.quality}</span>
                             </button>
+                            <a class="small-button stream-link" href="/stream?url=${encodeURIComponent(data.url || urlInput.value)}&format=${format.id}">Stream now</a>
                         </form>
                     `,
                       )
@@ -320,7 +321,7 @@ document.addEventListener("DOMContentLoaded", () => {
         downloadButton.innerHTML = '<span class="spinner"></span> Processing...'
         downloadButton.disabled = true
 
-        // Send download request
+        // Send download request; the server queues a job and returns its ID
         fetch(downloadUrl, {
           method: "POST",
           body: formData,
@@ -328,30 +329,15 @@ document.addEventListener("DOMContentLoaded", () => {
           .then((response) => response.json())
           .then((data) => {
             console.log("Download response:", data)
-            if (data.success) {
-              // Create a hidden link and click it to start download
-              const downloadLink = document.createElement("a")
-              downloadLink.href = data.download_url
-              downloadLink.download = ""
-              document.body.appendChild(downloadLink)
-              downloadLink.click()
-              document.body.removeChild(downloadLink)
-
-              // Reset button
+            if (data.success && data.download_url) {
+              // Cached download, the file is ready immediately
+              startFileDownload(data.download_url)
               downloadButton.innerHTML = originalButtonText
               downloadButton.disabled = false
-
-              // Update Tor status if using Tor
-              if (data.using_tor) {
-                updateTorStatus()
-              }
+            } else if (data.success) {
+              watchDownloadJob(data.job_id, downloadButton, originalButtonText)
             } else {
-              // Check if it's a rate limiting issue
-              if (data.rate_limited) {
-                showRateLimitError(data.error, data.details, data.using_tor)
-              } else {
-                showError(data.error || "Error processing download")
-              }
+              showDownloadError(data)
               downloadButton.innerHTML = originalButtonText
               downloadButton.disabled = false
             }
@@ -366,6 +352,116 @@ document.addEventListener("DOMContentLoaded", () => {
     })
   }
 
+  // Follow a download job over Server-Sent Events, falling back to polling
+  function watchDownloadJob(jobId, downloadButton, originalButtonText) {
+    if (!window.EventSource) {
+      pollDownloadJob(jobId, downloadButton, originalButtonText)
+      return
+    }
+
+    const events = new EventSource(`/api/jobs/${jobId}/events`)
+    events.addEventListener("progress", (e) => {
+      const job = JSON.parse(e.data)
+      if (handleJobUpdate(job, downloadButton, originalButtonText)) {
+        events.close()
+      }
+    })
+    events.onerror = () => {
+      // Connection dropped before the job finished; keep following it by polling
+      console.warn("Job event stream closed, falling back to polling")
+      events.close()
+      pollDownloadJob(jobId, downloadButton, originalButtonText)
+    }
+  }
+
+  // Poll a download job until it finishes, then start the file download
+  function pollDownloadJob(jobId, downloadButton, originalButtonText) {
+    fetch(`/api/jobs/${jobId}`)
+      .then((response) => response.json())
+      .then((data) => {
+        if (!data.success) {
+          throw new Error(data.error || "Download job not found")
+        }
+
+        if (!handleJobUpdate(data.job, downloadButton, originalButtonText)) {
+          setTimeout(() => pollDownloadJob(jobId, downloadButton, originalButtonText), 1000)
+        }
+      })
+      .catch((error) => {
+        console.error("Download job error:", error)
+        showError("Error processing download: " + error.message)
+        downloadButton.innerHTML = originalButtonText
+        downloadButton.disabled = false
+      })
+  }
+
+  // Update the download button from a job snapshot; returns true once the job is done
+  function handleJobUpdate(job, downloadButton, originalButtonText) {
+    console.log("Download job status:", job)
+
+    if (job.state === "finished") {
+      startFileDownload(job.result.download_url)
+
+      // Reset button
+      downloadButton.innerHTML = originalButtonText
+      downloadButton.disabled = false
+
+      // Update Tor status if using Tor
+      if (job.result.using_tor) {
+        updateTorStatus()
+      }
+      return true
+    }
+
+    if (job.state === "failed") {
+      showDownloadError(job.error || {})
+      downloadButton.innerHTML = originalButtonText
+      downloadButton.disabled = false
+      return true
+    }
+
+    downloadButton.innerHTML = `<span class="spinner"></span> ${describeJobProgress(job)}`
+    return false
+  }
+
+  // Build the progress text shown on the download button
+  function describeJobProgress(job) {
+    if (job.state === "queued") return "Queued..."
+
+    const stages = {
+      download: "Downloading",
+      merge: "Merging",
+      transcode: "Converting",
+      remux: "Remuxing",
+      finalize: "Finishing",
+    }
+    let text = `${stages[job.stage] || "Processing"}...`
+    if (job.progress > 0) text += ` ${Math.round(job.progress)}%`
+    if (job.speed) text += ` · ${(job.speed / (1024 * 1024)).toFixed(1)} MB/s`
+    if (job.eta) text += ` · ${job.eta}s left`
+    return text
+  }
+
+  // Create a hidden link and click it to start download
+  function startFileDownload(url) {
+    const downloadLink = document.createElement("a")
+    downloadLink.href = url
+    downloadLink.download = ""
+    document.body.appendChild(downloadLink)
+    downloadLink.click()
+    document.body.removeChild(downloadLink)
+  }
+
+  // Show the error for a failed download
+  function showDownloadError(data) {
+    // Check if it's a rate limiting issue
+    if (data.rate_limited) {
+      showRateLimitError(data.error, data.details, data.using_tor)
+    } else {
+      showError(data.error || "Error processing download")
+    }
+  }
+
   // Show error function
   function showError(message) {
     console.error("Error:", message)
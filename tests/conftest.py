@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Make the application modules importable when pytest runs from the repository root
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app module, imported in a scratch directory
+
+    app.py creates its downloads folder, state database and log file relative to
+    the working directory, so the tests run from a temporary one.
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app
+    app.app.config['USE_TOR'] = False
+    app.app.config['TESTING'] = True
+    yield app
+    os.chdir(cwd)
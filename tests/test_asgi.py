@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def asgi_module(app_module):
+    import asgi
+    return asgi
+
+
+def call(application, path):
+    """Run one GET request through the ASGI app and return the sent messages"""
+    messages = []
+
+    async def receive():
+        # The client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': []}
+    asyncio.run(asyncio.wait_for(application(scope, receive, send), timeout=5))
+    return messages
+
+
+def test_job_events_read_jobs_off_the_event_loop(asgi_module, monkeypatch):
+    threads = []
+
+    class SharedDatabaseJob:
+        """Stands in for a RemoteJob, whose reads are blocking SQLite queries"""
+
+        def wait_for_change(self, version, timeout=None):
+            threads.append(threading.current_thread().name)
+            if version == -1:
+                return 1, {'id': 'job1', 'state': 'running', 'progress': 50.0}
+            return 2, {'id': 'job1', 'state': 'finished', 'progress': 100.0}
+
+    def get(job_id):
+        threads.append(threading.current_thread().name)
+        return SharedDatabaseJob()
+
+    monkeypatch.setattr(asgi_module.job_queue, 'get', get)
+    messages = call(asgi_module.application, '/api/jobs/job1/events')
+
+    body = b''.join(message.get('body', b'') for message in messages)
+    assert messages[0]['status'] == 200
+    assert b'event: progress' in body and b'event: finished' in body
+    assert len(threads) == 3
+    assert all(name.startswith('asgi') for name in threads)
+
+
+def test_job_events_unknown_job(asgi_module, monkeypatch):
+    monkeypatch.setattr(asgi_module.job_queue, 'get', lambda job_id: None)
+    messages = call(asgi_module.application, '/api/jobs/missing/events')
+    assert messages[0]['status'] == 404
@@ -0,0 +1,26 @@
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'urls': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'format': 'mp3'}, 'urls must be a list of strings'),
+    ({'urls': ['https://www.youtube.com/watch?v=dQw4w9WgXcQ', 42], 'format': 'mp3'},
+     'urls must be a list of strings'),
+    ({'urls': {'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'}, 'format': 'mp3'},
+     'urls must be a list of strings'),
+    ({'url': ['https://www.youtube.com/playlist?list=PL1'], 'format': 'mp3'}, 'url must be a string'),
+    (['https://www.youtube.com/watch?v=dQw4w9WgXcQ'], 'Request body must be a JSON object'),
+])
+def test_batch_rejects_malformed_urls(client, body, error):
+    response = client.post('/api/batch', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == error
+
+
+def test_resolve_batch_urls_keeps_list_order_and_limit(app_module):
+    urls = [' https://youtu.be/a ', '', 'https://youtu.be/b', 'https://youtu.be/c']
+    assert app_module.resolve_batch_urls({'urls': urls, 'limit': 2}) == ['https://youtu.be/a', 'https://youtu.be/b']
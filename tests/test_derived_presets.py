@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+from utils.stream_cache import StreamCache
+from utils.ytdlp_engine import get_ytdlp_engine
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+
+
+def make_format(format_id, ext, vcodec='none', acodec='none', height=None, tbr=None):
+    return {'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec, 'height': height,
+            'tbr': tbr, 'url': f'https://example.invalid/{format_id}', 'protocol': 'https'}
+
+
+# The formats YouTube typically offers: progressive 360p, split H.264 video, AAC and opus audio
+INFO = {
+    'id': VIDEO_ID,
+    'title': 'Test video',
+    'duration': 10,
+    'formats': [
+        make_format('18', 'mp4', vcodec='avc1.42001E', acodec='mp4a.40.2', height=360, tbr=500),
+        make_format('135', 'mp4', vcodec='avc1.4d401e', height=480, tbr=1000),
+        make_format('137', 'mp4', vcodec='avc1.640028', height=1080, tbr=4000),
+        make_format('140', 'm4a', acodec='mp4a.40.2', tbr=129),
+        make_format('251', 'webm', acodec='opus', tbr=160),
+    ],
+}
+
+
+@pytest.mark.parametrize('format_id', ['mp4-hd', 'mp4-sd', 'mp3'])
+def test_every_preset_selects_the_same_audio(format_id):
+    streams = get_ytdlp_engine().select_streams(INFO, format_id)
+    audio = [stream['format_id'] for stream in streams if stream['acodec'] != 'none']
+    assert audio == ['140']
+
+
+@pytest.fixture
+def fetches(app_module, tmp_path, monkeypatch):
+    """Record stream downloads, with yt-dlp and ffmpeg replaced by stand-ins writing files"""
+    fetched = []
+
+    def download_stream(url, stream, output_path, **kwargs):
+        fetched.append(stream['format_id'])
+        path = f"{output_path}.{stream['ext']}"
+        with open(path, 'wb') as f:
+            f.write(stream['format_id'].encode('ascii'))
+        return {'filepath': path}
+
+    def derive_output(inputs, format_id, output_path, **kwargs):
+        path = f"{output_path}.{app_module.FORMAT_PRESETS[format_id]['ext']}"
+        with open(path, 'wb') as f:
+            f.write(b'derived')
+        return path, {'path': 'copy', 'cpu_seconds': None}
+
+    monkeypatch.setitem(app_module.app.config, 'DOWNLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(app_module, 'stream_cache', StreamCache(str(tmp_path / '.streams')))
+    monkeypatch.setattr(app_module.ytdlp_engine, 'download_stream', download_stream)
+    monkeypatch.setattr(app_module, 'derive_output', derive_output)
+    return fetched
+
+
+def derive(app_module, tmp_path, format_id):
+    output_path = os.path.join(str(tmp_path), f'out-{format_id}')
+    return app_module.download_derived(URL, VIDEO_ID, format_id, output_path, INFO,
+                                                 lambda *args: None)
+
+
+def test_mp3_after_mp4_hd_fetches_nothing(app_module, tmp_path, fetches):
+    derive(app_module, tmp_path, 'mp4-hd')
+    assert fetches == ['137', '140']
+
+    fetches.clear()
+    info = derive(app_module, tmp_path, 'mp3')
+    assert fetches == []
+    assert os.path.exists(info['filepath'])
+
+
+def test_mp4_sd_after_mp3_fetches_only_video(app_module, tmp_path, fetches):
+    derive(app_module, tmp_path, 'mp3')
+    assert fetches == ['140']
+
+    fetches.clear()
+    derive(app_module, tmp_path, 'mp4-sd')
+    assert fetches == ['135']
+
+
+@pytest.mark.parametrize('url, stream_cache_enabled', [
+    (URL, False),
+    # Not an 11-character ID, so it bypasses the stream cache
+    ('https://www.youtube.com/shorts/abc', True),
+])
+def test_direct_downloads_derive_with_supervised_ffmpeg(app_module, tmp_path, fetches, monkeypatch, url,
+                                                        stream_cache_enabled):
+    from utils.job_queue import Job
+
+    derived = []
+    original_derive = app_module.derive_output
+
+    def derive_output(inputs, format_id, output_path, **kwargs):
+        derived.append([os.path.exists(path) for path, _ in inputs])
+        return original_derive(inputs, format_id, output_path, **kwargs)
+
+    def unsupervised_download(*args, **kwargs):
+        raise AssertionError('yt-dlp postprocessors must not run ffmpeg')
+
+    monkeypatch.setattr(app_module, 'derive_output', derive_output)
+    monkeypatch.setattr(app_module.ytdlp_engine, 'download', unsupervised_download)
+    monkeypatch.setattr(app_module, 'get_video_metadata', lambda url, max_wait=None: INFO)
+    monkeypatch.setitem(app_module.app.config, 'STREAM_CACHE_ENABLED', stream_cache_enabled)
+    monkeypatch.setitem(app_module.app.config, 'DOWNLOAD_CACHE_ENABLED', False)
+
+    result = app_module.run_download_job(Job('download'), url, 'mp4-hd')
+
+    assert result['success'], result
+    assert fetches == ['137', '140']
+    assert derived == [[True, True]]
+    # Temporary streams are removed and nothing went into the stream cache
+    assert sorted(os.listdir(tmp_path)) == ['.streams', f"{result['file_id']}.mp4"]
+    assert os.listdir(tmp_path / '.streams') == []
@@ -0,0 +1,86 @@
+import time
+import threading
+
+import pytest
+
+from utils.job_queue import Job, JobQueue, NotJobWaiterError
+from utils.worker_pool import PoolSaturatedError
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+def wait_done(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.is_done and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def saturated_then(app_module, monkeypatch, failures, result):
+    calls = []
+
+    def run_download_job(job, url, format_id):
+        calls.append(time.time())
+        if len(calls) <= failures:
+            raise PoolSaturatedError('media pool is full', retry_after=0.05)
+        return result
+
+    monkeypatch.setattr(app_module, 'run_download_job', run_download_job)
+    return calls
+
+
+def test_queued_job_waits_for_saturated_media_pool(app_module, monkeypatch):
+    calls = saturated_then(app_module, monkeypatch, 2, {'success': True, 'file_id': 'abc'})
+    queue = JobQueue(max_workers=1)
+    job = queue.submit('download', lambda job: app_module.run_download_job_when_ready(job, URL, 'mp3'))
+
+    assert wait_done(job).state == Job.FINISHED
+    assert job.result['file_id'] == 'abc'
+    assert len(calls) == 3
+    assert calls[2] - calls[0] >= 0.1
+
+
+def test_cancelled_while_waiting_for_media_pool(app_module, monkeypatch):
+    saturated_then(app_module, monkeypatch, 1000, {'success': True})
+    queue = JobQueue(max_workers=1)
+    job = queue.submit('download', lambda job: app_module.run_download_job_when_ready(job, URL, 'mp3'))
+    time.sleep(0.1)
+    queue.cancel(job.id)
+
+    assert wait_done(job).state == Job.FAILED
+
+
+def test_batch_item_gives_up_after_attempts(app_module, monkeypatch):
+    calls = saturated_then(app_module, monkeypatch, 1000, {'success': True})
+    monkeypatch.setitem(app_module.app.config, 'DOWNLOAD_CACHE_ENABLED', False)
+    result = app_module.run_batch_item(URL, 'mp3', threading.Event(), attempts=3)
+
+    assert result['success'] is False
+    assert len(calls) == 3
+
+
+def coalesced_job(queue, release):
+    submit = lambda client: queue.submit('download', lambda job: release.wait(5) and job.cancel_event.is_set(),
+                                         dedupe_key=('dQw4w9WgXcQ', 'download', 'mp3'), client=client)
+    first, second = submit('10.0.0.1'), submit('10.0.0.2')
+    assert first is second
+    return first
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_cancel_only_stops_job_when_last_waiter_leaves(tmp_path, shared):
+    queue = JobQueue(max_workers=1, db_path=str(tmp_path / 'state.db') if shared else None)
+    release = threading.Event()
+    job = coalesced_job(queue, release)
+
+    with pytest.raises(NotJobWaiterError):
+        queue.cancel(job.id, client='10.0.0.3')
+    queue.cancel(job.id, client='10.0.0.1')
+    assert not job.cancel_event.is_set()
+    with pytest.raises(NotJobWaiterError):
+        queue.cancel(job.id, client='10.0.0.1')
+
+    queue.cancel(job.id, client='10.0.0.2')
+    assert job.cancel_event.is_set()
+    release.set()
+    assert wait_done(job).is_done
@@ -0,0 +1,43 @@
+import sys
+
+import pytest
+
+from utils import media_stream
+from utils.media_stream import STREAM_PRESETS, build_stream_command
+from utils.process_supervisor import get_process_supervisor
+
+
+@pytest.mark.parametrize('format_id', ['mp4-hd', 'mp4-sd'])
+def test_video_presets_mux_separate_streams_into_fragmented_mp4(format_id):
+    cmd = build_stream_command('https://www.youtube.com/watch?v=dQw4w9WgXcQ', format_id)
+    selector = cmd[cmd.index('-f') + 1]
+    # Separate video and audio first; progressive formats only as a fallback
+    assert selector.split('/')[0].startswith('bestvideo[') and '+bestaudio' in selector.split('/')[0]
+
+    ffmpeg = STREAM_PRESETS[format_id]['transcode']
+    assert ffmpeg[ffmpeg.index('-movflags') + 1] == 'frag_keyframe+empty_moov'
+    assert ffmpeg[ffmpeg.index('-c') + 1] == 'copy'
+    assert ffmpeg[-1] == 'pipe:1'
+
+
+def test_failed_ffmpeg_spawn_kills_and_reaps_downloader(monkeypatch):
+    supervisor = get_process_supervisor()
+    spawned = []
+    spawn = supervisor.spawn
+
+    def spawn_or_fail(cmd, kind, **kwargs):
+        if kind == 'ffmpeg':
+            raise FileNotFoundError('ffmpeg')
+        spawned.append(spawn(cmd, kind, **kwargs))
+        return spawned[-1]
+
+    monkeypatch.setattr(media_stream, 'build_stream_command',
+                        lambda *args, **kwargs: [sys.executable, '-c', 'import time; time.sleep(30)'])
+    monkeypatch.setattr(supervisor, 'spawn', spawn_or_fail)
+    with pytest.raises(FileNotFoundError):
+        media_stream.MediaStream('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'mp4-hd')
+
+    downloader, = spawned
+    assert downloader.popen.returncode is not None
+    assert downloader.popen.stdout.closed and downloader.popen.stderr.closed
+    assert downloader not in supervisor.processes
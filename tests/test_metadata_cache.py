@@ -0,0 +1,66 @@
+import json
+
+from utils.metadata_cache import MetadataCache, trim_info
+from utils.ytdlp_engine import get_ytdlp_engine
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+
+
+def full_info():
+    """An info dict shaped like yt-dlp's, with the bulky parts the app never reads"""
+    def make_format(format_id, ext, vcodec='none', acodec='none', height=None, **extra):
+        return dict({'format_id': format_id, 'ext': ext, 'vcodec': vcodec, 'acodec': acodec, 'height': height,
+                     'url': f'https://example.invalid/{format_id}', 'protocol': 'https',
+                     'http_headers': {'User-Agent': 'test'}}, **extra)
+
+    captions = [{'ext': ext, 'url': f'https://example.invalid/captions/{ext}'}
+                for ext in ('json3', 'srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+    return {
+        'id': VIDEO_ID,
+        'title': 'Test video',
+        'duration': 212,
+        'thumbnail': 'https://example.invalid/thumb.jpg',
+        'uploader': 'Uploader',
+        'view_count': 1000,
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'webpage_url': f'https://www.youtube.com/watch?v={VIDEO_ID}',
+        'description': 'x' * 5000,
+        'thumbnails': [{'url': f'https://example.invalid/thumb{index}.jpg'} for index in range(40)],
+        'automatic_captions': {f'lang{index}': captions for index in range(150)},
+        'formats': [
+            make_format('sb0', 'mhtml', format_note='storyboard',
+                        fragments=[{'url': f'https://example.invalid/sb/{index}'} for index in range(100)]),
+            make_format('137', 'mp4', vcodec='avc1.640028', height=1080, tbr=4000,
+                        downloader_options={'http_chunk_size': 10485760}),
+            make_format('140', 'm4a', acodec='mp4a.40.2', tbr=129, audio_ext='m4a', preference=None),
+        ],
+    }
+
+
+def test_trim_keeps_what_the_app_and_selection_use():
+    info = full_info()
+    trimmed = trim_info(info)
+
+    for key in ('id', 'title', 'duration', 'thumbnail', 'uploader', 'view_count', 'webpage_url'):
+        assert trimmed[key] == info[key]
+    assert [f['format_id'] for f in trimmed['formats']] == ['137', '140']
+    assert 'automatic_captions' not in trimmed and 'thumbnails' not in trimmed
+    assert len(json.dumps(trimmed)) < len(json.dumps(info)) / 20
+
+    streams = get_ytdlp_engine().select_streams(trimmed, 'mp4-hd')
+    assert [stream['format_id'] for stream in streams] == ['137', '140']
+    assert streams[0]['url'] == 'https://example.invalid/137'
+
+
+def test_cache_stores_trimmed_info_in_both_tiers(tmp_path):
+    db_path = str(tmp_path / 'state.db')
+    cache = MetadataCache(db_path=db_path)
+    cache.put(VIDEO_ID, full_info())
+
+    assert 'automatic_captions' not in cache.get(VIDEO_ID)
+    stored = cache.db.execute('SELECT info FROM metadata WHERE video_id = ?', (VIDEO_ID,))[0][0]
+    assert len(stored) < 2000
+
+    other_worker = MetadataCache(db_path=db_path)
+    assert other_worker.get(VIDEO_ID) == cache.get(VIDEO_ID)
@@ -0,0 +1,42 @@
+import os
+import time
+
+import pytest
+
+from utils.download_cache import DownloadCache
+from utils.retention import RetentionSweeper
+
+UPLOAD_DATE = time.time() - 10 * 365 * 24 * 60 * 60
+
+
+def downloaded_file(folder, name):
+    """A finished download whose mtime is the video's upload date, as yt-dlp's updatetime leaves it"""
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * 1024)
+    os.utime(path, (UPLOAD_DATE, UPLOAD_DATE))
+    return path
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_fresh_download_with_old_mtime_survives_age_sweep(tmp_path, shared):
+    folder = str(tmp_path / 'downloads')
+    cache = DownloadCache(folder, db_path=str(tmp_path / 'state.db') if shared else None)
+    sweeper = RetentionSweeper(folder, cache, max_age=60 * 60)
+
+    cache.register_file('direct-download', downloaded_file(folder, 'direct-download.mp4'))
+    cached = downloaded_file(folder, 'cached.mp3')
+    cache.put('dQw4w9WgXcQ', 'mp3', cached, 'Test video')
+    report = sweeper.sweep()
+
+    assert report['deleted'] == []
+    assert os.path.exists(os.path.join(folder, 'direct-download.mp4'))
+
+
+def test_unknown_file_with_old_mtime_is_age_swept(tmp_path):
+    folder = str(tmp_path / 'downloads')
+    cache = DownloadCache(folder)
+    sweeper = RetentionSweeper(folder, cache, max_age=60 * 60)
+    downloaded_file(folder, 'leftover.mp4')
+
+    assert [item['reason'] for item in sweeper.sweep()['deleted']] == ['age']
@@ -0,0 +1,79 @@
+import os
+import traceback
+
+import pytest
+
+from utils import shared_db
+from utils.shared_db import SharedDatabase, reopen_shared_databases
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS items (name TEXT NOT NULL)',)
+
+
+def in_child(check):
+    """Run check() in a forked child process and fail if it raised"""
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            check()
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def test_child_never_uses_parent_connection(tmp_path):
+    db = SharedDatabase(str(tmp_path / 'state.db'), schema=SCHEMA)
+    db.execute('INSERT INTO items (name) VALUES (?)', ('parent',))
+    parent_connection = db.connection
+
+    def check():
+        reopen_shared_databases()
+        assert db.connection is None
+        db.execute('INSERT INTO items (name) VALUES (?)', ('child',))
+        assert db.connection is not parent_connection
+        # Kept alive, not closed, in the child
+        assert any(connection is parent_connection for connection in shared_db._inherited)
+
+    in_child(check)
+
+    assert db.connection is parent_connection
+    assert sorted(row[0] for row in db.execute('SELECT name FROM items')) == ['child', 'parent']
+
+
+def test_child_without_reopen_still_gets_its_own_connection(tmp_path):
+    db = SharedDatabase(str(tmp_path / 'state.db'), schema=SCHEMA)
+    db.execute('INSERT INTO items (name) VALUES (?)', ('parent',))
+    parent_connection = db.connection
+
+    def check():
+        assert db.execute('SELECT COUNT(*) FROM items')[0][0] == 1
+        assert db.connection is not parent_connection
+
+    in_child(check)
+
+
+def test_app_reopen_connections_after_fork(app_module):
+    # Loading the app in the parent has already opened the shared state database
+    app_module.metadata_cache.put('dQw4w9WgXcQ', {'id': 'dQw4w9WgXcQ', 'title': 'Parent'})
+    parent_connection = app_module.metadata_cache.db.connection
+    pool = app_module.get_http_pool()
+    pool.get_session(None)
+
+    def check():
+        app_module.reopen_connections()
+        assert pool.sessions == {}
+        for cache in (app_module.metadata_cache, app_module.download_cache, app_module.stream_cache):
+            assert cache.db.connection is None or cache.db.pid == os.getpid()
+        app_module.metadata_cache.put('9bZkp7q19f0', {'id': '9bZkp7q19f0', 'title': 'Child'})
+        assert app_module.metadata_cache.db.connection is not parent_connection
+
+    in_child(check)
+    assert app_module.metadata_cache.db.connection is parent_connection
+    assert app_module.metadata_cache.db.execute(
+        'SELECT COUNT(*) FROM metadata WHERE video_id = ?', ('9bZkp7q19f0',))[0][0] == 1
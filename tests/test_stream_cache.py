@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from utils.stream_cache import StreamCache
+
+
+def make_stream(folder, name='part.mp4', data=b'media'):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_put_and_get(tmp_path):
+    cache = StreamCache(str(tmp_path / 'streams'))
+    path = cache.put('dQw4w9WgXcQ', '140', make_stream(str(tmp_path), 'audio.m4a'))
+
+    assert os.path.dirname(path) == str(tmp_path / 'streams')
+    assert cache.get('dQw4w9WgXcQ', '140') == path
+
+
+@pytest.mark.parametrize('video_id', [
+    '../../../etc/passwd',
+    '../outside',
+    '/tmp/absolute',
+    'abc/../../x',
+    'dQw4w9WgXcQ/..',
+    '',
+    None,
+])
+def test_put_rejects_malicious_video_id(tmp_path, video_id):
+    cache = StreamCache(str(tmp_path / 'streams'))
+    source = make_stream(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        cache.put(video_id, '140', source)
+
+    # Nothing was moved or written outside the cache folder
+    assert os.path.exists(source)
+    assert sorted(os.listdir(tmp_path)) == ['part.mp4', 'streams']
+    assert cache.get(video_id, '140') is None
+
+
+def test_format_id_and_extension_are_sanitized(tmp_path):
+    cache = StreamCache(str(tmp_path / 'streams'))
+    path = cache.put('dQw4w9WgXcQ', '../137', make_stream(str(tmp_path)))
+
+    assert os.path.realpath(path).startswith(os.path.realpath(str(tmp_path / 'streams')) + os.sep)
+
+
+def test_shared_database_tier(tmp_path):
+    db_path = str(tmp_path / 'state.db')
+    writer = StreamCache(str(tmp_path / 'streams'), db_path=db_path)
+    path = writer.put('dQw4w9WgXcQ', '137', make_stream(str(tmp_path), 'video.mp4'))
+
+    reader = StreamCache(str(tmp_path / 'streams'), db_path=db_path)
+    assert reader.get('dQw4w9WgXcQ', '137') == path
+    reader.unpin('dQw4w9WgXcQ', '137')
@@ -0,0 +1,101 @@
+import pytest
+
+from utils import media_stream
+from utils.worker_pool import SlotPool, PoolSaturatedError
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+
+class FakeStream:
+    def __init__(self):
+        self.bytes_sent = 0
+        self.callbacks = []
+
+    def __iter__(self):
+        yield b'chunk'
+
+    def on_close(self, callback):
+        self.callbacks.append(callback)
+
+    def close(self):
+        for callback in self.callbacks:
+            callback()
+
+
+class StartedStream(FakeStream):
+    def start(self):
+        return self
+
+
+def test_slot_pool_rejects_when_full():
+    pool = SlotPool('stream', 2, retry_after=7)
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(PoolSaturatedError) as error:
+        pool.acquire()
+    assert error.value.retry_after == 7
+
+    first()
+    first()  # releasing twice frees one slot only
+    pool.acquire()
+    assert pool.stats()['active'] == 2 and pool.stats()['rejected'] == 1
+    second()
+
+
+@pytest.fixture
+def slots(app_module, monkeypatch):
+    pool = SlotPool('stream', 2, retry_after=5)
+    monkeypatch.setattr(app_module, 'stream_slots', pool)
+    return pool
+
+
+def test_start_stream_holds_slot_until_close(app_module, slots):
+    opened = []
+
+    def opener(url, format_id, **kwargs):
+        opened.append(FakeStream())
+        return opened[-1]
+
+    with app_module.app.app_context():
+        streams = [app_module.start_stream(URL, 'mp3', opener=opener)[0] for _ in range(2)]
+        stream, error = app_module.start_stream(URL, 'mp3', opener=opener)
+
+    assert stream is None
+    assert error.status_code == 503
+    assert error.headers['Retry-After'] == '5'
+    # The saturated request never started a pipeline
+    assert len(opened) == 2
+
+    streams[0].close()
+    with app_module.app.app_context():
+        stream, error = app_module.start_stream(URL, 'mp3', opener=opener)
+    assert error is None and slots.stats()['active'] == 2
+
+
+def test_failed_stream_start_frees_its_slot(app_module, slots):
+    def opener(url, format_id, **kwargs):
+        raise FileNotFoundError('yt-dlp')
+
+    with app_module.app.app_context():
+        for _ in range(3):
+            with pytest.raises(FileNotFoundError):
+                app_module.start_stream(URL, 'mp3', opener=opener)
+    assert slots.stats()['active'] == 0
+
+
+def test_stream_route_returns_503_when_saturated(app_module, slots, monkeypatch):
+    monkeypatch.setattr(app_module, 'check_stream_request', lambda url, format_id, video_id: None)
+    # open_media_stream() builds its pipeline from this class
+    monkeypatch.setattr(media_stream, 'MediaStream', lambda *args, **kwargs: StartedStream())
+    held = [slots.acquire() for _ in range(2)]
+
+    response = app_module.app.test_client().get('/stream', query_string={'url': URL, 'format': 'mp3'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+    held[0]()
+    response = app_module.app.test_client().get('/stream', query_string={'url': URL, 'format': 'mp3'})
+    assert response.status_code == 200
+    assert response.data == b'chunk'
+    response.close()
+    # The finished stream gave its slot back; only the one still held here remains
+    assert slots.stats()['active'] == 1
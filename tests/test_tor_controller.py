@@ -0,0 +1,37 @@
+from utils.http_pool import get_http_pool
+from utils.tor_controller import TorController
+
+
+class FakeControlConnection:
+    """Stand-in for a stem Controller that builds a new circuit on NEWNYM"""
+
+    def __init__(self, tor):
+        self.tor = tor
+        self.signals = []
+
+    def is_alive(self):
+        return True
+
+    def is_newnym_available(self):
+        return True
+
+    def signal(self, signal):
+        self.signals.append(signal)
+        with self.tor.circuit_changed:
+            circuit_id = str(len(self.tor.circuits) + 1)
+            self.tor.circuits[circuit_id] = f'RELAY{circuit_id}'
+            self.tor.exit_addresses[f'RELAY{circuit_id}'] = f'203.0.113.{circuit_id}'
+            self.tor.circuit_changed.notify_all()
+
+
+def test_rotation_keeps_pooled_session(tmp_path):
+    tor = TorController(tor_port=19050, control_port=19051, data_dir=str(tmp_path))
+    tor.controller = FakeControlConnection(tor)
+    pool = get_http_pool()
+    session = pool.get_session(tor.get_proxy_url())
+
+    assert tor.renew_tor_ip() == '203.0.113.1'
+    assert tor.renew_tor_ip() == '203.0.113.2'
+
+    assert len(tor.controller.signals) == 2
+    assert pool.get_session(tor.get_proxy_url()) is session
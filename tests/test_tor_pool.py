@@ -0,0 +1,163 @@
+import socket
+import struct
+import threading
+import socketserver
+
+import pytest
+import requests
+
+from utils.tor_controller import TorController
+from utils.tor_pool import TorPool
+
+
+class _SocksHandler(socketserver.BaseRequestHandler):
+    """Minimal SOCKS5 server that answers every CONNECT itself with a small HTTP response"""
+
+    def _read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('client went away')
+            data += chunk
+        return data
+
+    def handle(self):
+        try:
+            _, methods = self._read(2)
+            self._read(methods)
+            self.request.sendall(b'\x05\x00')  # no authentication
+
+            _, command, _, address_type = self._read(4)
+            if address_type == 1:
+                self._read(4)
+            elif address_type == 3:
+                self._read(self._read(1)[0])
+            else:
+                self._read(16)
+            self._read(2)
+            if command != 1:
+                self.request.sendall(b'\x05\x07\x00\x01' + bytes(6))
+                return
+            self.request.sendall(b'\x05\x00\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', 0))
+
+            request = b''
+            while b'\r\n\r\n' not in request:
+                request += self.request.recv(4096)
+            self.server.connections += 1
+            body = self.server.name.encode('ascii')
+            self.request.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s'
+                                 % (len(body), body))
+        except (ConnectionError, OSError, ValueError):
+            pass
+
+
+class SocksEndpoint(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, name):
+        super().__init__(('127.0.0.1', 0), _SocksHandler)
+        self.name = name
+        self.connections = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@pytest.fixture
+def endpoints():
+    servers = [SocksEndpoint(f'tor{index}') for index in range(2)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def pool(endpoints, tmp_path):
+    controllers = []
+    for index, endpoint in enumerate(endpoints):
+        controller = TorController(tor_port=endpoint.port, control_port=endpoint.port + 1,
+                                   data_dir=str(tmp_path / f'tor{index}'))
+        controller.ready_event.set()
+        controllers.append(controller)
+    return TorPool(controllers)
+
+
+def fetch(lease):
+    proxy = lease.proxy_url
+    return requests.get('http://video.invalid/', proxies={'http': proxy, 'https': proxy}, timeout=5).text
+
+
+def test_concurrent_leases_spread_over_endpoints(pool, endpoints):
+    leases = [pool.acquire() for _ in range(4)]
+    names = sorted(fetch(lease) for lease in leases)
+
+    assert names == ['tor0', 'tor0', 'tor1', 'tor1']
+    assert [endpoint.connections for endpoint in endpoints] == [2, 2]
+
+    for lease in leases:
+        lease.release(1024)
+    assert [instance.in_flight for instance in pool.instances] == [0, 0]
+
+
+def test_faster_endpoint_gets_more_leases(pool):
+    fast, slow = pool.acquire(), pool.acquire()
+    assert (fetch(fast), fetch(slow)) == ('tor0', 'tor1')
+    fast.started -= 1
+    slow.started -= 1
+    fast.release(10 * 1024 * 1024)
+    slow.release(1024)
+
+    leases = [pool.acquire() for _ in range(3)]
+    assert [lease.instance.index for lease in leases] == [0, 0, 0]
+
+
+def test_start_stream_releases_lease_when_opener_fails(app_module, pool, monkeypatch):
+    monkeypatch.setattr(app_module, 'tor_pool', pool)
+    monkeypatch.setitem(app_module.app.config, 'USE_TOR', True)
+
+    def opener(url, format_id, proxy=None, **kwargs):
+        raise FileNotFoundError('yt-dlp')
+
+    with app_module.app.app_context(), pytest.raises(FileNotFoundError):
+        app_module.start_stream('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'mp3', opener=opener)
+
+    assert [instance.in_flight for instance in pool.instances] == [0, 0]
+    assert sum(instance.failures for instance in pool.instances) == 1
+
+
+def test_start_stream_holds_lease_until_stream_closes(app_module, pool, endpoints, monkeypatch):
+    monkeypatch.setattr(app_module, 'tor_pool', pool)
+    monkeypatch.setitem(app_module.app.config, 'USE_TOR', True)
+
+    class FakeStream:
+        def __init__(self, body):
+            self.bytes_sent = len(body)
+            self.callbacks = []
+
+        def on_close(self, callback):
+            self.callbacks.append(callback)
+
+        def close(self):
+            for callback in self.callbacks:
+                callback()
+
+    def opener(url, format_id, proxy=None, **kwargs):
+        # The pipeline's traffic goes through the leased endpoint
+        body = requests.get('http://video.invalid/', proxies={'http': proxy}, timeout=5).content
+        return FakeStream(body)
+
+    with app_module.app.app_context():
+        stream, error = app_module.start_stream('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'mp3',
+                                                opener=opener)
+    assert error is None
+    assert sum(endpoint.connections for endpoint in endpoints) == 1
+    assert sum(instance.in_flight for instance in pool.instances) == 1
+
+    stream.close()
+    assert [instance.in_flight for instance in pool.instances] == [0, 0]
+    assert sum(instance.bytes for instance in pool.instances) == 4
@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from utils.shared_db import SharedDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """Content-addressed cache of finished downloads keyed by (video ID, format preset)
+
+    The index is a JSON file, or with db_path a SQLite database that every worker
+    process serving the same download folder reads and writes.
+    """
+
+    INDEX_FILE = '.cache_index.json'
+
+    def __init__(self, download_folder, max_bytes=5 * 1024 * 1024 * 1024, db_path=None):
+        self.download_folder = download_folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(download_folder, self.INDEX_FILE)
+        self.entries = {}
+        self.files = {}  # file ID -> served file info, covers cached and uncached downloads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+        if db_path:
+            self.db = SharedDatabase(db_path, schema=(
+                'CREATE TABLE IF NOT EXISTS downloads ('
+                'key TEXT PRIMARY KEY, file_id TEXT NOT NULL, entry TEXT NOT NULL, last_access REAL NOT NULL)',
+                'CREATE TABLE IF NOT EXISTS served (file_id TEXT PRIMARY KEY, last_served REAL NOT NULL)',
+            ))
+
+        os.makedirs(download_folder, exist_ok=True)
+        self._load_index()
+        logger.info(f"Loaded {len(self.entries)} cached downloads")
+
+    @staticmethod
+    def make_file_id(video_id, format_id):
+        """Derive the stable file ID used for a cached download"""
+        return hashlib.sha256(f"{video_id}:{format_id}".encode('utf-8')).hexdigest()[:32]
+
+    def _file_path(self, entry):
+        return os.path.join(self.download_folder, f"{entry['file_id']}.{entry['ext']}")
+
+    def _load_index(self):
+        """Load the persisted index, dropping entries whose files are gone"""
+        if self.db is not None:
+            self._refresh()
+            return
+
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable download cache index: {e}")
+            return
+
+        for key, entry in entries.items():
+            if os.path.exists(self._file_path(entry)):
+                self.entries[key] = entry
+                self._register(entry['file_id'], self._file_path(entry), cached=True)
+
+    def _entry_from_row(self, entry, last_access):
+        entry = json.loads(entry)
+        entry['last_access'] = last_access
+        return entry
+
+    def _refresh(self):
+        """Replace the in-memory index with the shared one, which other workers also update"""
+        entries = {}
+        for key, entry, last_access in self.db.execute('SELECT key, entry, last_access FROM downloads'):
+            entry = self._entry_from_row(entry, last_access)
+            if os.path.exists(self._file_path(entry)):
+                entries[key] = entry
+                if entry['file_id'] not in self.files:
+                    self._register(entry['file_id'], self._file_path(entry), cached=True)
+        self.entries = entries
+
+    def _save_entry(self, key):
+        """Persist one new or changed entry"""
+        if self.db is None:
+            self._save_index()
+            return
+        entry = self.entries[key]
+        self.db.execute(
+            'INSERT OR REPLACE INTO downloads (key, file_id, entry, last_access) VALUES (?, ?, ?, ?)',
+            (key, entry['file_id'], json.dumps(entry), entry['last_access'])
+        )
+
+    def _forget(self, keys):
+        """Persist the removal of entries already deleted from self.entries"""
+        if not keys:
+            return
+        if self.db is None:
+            self._save_index()
+            return
+        for key in keys:
+            self.db.execute('DELETE FROM downloads WHERE key = ?', (key,))
+
+    def _save_index(self):
+        """Persist the index atomically"""
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _total_bytes(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits its size limit"""
+        if self.db is not None:
+            # Count downloads cached by every worker, not just this one
+            self._refresh()
+        evicted = []
+        total = self._total_bytes()
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._file_path(entry))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict cached download {entry['file_id']}: {e}")
+                continue
+            del self.entries[key]
+            self.files.pop(entry['file_id'], None)
+            evicted.append(key)
+            total -= entry['size']
+            self.evictions += 1
+            logger.info(f"Evicted cached download {entry['file_id']} ({entry['size']} bytes)")
+        self._forget(evicted)
+
+    def get(self, video_id, format_id):
+        """Get the cache entry for a video and format, or None on a miss"""
+        key = f"{video_id}:{format_id}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.db is not None:
+                # Another worker may have cached it
+                rows = self.db.execute('SELECT entry, last_access FROM downloads WHERE key = ?', (key,))
+                if rows:
+                    entry = self.entries[key] = self._entry_from_row(*rows[0])
+            if entry and not os.path.exists(self._file_path(entry)):
+                del self.entries[key]
+                self._forget([key])
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry['last_access'] = time.time()
+            return dict(entry)
+
+    def put(self, video_id, format_id, file_path, title):
+        """Publish a finished download into the cache and return its entry"""
+        key = f"{video_id}:{format_id}"
+        ext = os.path.splitext(file_path)[1].lstrip('.')
+        entry = {
+            'file_id': self.make_file_id(video_id, format_id),
+            'ext': ext,
+            'title': title,
+            'size': os.path.getsize(file_path),
+            'created': time.time(),
+            'last_access': time.time(),
+        }
+
+        with self.lock:
+            # Atomic rename so readers never observe a partially written file
+            os.replace(file_path, self._file_path(entry))
+            self.entries[key] = entry
+            self._register(entry['file_id'], self._file_path(entry), cached=True)
+            self._mark_used(entry['file_id'], entry['created'])
+            self._save_entry(key)
+            self._evict()
+
+        logger.info(f"Cached download {key} as {entry['file_id']}.{ext}")
+        return dict(entry)
+
+    def _register(self, file_id, path, cached=False):
+        stat = os.stat(path)
+        self.files[file_id] = {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            # Strong validator: changes whenever the file is replaced
+            'etag': f"{file_id}-{stat.st_size:x}-{stat.st_mtime_ns:x}",
+            'last_modified': stat.st_mtime,
+            'last_served': None,
+            'cached': cached,
+        }
+
+    def register_file(self, file_id, path):
+        """Record the location of a download that is not in the cache"""
+        with self.lock:
+            self._register(file_id, path)
+            self._mark_used(file_id, time.time())
+
+    def resolve(self, file_id, extensions=('mp4', 'mp3')):
+        """Get the file info for a file ID, or None if there is no such download"""
+        with self.lock:
+            info = self.files.get(file_id)
+            if info is not None:
+                if os.path.exists(info['path']):
+                    return dict(info)
+                del self.files[file_id]
+
+            # Unknown ID, e.g. a download from before a restart: probe once and remember it
+            for ext in extensions:
+                path = os.path.join(self.download_folder, f"{file_id}.{ext}")
+                if os.path.exists(path):
+                    self._register(file_id, path)
+                    return dict(self.files[file_id])
+            return None
+
+    def record_access(self, file_id):
+        """Remember when a file was last served, for LRU eviction and retention"""
+        now = time.time()
+        with self.lock:
+            for entry in self.entries.values():
+                if entry['file_id'] == file_id:
+                    entry['last_access'] = now
+                    break
+            if self.db is not None:
+                self.db.execute('UPDATE downloads SET last_access = ? WHERE file_id = ?', (now, file_id))
+            self._mark_used(file_id, now)
+
+    def _mark_used(self, file_id, now):
+        """Record that a file was just written or served; the caller holds self.lock"""
+        info = self.files.get(file_id)
+        if info is not None:
+            info['last_served'] = now
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO served (file_id, last_served) VALUES (?, ?)', (file_id, now))
+
+    def last_access(self, file_id):
+        """Get when a file was last downloaded or served, or None if this index never saw either
+
+        Retention ages files by this rather than their mtime, which yt-dlp may
+        set to the video's upload date.
+        """
+        with self.lock:
+            if self.db is not None:
+                # Served by any worker
+                rows = self.db.execute('SELECT last_served FROM served WHERE file_id = ?', (file_id,))
+                return rows[0][0] if rows else None
+            info = self.files.get(file_id)
+            return info['last_served'] if info else None
+
+    def remove(self, file_id):
+        """Forget a file ID after its file has been deleted"""
+        with self.lock:
+            self.files.pop(file_id, None)
+            keys = [key for key, entry in self.entries.items() if entry['file_id'] == file_id]
+            for key in keys:
+                del self.entries[key]
+            if self.db is not None:
+                self.db.execute('DELETE FROM downloads WHERE file_id = ?', (file_id,))
+                self.db.execute('DELETE FROM served WHERE file_id = ?', (file_id,))
+            else:
+                self._forget(keys)
+
+    def stats(self):
+        """Get cache hit/miss counters and usage"""
+        with self.lock:
+            if self.db is not None:
+                self._refresh()
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self._total_bytes(),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+# Singleton instance
+_download_cache = None
+
+def get_download_cache(download_folder, max_bytes=5 * 1024 * 1024 * 1024, db_path=None):
+    """Get the singleton DownloadCache instance"""
+    global _download_cache
+    if _download_cache is None:
+        _download_cache = DownloadCache(download_folder, max_bytes=max_bytes, db_path=db_path)
+    return _download_cache
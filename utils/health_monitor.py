@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """Runs dependency probes in the background and publishes a cached status snapshot"""
+
+    def __init__(self, interval=30, failure_interval=5):
+        self.interval = interval  # seconds between probe rounds when everything is healthy
+        self.failure_interval = failure_interval  # seconds between rounds while a probe is failing
+        self.probes = {}
+        self.results = {}  # replaced wholesale on every update, so readers never need the lock
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, func, enabled=None):
+        """Register a probe; func() returns a truthy value when the dependency is healthy
+
+        enabled() is checked before each run so optional dependencies can be skipped.
+        """
+        self.probes[name] = (func, enabled)
+
+    def _run_probe(self, name):
+        """Run a single probe and publish its result"""
+        func, enabled = self.probes[name]
+        previous = self.results.get(name, {})
+        if enabled is not None and not enabled():
+            result = {'enabled': False, 'ok': False, 'value': None, 'error': None, 'latency_ms': None,
+                      'last_checked': time.time(), 'last_success': previous.get('last_success')}
+            with self.lock:
+                self.results = {**self.results, name: result}
+            return result
+
+        start = time.time()
+        try:
+            value = func()
+            error = None
+        except Exception as e:
+            logger.error(f"Health probe {name} failed: {e}")
+            value = None
+            error = str(e)
+
+        now = time.time()
+        result = {
+            'enabled': True,
+            'ok': bool(value),
+            'value': value,
+            'error': error,
+            'latency_ms': round((now - start) * 1000, 1),
+            'last_checked': now,
+            'last_success': now if value else previous.get('last_success'),
+        }
+
+        with self.lock:
+            self.results = {**self.results, name: result}
+        return result
+
+    def _loop(self):
+        """Background thread function for running probes"""
+        logger.info(f"Starting health probes every {self.interval} seconds")
+        while not self.stop_event.is_set():
+            for name in list(self.probes):
+                if self.stop_event.is_set():
+                    break
+                self._run_probe(name)
+
+            healthy = self.is_healthy()
+            self.wake_event.wait(self.interval if healthy else self.failure_interval)
+            self.wake_event.clear()
+
+    def get(self, name):
+        """Get the latest result for a probe, running it inline if it has never run"""
+        result = self.results.get(name)
+        _, enabled = self.probes[name]
+        if result is None or (not result['enabled'] and (enabled is None or enabled())):
+            result = self._run_probe(name)
+        return result
+
+    def check(self, name):
+        """Run a probe now and return its fresh result"""
+        return self._run_probe(name)
+
+    def is_healthy(self):
+        """Check whether every enabled probe last succeeded"""
+        return all(result['ok'] for result in self.results.values() if result['enabled'])
+
+    def snapshot(self):
+        """Get the latest results for all probes"""
+        return self.results
+
+    def refresh(self):
+        """Wake the background thread to run all probes now"""
+        self.wake_event.set()
+
+    def start(self):
+        """Start the probe thread"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the probe thread"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+
+# Singleton instance
+_health_monitor = None
+
+def get_health_monitor(interval=30):
+    """Get the singleton HealthMonitor instance"""
+    global _health_monitor
+    if _health_monitor is None:
+        _health_monitor = HealthMonitor(interval=interval)
+    return _health_monitor
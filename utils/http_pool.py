@@ -0,0 +1,124 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class HttpSessionPool:
+    """Shared requests sessions, one per proxy endpoint, with pooled keep-alive connections"""
+
+    def __init__(self, pool_connections=4, pool_maxsize=8, retries=1, timeout=(5, 10)):
+        self.pool_connections = pool_connections  # number of hosts to keep connection pools for
+        self.pool_maxsize = pool_maxsize  # connections kept alive per host
+        self.retries = retries
+        self.timeout = timeout  # (connect, read) seconds
+        self.sessions = {}  # proxy URL (None for direct) -> requests.Session
+        self.lock = threading.Lock()
+        self.session_hits = 0
+        self.session_misses = 0
+        self.requests = 0
+        self.retired_requests = 0  # counters of connection pools closed by reset()
+        self.retired_connections = 0
+
+    def _create_session(self, proxy):
+        """Create a session whose adapters keep connections alive between calls"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=Retry(total=self.retries, connect=self.retries, read=0, backoff_factor=0.5),
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if proxy:
+            session.proxies = {'http': proxy, 'https': proxy}
+        return session
+
+    def get_session(self, proxy=None):
+        """Get the shared session for a proxy endpoint"""
+        with self.lock:
+            session = self.sessions.get(proxy)
+            if session is None:
+                self.session_misses += 1
+                session = self.sessions[proxy] = self._create_session(proxy)
+                logger.debug(f"Created HTTP session for proxy {proxy}")
+            else:
+                self.session_hits += 1
+            return session
+
+    def get(self, url, proxy=None, **kwargs):
+        """Send a GET request on the shared session for a proxy endpoint"""
+        kwargs.setdefault('timeout', self.timeout)
+        session = self.get_session(proxy)
+        with self.lock:
+            self.requests += 1
+        return session.get(url, **kwargs)
+
+    @staticmethod
+    def _connection_pools(session):
+        """Iterate over the urllib3 connection pools behind a session"""
+        adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+        for adapter in adapters.values():
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        yield pool
+
+    def _counters(self, session):
+        requests_sent, connections = 0, 0
+        for pool in self._connection_pools(session):
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return requests_sent, connections
+
+    def reset(self, proxy=None):
+        """Close the pooled connections for a proxy endpoint, e.g. after a Tor circuit change"""
+        with self.lock:
+            session = self.sessions.pop(proxy, None)
+            if session is None:
+                return
+            requests_sent, connections = self._counters(session)
+            self.retired_requests += requests_sent
+            self.retired_connections += connections
+        session.close()
+
+    def reopen(self):
+        """Drop sessions inherited from the parent process, whose sockets it still uses"""
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def stats(self):
+        """Get session and connection reuse counters"""
+        with self.lock:
+            requests_sent, connections = self.retired_requests, self.retired_connections
+            for session in self.sessions.values():
+                session_requests, session_connections = self._counters(session)
+                requests_sent += session_requests
+                connections += session_connections
+            return {
+                'sessions': len(self.sessions),
+                'session_hits': self.session_hits,
+                'session_misses': self.session_misses,
+                'requests': self.requests,
+                # A pool hit is a request served on an already open connection
+                'connection_hits': max(requests_sent - connections, 0),
+                'connection_misses': connections,
+                'pool_maxsize': self.pool_maxsize,
+            }
+
+
+# Singleton instance
+_http_pool = None
+
+def get_http_pool():
+    """Get the singleton HttpSessionPool instance"""
+    global _http_pool
+    if _http_pool is None:
+        _http_pool = HttpSessionPool()
+    return _http_pool
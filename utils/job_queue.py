@@ -0,0 +1,472 @@
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import threading
+
+from utils.scheduler import FairScheduler
+from utils.worker_pool import PoolSaturatedError
+from utils.shared_db import SharedDatabase, pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(PoolSaturatedError):
+    """Raised when the job queue cannot accept more work"""
+
+
+class NotJobWaiterError(Exception):
+    """Raised when a client tries to cancel a job it did not submit or join"""
+
+
+class Job:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, kind, params=None, dedupe_key=None, client=None, priority=0, cancel_event=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.params = params or {}
+        self.dedupe_key = dedupe_key
+        self.client = client
+        self.priority = priority
+        self.state = Job.QUEUED
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.speed = None
+        self.eta = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0  # incremented on every change, used by event stream subscribers
+        self.cancel_event = cancel_event or threading.Event()  # set to stop the job's downloads and processes
+        self.on_change = None  # called with the job after every change, outside its lock
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    @property
+    def is_done(self):
+        return self.state in (Job.FINISHED, Job.FAILED)
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _set(self, **fields):
+        """Update fields and wake subscribers"""
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def update(self, stage=None, progress=None, speed=None, eta=None):
+        """Record the current stage, progress percentage, speed (bytes/s) and ETA (s) of the job"""
+        fields = {'speed': speed, 'eta': eta}
+        if stage is not None:
+            fields['stage'] = stage
+        if progress is not None:
+            fields['progress'] = max(0.0, min(100.0, float(progress)))
+        self._set(**fields)
+
+    def _snapshot(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'priority': self.priority,
+            'state': self.state,
+            'stage': self.stage,
+            'progress': round(self.progress, 1),
+            'speed': self.speed,
+            'eta': self.eta,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def to_dict(self):
+        """Get a JSON-serialisable snapshot of the job"""
+        with self._lock:
+            return self._snapshot()
+
+    def wait_for_change(self, version, timeout=None):
+        """Wait until the job changes after `version`
+
+        Returns (version, snapshot), or (version, None) on timeout. Subscribers only
+        ever see the latest state, so a slow reader needs no per-subscriber buffer.
+        """
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            if self.version == version:
+                return version, None
+            return self.version, self._snapshot()
+
+
+class RemoteJob:
+    """Read-only view of a job owned by another worker process, read from the shared database"""
+
+    def __init__(self, queue, job_id, snapshot):
+        self.queue = queue
+        self.id = job_id
+        self.snapshot = snapshot
+
+    @property
+    def state(self):
+        return self.snapshot['state']
+
+    @property
+    def is_done(self):
+        return self.state in (Job.FINISHED, Job.FAILED)
+
+    def to_dict(self):
+        """Get the last snapshot the owning worker published"""
+        _, snapshot = self.queue._load(self.id)
+        if snapshot is not None:
+            self.snapshot = snapshot
+        return dict(self.snapshot)
+
+    def wait_for_change(self, version, timeout=None):
+        """Poll the shared database until the job changes after `version`, like Job.wait_for_change"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            current, snapshot = self.queue._load(self.id)
+            if snapshot is not None and current != version:
+                self.snapshot = snapshot
+                return current, snapshot
+            if deadline is not None and time.time() >= deadline:
+                return version, None
+            time.sleep(self.queue.poll_interval if deadline is None else
+                       max(0, min(self.queue.poll_interval, deadline - time.time())))
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_pending=20, retention=3600, scheduler=None, db_path=None,
+                 publish_interval=0.5, poll_interval=0.5):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention = retention  # seconds to keep finished jobs around
+        self.scheduler = scheduler if scheduler is not None else FairScheduler()  # decides which queued job a free worker runs next
+        self.publish_interval = publish_interval  # minimum seconds between progress-only writes to the shared database
+        self.poll_interval = poll_interval  # seconds between shared database checks for remote jobs and cancellations
+        self.jobs = {}
+        self.active_keys = {}  # dedupe key -> job ID of the in-flight job
+        self.published = {}  # job ID -> (time, state, stage) last written to the shared database
+        self.waiters = {}  # job ID -> clients that submitted or were coalesced into the job, without a database
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.work_available = threading.Semaphore(0)
+        self.workers = []
+        self.db = None
+
+        if db_path:
+            # Jobs are visible to, deduplicated across and cancellable from every worker process
+            self.db = SharedDatabase(db_path, schema=(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, owner INTEGER NOT NULL, dedupe_key TEXT, state TEXT NOT NULL, '
+                'version INTEGER NOT NULL, snapshot TEXT NOT NULL, cancel_requested INTEGER NOT NULL DEFAULT 0, '
+                'updated_at REAL NOT NULL)',
+                'CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key)',
+                'CREATE TABLE IF NOT EXISTS job_waiters (job_id TEXT NOT NULL, client TEXT NOT NULL, '
+                'PRIMARY KEY (job_id, client))',
+            ))
+
+    def _ensure_workers(self):
+        """Start the worker threads on first use, i.e. in the process that runs jobs"""
+        if self.workers:
+            return
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'job-{index}')
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        if self.db is not None:
+            watcher = threading.Thread(target=self._watch_cancellations, name='job-cancellations')
+            watcher.daemon = True
+            watcher.start()
+            self.workers.append(watcher)
+
+    def _worker_loop(self):
+        """Worker thread function: run the job the scheduler picks next"""
+        while True:
+            self.work_available.acquire()
+            entry = self.scheduler.pop()
+            if entry is not None:
+                self._run(*entry)
+
+    def _watch_cancellations(self):
+        """Cancel jobs of this process that a request to another worker asked to cancel"""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                rows = self.db.execute(
+                    'SELECT id FROM jobs WHERE owner = ? AND cancel_requested = 1', (os.getpid(),)
+                )
+                for (job_id,) in rows:
+                    self.db.execute('UPDATE jobs SET cancel_requested = 0 WHERE id = ?', (job_id,))
+                    self.cancel(job_id)
+            except Exception as e:
+                logger.error(f"Error checking for cancelled jobs: {e}")
+
+    def _publish(self, job):
+        """Write a job's state to the shared database; progress-only changes at most every publish_interval"""
+        with job._lock:
+            version, snapshot = job.version, job._snapshot()
+        now = time.time()
+        last = self.published.get(job.id)
+        if (last is not None and last[1:] == (snapshot['state'], snapshot['stage'])
+                and now - last[0] < self.publish_interval):
+            return
+        self.published[job.id] = (now, snapshot['state'], snapshot['stage'])
+
+        dedupe_key = json.dumps(job.dedupe_key) if job.dedupe_key is not None else None
+        try:
+            # Concurrent publishers may finish out of order; never overwrite a newer version
+            self.db.execute(
+                'INSERT INTO jobs (id, owner, dedupe_key, state, version, snapshot, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET state = excluded.state, '
+                'version = excluded.version, snapshot = excluded.snapshot, updated_at = excluded.updated_at '
+                'WHERE excluded.version > jobs.version',
+                (job.id, os.getpid(), dedupe_key, snapshot['state'], version, json.dumps(snapshot), now)
+            )
+        except Exception as e:
+            logger.error(f"Could not publish job {job.id}: {e}")
+
+    def _load(self, job_id):
+        """Get (version, snapshot) of a job from the shared database, or (None, None)"""
+        rows = self.db.execute('SELECT owner, version, snapshot FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None, None
+        owner, version, snapshot = rows[0]
+        snapshot = json.loads(snapshot)
+        if snapshot['state'] in (Job.QUEUED, Job.RUNNING) and not pid_alive(owner):
+            # The worker running it exited (crash, restart or max_requests)
+            snapshot.update(state=Job.FAILED, stage='failed', finished_at=time.time(),
+                            error={'success': False, 'error': 'The worker running this job exited'})
+            version += 1
+            self.db.execute('UPDATE jobs SET state = ?, version = ?, snapshot = ? WHERE id = ? AND version < ?',
+                            (Job.FAILED, version, json.dumps(snapshot), job_id, version))
+        return version, snapshot
+
+    def _get_remote(self, job_id):
+        if self.db is None:
+            return None
+        _, snapshot = self._load(job_id)
+        return RemoteJob(self, job_id, snapshot) if snapshot else None
+
+    def _find_remote_active(self, dedupe_key):
+        """Find an in-flight job with the same dedupe key owned by another live worker"""
+        rows = self.db.execute(
+            'SELECT id, owner, snapshot FROM jobs WHERE dedupe_key = ? AND state IN (?, ?) AND owner != ?',
+            (json.dumps(dedupe_key), Job.QUEUED, Job.RUNNING, os.getpid())
+        )
+        for job_id, owner, snapshot in rows:
+            if pid_alive(owner):
+                return RemoteJob(self, job_id, json.loads(snapshot))
+        return None
+
+    def _add_waiter(self, job_id, client):
+        """Record a client waiting on a job, shared by every worker process with a database"""
+        if self.db is not None:
+            self.db.execute('INSERT OR IGNORE INTO job_waiters (job_id, client) VALUES (?, ?)',
+                            (job_id, str(client)))
+        else:
+            self.waiters.setdefault(job_id, set()).add(str(client))
+
+    def _detach(self, job_id, client):
+        """Remove a client from a job's waiters; returns the number left, or None if it was not one"""
+        client = str(client)
+        if self.db is None:
+            with self.lock:
+                waiters = self.waiters.get(job_id, set())
+                if client not in waiters:
+                    return None
+                waiters.discard(client)
+                return len(waiters)
+
+        with self.db.transaction() as connection:
+            removed = connection.execute('DELETE FROM job_waiters WHERE job_id = ? AND client = ?',
+                                         (job_id, client)).rowcount
+            if not removed:
+                return None
+            return connection.execute('SELECT COUNT(*) FROM job_waiters WHERE job_id = ?',
+                                      (job_id,)).fetchone()[0]
+
+    def _pending_count(self):
+        return sum(1 for job in self.jobs.values() if not job.is_done)
+
+    def _purge_expired(self):
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.is_done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+            self.published.pop(job_id, None)
+            self.waiters.pop(job_id, None)
+        if self.db is not None:
+            self.db.execute('DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?',
+                            (Job.FINISHED, Job.FAILED, cutoff))
+            self.db.execute('DELETE FROM job_waiters WHERE job_id NOT IN (SELECT id FROM jobs)')
+        self.active_keys = {key: job_id for key, job_id in self.active_keys.items()
+                            if job_id in self.jobs and not self.jobs[job_id].is_done}
+
+    def _run(self, job, func):
+        """Run a job function and record its outcome"""
+        if job.is_cancelled:
+            # Cancelled while it was queued
+            return
+        job._set(state=Job.RUNNING, stage='starting', started_at=time.time())
+
+        try:
+            result = func(job)
+            # Job functions return a payload with 'success' like the JSON routes
+            if result.get('success', True):
+                job._set(state=Job.FINISHED, stage='done', progress=100.0, result=result,
+                         speed=None, eta=None, finished_at=time.time())
+            else:
+                job._set(state=Job.FAILED, stage='failed', error=result,
+                         speed=None, eta=None, finished_at=time.time())
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed: {e}")
+            job._set(state=Job.FAILED, stage='failed',
+                     error={'success': False, 'error': f'Error processing job: {str(e)}'},
+                     speed=None, eta=None, finished_at=time.time())
+        logger.info(f"Job {job.id} {job.state} in {job.finished_at - job.started_at:.2f}s")
+
+    def submit(self, kind, func, params=None, dedupe_key=None, client=None, priority=0, cost=1.0):
+        """Enqueue func(job) and return the Job immediately
+
+        If a job with the same dedupe_key is still queued or running, that job
+        is returned instead so identical requests share one execution. The
+        scheduler orders queued jobs by priority class (lower runs first) and
+        shares workers fairly between clients in proportion to job cost. With a
+        shared database, an in-flight job of another worker process is returned
+        as a RemoteJob. Either way the client is recorded as one of the job's
+        waiters, see cancel().
+        """
+        with self.lock:
+            self._ensure_workers()
+            self._purge_expired()
+            if dedupe_key is not None:
+                existing = self.jobs.get(self.active_keys.get(dedupe_key))
+                if existing is None and self.db is not None:
+                    existing = self._find_remote_active(dedupe_key)
+                if existing is not None and not existing.is_done:
+                    self.coalesced += 1
+                    self._add_waiter(existing.id, client)
+                    logger.info(f"Coalesced {kind} request into in-flight job {existing.id}")
+                    return existing
+
+            if self._pending_count() >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)",
+                                     retry_after=self._retry_after())
+
+            job = Job(kind, params, dedupe_key, client=client, priority=priority)
+            self.jobs[job.id] = job
+            self._add_waiter(job.id, client)
+            if dedupe_key is not None:
+                self.active_keys[dedupe_key] = job.id
+            if self.db is not None:
+                job.on_change = self._publish
+                self._publish(job)
+
+        self.scheduler.push((job, func), client=client, priority=priority, cost=cost)
+        self.work_available.release()
+        logger.info(f"Job {job.id} ({kind}) queued for {client} with priority {priority}")
+        return job
+
+    def cancel(self, job_id, client=None):
+        """Cancel a queued or running job; returns the job, or None if it is unknown
+
+        Identical requests share one job, so with a client only that client's
+        interest is dropped: NotJobWaiterError is raised if it never submitted or
+        joined the job, and the job itself is only cancelled once its last waiter
+        has left. Without a client the job is cancelled outright.
+
+        A queued job fails straight away. A running job has its cancel event set,
+        which stops its downloads and kills its processes; it then fails through
+        its own error handling. A job of another worker process is flagged in the
+        shared database and cancelled by its owner within poll_interval.
+        """
+        job = self.get(job_id)
+        if job is None or job.is_done:
+            return job
+        if client is not None:
+            remaining = self._detach(job_id, client)
+            if remaining is None:
+                raise NotJobWaiterError(f"Client {client} is not waiting on job {job_id}")
+            if remaining:
+                logger.info(f"Client {client} left job {job_id}; {remaining} other clients still wait on it")
+                return job
+        if isinstance(job, RemoteJob):
+            self.db.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+            logger.info(f"Requested cancellation of job {job_id} owned by another worker")
+            return job
+
+        job.cancel_event.set()
+        with job._lock:
+            queued = job.state == Job.QUEUED
+        if queued:
+            job._set(state=Job.FAILED, stage='cancelled',
+                     error={'success': False, 'error': 'Job cancelled'},
+                     finished_at=time.time())
+        logger.info(f"Job {job.id} cancelled while {'queued' if queued else 'running'}")
+        return job
+
+    def _retry_after(self):
+        """Estimate how long until a job slot frees up, from recent job durations"""
+        durations = [job.finished_at - job.started_at for job in self.jobs.values()
+                     if job.is_done and job.started_at]
+        average = sum(durations) / len(durations) if durations else 10.0
+        # Running jobs finish one after another, so a slot frees up every average / workers seconds
+        return max(1, math.ceil(average / self.max_workers))
+
+    def get(self, job_id):
+        """Get a job by ID, or None if it is unknown or expired
+
+        Jobs of other worker processes are found through the shared database.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        return job if job is not None else self._get_remote(job_id)
+
+    def stats(self):
+        """Get counts of jobs by state, queue wait and utilisation"""
+        with self.lock:
+            counts = {Job.QUEUED: 0, Job.RUNNING: 0, Job.FINISHED: 0, Job.FAILED: 0}
+            waits = []
+            for job in self.jobs.values():
+                counts[job.state] += 1
+                if job.started_at:
+                    waits.append(job.started_at - job.created_at)
+            counts['coalesced'] = self.coalesced
+        counts['max_workers'] = self.max_workers
+        counts['max_pending'] = self.max_pending
+        counts['avg_wait_ms'] = round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0
+        counts['max_wait_ms'] = round(max(waits) * 1000, 1) if waits else 0.0
+        counts['utilisation'] = round(counts[Job.RUNNING] / self.max_workers, 3)
+        counts['scheduler'] = self.scheduler.stats()
+        return counts
+
+
+# Singleton instance
+_job_queue = None
+
+def get_job_queue(max_workers=2, max_pending=20, scheduler=None, db_path=None):
+    """Get the singleton JobQueue instance"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(max_workers=max_workers, max_pending=max_pending, scheduler=scheduler,
+                              db_path=db_path)
+    return _job_queue
@@ -0,0 +1,281 @@
+import os
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from utils.ytdlp_engine import USER_AGENT, YtDlpError
+from utils.process_supervisor import get_process_supervisor
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg stage for the video presets: yt-dlp writes the merged video and audio streams to
+# stdout as MPEG-TS, which is copied into fragmented MP4 so no seekable output file is needed
+FRAGMENTED_MP4 = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+                  '-c', 'copy', '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4', 'pipe:1']
+
+# Presets that can be produced as a single stream without a seekable output file
+STREAM_PRESETS = {
+    'mp4-hd': {
+        'format': ('bestvideo[height<=1080][vcodec^=avc1]+bestaudio[acodec^=mp4a]/'
+                   'best[height<=1080][ext=mp4]/best[height<=1080]'),
+        'ext': 'mp4',
+        'mimetype': 'video/mp4',
+        'transcode': FRAGMENTED_MP4,
+    },
+    'mp4-sd': {
+        'format': ('bestvideo[height<=480][vcodec^=avc1]+bestaudio[acodec^=mp4a]/'
+                   'best[height<=480][ext=mp4]/best[height<=480]'),
+        'ext': 'mp4',
+        'mimetype': 'video/mp4',
+        'transcode': FRAGMENTED_MP4,
+    },
+    'mp3': {
+        'format': 'bestaudio/best',
+        'ext': 'mp3',
+        'mimetype': 'audio/mpeg',
+        'transcode': ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+                      '-vn', '-c:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3', 'pipe:1'],
+    },
+}
+
+
+def build_stream_command(url, format_id, proxy=None, referer=None):
+    """Build the yt-dlp command writing a STREAM_PRESETS format to stdout"""
+    cmd = [
+        'yt-dlp',
+        '-f', STREAM_PRESETS[format_id]['format'],
+        '-o', '-',
+        '--quiet',
+        '--no-part',
+        '--no-playlist',
+        '--no-cache-dir',
+        '--user-agent', USER_AGENT,
+    ]
+    if referer:
+        cmd.extend(['--referer', referer])
+    if proxy:
+        cmd.extend(['--proxy', proxy])
+    cmd.append(url)
+    return cmd
+
+
+class MediaStream:
+    """A running yt-dlp (and optional ffmpeg) pipeline writing media to stdout"""
+
+    def __init__(self, url, format_id, proxy=None, referer=None, chunk_size=64 * 1024, timeout=None):
+        self.url = url
+        self.format_id = format_id
+        self.preset = STREAM_PRESETS[format_id]
+        self.chunk_size = chunk_size
+        self.bytes_sent = 0
+        self.processes = []
+        self.stderr_tail = deque(maxlen=50)  # last lines of yt-dlp output, for error reporting
+        self.first_chunk = b''
+        self.closed = False
+        self.close_callbacks = []
+
+        cmd = build_stream_command(url, format_id, proxy=proxy, referer=referer)
+        logger.debug(f"Starting media stream: {' '.join(cmd)}")
+        supervisor = get_process_supervisor()
+        downloader = supervisor.spawn(cmd, 'yt-dlp', timeout=timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.downloader = downloader.popen
+        self.processes.append(downloader)
+        self.output = self.downloader.stdout
+
+        if 'transcode' in self.preset:
+            try:
+                transcoder = supervisor.spawn(
+                    self.preset['transcode'],
+                    'ffmpeg',
+                    timeout=timeout,
+                    stdin=self.downloader.stdout,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                )
+            except BaseException:
+                # e.g. ffmpeg is missing: don't leave yt-dlp running with nobody reading its pipes
+                supervisor.kill(downloader, 'spawn_failed')
+                self.downloader.stdout.close()
+                self.downloader.stderr.close()
+                supervisor.release(downloader, self.downloader.wait())
+                raise
+            # Let ffmpeg own the read end so yt-dlp sees SIGPIPE if ffmpeg exits
+            self.downloader.stdout.close()
+            self.processes.append(transcoder)
+            self.transcoder = transcoder.popen
+            self.output = self.transcoder.stdout
+
+        self.stderr_thread = threading.Thread(target=self._drain_stderr)
+        self.stderr_thread.daemon = True
+        self.stderr_thread.start()
+
+    def _drain_stderr(self):
+        """Keep yt-dlp's stderr pipe from filling up"""
+        for line in self.downloader.stderr:
+            self.stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    def start(self):
+        """Wait for the first chunk so failures can still be reported as an error response"""
+        self.first_chunk = self.output.read(self.chunk_size)
+        if not self.first_chunk:
+            self.downloader.wait()
+            self.stderr_thread.join(timeout=1)
+            self.close()
+            raise YtDlpError('\n'.join(self.stderr_tail) or 'yt-dlp produced no output')
+        return self
+
+    def __iter__(self):
+        """Yield media chunks; closing the iterator stops the pipeline"""
+        try:
+            chunk = self.first_chunk
+            while chunk:
+                self.bytes_sent += len(chunk)
+                yield chunk
+                chunk = self.output.read(self.chunk_size)
+            logger.info(f"Streamed {self.bytes_sent} bytes for {self.url} ({self.format_id})")
+        finally:
+            self.close()
+
+    def on_close(self, callback):
+        """Register a function to call once the pipeline has been closed"""
+        self.close_callbacks.append(callback)
+
+    def close(self):
+        """Kill any process still running, e.g. because the client disconnected"""
+        supervisor = get_process_supervisor()
+        for process in self.processes:
+            if process.popen.poll() is None:
+                supervisor.kill(process, 'disconnect')
+            supervisor.release(process, process.popen.wait())
+        self.output.close()
+
+        if not self.closed:
+            self.closed = True
+            for callback in self.close_callbacks:
+                callback()
+
+
+def open_media_stream(url, format_id, proxy=None, referer=None, timeout=None):
+    """Start streaming a video in one of STREAM_PRESETS, raising YtDlpError if nothing is produced
+
+    The yt-dlp and ffmpeg processes are killed after timeout seconds (the
+    supervisor default when None) or as soon as the stream is closed early.
+    """
+    return MediaStream(url, format_id, proxy=proxy, referer=referer, timeout=timeout).start()
+
+
+class AsyncMediaStream:
+    """MediaStream counterpart for the ASGI server, driven by asyncio subprocesses
+
+    Nothing blocks a thread while the pipeline runs: reads from yt-dlp/ffmpeg and
+    waits for process exit are awaited on the event loop.
+    """
+
+    def __init__(self, url, format_id, proxy=None, referer=None, chunk_size=64 * 1024, timeout=None):
+        self.url = url
+        self.format_id = format_id
+        self.proxy = proxy
+        self.referer = referer
+        self.preset = STREAM_PRESETS[format_id]
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.bytes_sent = 0
+        self.processes = []
+        self.stderr_tail = deque(maxlen=50)
+        self.first_chunk = b''
+        self.closed = False
+        self.close_callbacks = []
+        self.output = None
+        self.stderr_task = None
+
+    async def _drain_stderr(self, stderr):
+        """Keep yt-dlp's stderr pipe from filling up"""
+        async for line in stderr:
+            self.stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    async def _spawn(self):
+        supervisor = get_process_supervisor()
+        cmd = build_stream_command(self.url, self.format_id, proxy=self.proxy, referer=self.referer)
+        logger.debug(f"Starting async media stream: {' '.join(cmd)}")
+
+        if 'transcode' not in self.preset:
+            downloader = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=os.name == 'posix'
+            )
+            self.processes.append(supervisor.track(downloader, 'yt-dlp', timeout=self.timeout))
+            self.output = downloader.stdout
+        else:
+            # yt-dlp writes straight into ffmpeg through an OS pipe; only ffmpeg's output passes through the loop
+            read_fd, write_fd = os.pipe()
+            try:
+                downloader = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=write_fd, stderr=subprocess.PIPE, start_new_session=os.name == 'posix'
+                )
+                self.processes.append(supervisor.track(downloader, 'yt-dlp', timeout=self.timeout))
+                transcoder = await asyncio.create_subprocess_exec(
+                    *self.preset['transcode'], stdin=read_fd, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL, start_new_session=os.name == 'posix'
+                )
+                self.processes.append(supervisor.track(transcoder, 'ffmpeg', timeout=self.timeout))
+            finally:
+                os.close(read_fd)
+                os.close(write_fd)
+            self.output = transcoder.stdout
+
+        self.stderr_task = asyncio.ensure_future(self._drain_stderr(downloader.stderr))
+
+    async def start(self):
+        """Wait for the first chunk so failures can still be reported as an error response"""
+        try:
+            await self._spawn()
+            self.first_chunk = await self.output.read(self.chunk_size)
+        except BaseException:
+            await self.aclose()
+            raise
+        if not self.first_chunk:
+            await self.processes[0].popen.wait()
+            try:
+                await asyncio.wait_for(self.stderr_task, timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            await self.aclose()
+            raise YtDlpError('\n'.join(self.stderr_tail) or 'yt-dlp produced no output')
+        return self
+
+    async def __aiter__(self):
+        """Yield media chunks; closing the iterator stops the pipeline"""
+        try:
+            chunk = self.first_chunk
+            while chunk:
+                self.bytes_sent += len(chunk)
+                yield chunk
+                chunk = await self.output.read(self.chunk_size)
+            logger.info(f"Streamed {self.bytes_sent} bytes for {self.url} ({self.format_id})")
+        finally:
+            await self.aclose()
+
+    def on_close(self, callback):
+        """Register a function to call once the pipeline has been closed"""
+        self.close_callbacks.append(callback)
+
+    async def aclose(self):
+        """Kill any process still running, e.g. because the client disconnected"""
+        supervisor = get_process_supervisor()
+        for process in self.processes:
+            if process.popen.returncode is None:
+                supervisor.kill(process, 'disconnect')
+            supervisor.release(process, await process.popen.wait())
+        if self.stderr_task is not None and not self.stderr_task.done():
+            self.stderr_task.cancel()
+
+        if not self.closed:
+            self.closed = True
+            for callback in self.close_callbacks:
+                callback()
+
+
+async def open_async_media_stream(url, format_id, proxy=None, referer=None, timeout=None):
+    """Start an AsyncMediaStream, raising YtDlpError if nothing is produced"""
+    return await AsyncMediaStream(url, format_id, proxy=proxy, referer=referer, timeout=timeout).start()
@@ -0,0 +1,143 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from utils.shared_db import SharedDatabase
+
+logger = logging.getLogger(__name__)
+
+# Info dict fields the app reads, plus those yt-dlp needs to download from a cached dict again.
+# Captions, thumbnail lists and storyboards alone hold hundreds of URLs per video.
+INFO_FIELDS = ('id', 'title', 'duration', 'thumbnail', 'uploader', 'view_count', 'is_live', 'display_id',
+               'webpage_url', 'original_url', 'extractor', 'extractor_key', 'http_headers')
+FORMAT_FIELDS = ('format_id', 'format', 'format_note', 'ext', 'container', 'protocol', 'url', 'manifest_url',
+                 'fragment_base_url', 'fragments', 'http_headers', 'downloader_options', 'vcodec', 'acodec',
+                 'width', 'height', 'fps', 'dynamic_range', 'tbr', 'vbr', 'abr', 'asr', 'audio_channels',
+                 'filesize', 'filesize_approx', 'quality', 'source_preference', 'language', 'has_drm')
+
+
+def trim_info(info):
+    """Keep only the parts of a yt-dlp info dict the app uses, dropping storyboard formats"""
+    trimmed = {key: info[key] for key in INFO_FIELDS if key in info}
+    trimmed['formats'] = [
+        {key: f[key] for key in FORMAT_FIELDS if key in f}
+        for f in info.get('formats') or []
+        if f.get('format_note') != 'storyboard' and f.get('ext') != 'mhtml'
+    ]
+    return trimmed
+
+
+class MetadataCache:
+    """TTL + LRU cache of yt-dlp info dicts keyed by video ID, with an optional SQLite tier
+
+    Info dicts are stored trimmed by trim_info(), so an entry stays a few
+    kilobytes. The SQLite tier is shared by every worker process using the same file.
+    """
+
+    def __init__(self, ttl=1800, max_entries=256, db_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.entries = OrderedDict()  # video ID -> (expires_at, info)
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+        if db_path:
+            self.db = SharedDatabase(db_path, schema=(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'video_id TEXT PRIMARY KEY, info TEXT NOT NULL, expires_at REAL NOT NULL)',
+            ))
+            self.db.execute('DELETE FROM metadata WHERE expires_at < ?', (time.time(),))
+
+    def _store(self, video_id, expires_at, info):
+        """Insert into the in-memory tier, evicting the least recently used entry if full"""
+        self.entries[video_id] = (expires_at, info)
+        self.entries.move_to_end(video_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_persistent(self, video_id):
+        """Look a video up in the SQLite tier"""
+        rows = self.db.execute('SELECT info, expires_at FROM metadata WHERE video_id = ?', (video_id,))
+        if not rows:
+            return None
+
+        info, expires_at = rows[0]
+        if expires_at < time.time():
+            self.db.execute('DELETE FROM metadata WHERE video_id = ?', (video_id,))
+            self.expirations += 1
+            return None
+        return expires_at, json.loads(info)
+
+    def get(self, video_id):
+        """Get the cached info dict for a video, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is not None:
+                if entry[0] >= time.time():
+                    self.entries.move_to_end(video_id)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[video_id]
+                self.expirations += 1
+
+            if self.db is not None:
+                entry = self._load_persistent(video_id)
+                if entry is not None:
+                    self._store(video_id, *entry)
+                    self.persistent_hits += 1
+                    return entry[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, video_id, info):
+        """Cache the trimmed info dict for a video"""
+        info = trim_info(info)
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._store(video_id, expires_at, info)
+            if self.db is not None:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO metadata (video_id, info, expires_at) VALUES (?, ?, ?)',
+                    (video_id, json.dumps(info), expires_at)
+                )
+
+    def stats(self):
+        """Get cache hit/miss counters and usage"""
+        with self.lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            stats = {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.persistent_hits) / lookups, 3) if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'persistent': self.db is not None,
+            }
+            if self.db is not None:
+                stats['persistent_entries'] = self.db.execute('SELECT COUNT(*) FROM metadata')[0][0]
+            return stats
+
+
+# Singleton instance
+_metadata_cache = None
+
+def get_metadata_cache(ttl=1800, max_entries=256, db_path=None):
+    """Get the singleton MetadataCache instance"""
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = MetadataCache(ttl=ttl, max_entries=max_entries, db_path=db_path)
+    return _metadata_cache
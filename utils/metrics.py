@@ -0,0 +1,174 @@
+import time
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from fast cache hits up to long downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = dict(self.values)
+        if not values and not self.labelnames:
+            values = {(): 0}
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, optionally split by labels"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, **labels):
+        """Decorator observing the duration of every call"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self.series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """Point-in-time values read from a callback when metrics are scraped
+
+    func() returns a number, or a dict mapping label value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value or 0)}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Metrics recorded across the application
+STAGE_SECONDS = registry.register(Histogram(
+    'ytshortpro_stage_seconds', 'Time spent in each stage of request handling and download jobs',
+    ['handler', 'stage']
+))
+YTDLP_RETRIES = registry.register(Counter(
+    'ytshortpro_ytdlp_retries_total', 'yt-dlp operations retried by run_yt_dlp_with_tor'
+))
+YTDLP_RATE_LIMITED = registry.register(Counter(
+    'ytshortpro_ytdlp_rate_limited_total', 'yt-dlp failures caused by HTTP 429 rate limiting'
+))
+TOR_ROTATIONS = registry.register(Counter(
+    'ytshortpro_tor_rotations_total', 'Tor circuit rotations requested with NEWNYM'
+))
+BYTES_SERVED = registry.register(Counter(
+    'ytshortpro_bytes_served_total', 'Media bytes sent to clients', ['route']
+))
+TRANSCODES = registry.register(Counter(
+    'ytshortpro_transcodes_total', 'Presets derived by ffmpeg, by path taken (copy, partial, transcode)', ['path']
+))
+TRANSCODE_CPU_SECONDS = registry.register(Counter(
+    'ytshortpro_transcode_cpu_seconds_total', 'CPU time used by ffmpeg deriving presets, by path taken', ['path']
+))
+PROCESS_KILLS = registry.register(Counter(
+    'ytshortpro_process_kills_total', 'yt-dlp and ffmpeg work stopped by the supervisor, by reason',
+    ['kind', 'reason']
+))
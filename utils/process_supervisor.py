@@ -0,0 +1,236 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+
+from utils.metrics import PROCESS_KILLS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedProcess:
+    """A supervised child process in its own process group
+
+    popen is the subprocess.Popen, or the asyncio.subprocess.Process for pipelines
+    run from the event loop.
+    """
+
+    def __init__(self, popen, kind, deadline=None, cancel_event=None):
+        self.popen = popen
+        self.kind = kind
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.killed_reason = None  # 'timeout', 'cancelled' or 'disconnect' once killed
+        self.done = False
+
+    @property
+    def pid(self):
+        return self.popen.pid
+
+
+class ProcessSupervisor:
+    """Starts ffmpeg and yt-dlp child processes with resource limits and kills them when needed
+
+    Every child gets its own process group, a lower CPU priority and CPU time and
+    address space rlimits. A watchdog thread kills the whole group when its
+    wall-clock deadline passes or its cancel event is set, so helpers the child
+    spawned itself go with it.
+    """
+
+    def __init__(self, timeout=1800, cpu_seconds=None, memory_bytes=None, nice=10, interval=0.5):
+        self.timeout = timeout  # default wall-clock limit in seconds, None for no limit
+        self.cpu_seconds = cpu_seconds  # RLIMIT_CPU per process
+        self.memory_bytes = memory_bytes  # RLIMIT_AS per process
+        self.nice = nice  # added to the niceness of every child
+        self.interval = interval  # seconds between watchdog checks
+        self.processes = []
+        self.lock = threading.Lock()
+        self.watchdog = None
+        self.spawned = 0
+        self.finished = 0
+        self.failed = 0
+        self.kills = {}  # (kind, reason) -> count
+        self.cpu_seconds_used = 0.0
+
+    def _apply_limits(self, pid):
+        """Lower the priority and set rlimits of a freshly started child"""
+        try:
+            if self.nice and hasattr(os, 'setpriority'):
+                os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + self.nice))
+            if resource is not None and hasattr(resource, 'prlimit'):
+                if self.cpu_seconds:
+                    # Soft limit sends SIGXCPU, the hard limit a little later SIGKILL
+                    resource.prlimit(pid, resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 5))
+                if self.memory_bytes:
+                    resource.prlimit(pid, resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not apply resource limits to process {pid}: {e}")
+
+    def _ensure_watchdog(self):
+        if self.watchdog is None:
+            self.watchdog = threading.Thread(target=self._watch, name='process-watchdog')
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    def _watch(self):
+        """Watchdog thread: kill processes past their deadline or whose work was cancelled"""
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self.lock:
+                processes = list(self.processes)
+            for process in processes:
+                if process.killed_reason:
+                    continue
+                if process.cancel_event is not None and process.cancel_event.is_set():
+                    self.kill(process, 'cancelled')
+                elif process.deadline is not None and now > process.deadline:
+                    self.kill(process, 'timeout')
+
+    def spawn(self, cmd, kind, timeout=None, cancel_event=None, **popen_kwargs):
+        """Start cmd supervised and return a SupervisedProcess
+
+        timeout overrides the default wall-clock limit; setting cancel_event kills
+        the process within one watchdog interval.
+        """
+        if os.name == 'posix':
+            popen_kwargs.setdefault('start_new_session', True)
+        return self.track(subprocess.Popen(cmd, **popen_kwargs), kind, timeout=timeout, cancel_event=cancel_event)
+
+    def track(self, popen, kind, timeout=None, cancel_event=None):
+        """Supervise a process started elsewhere, e.g. with asyncio.create_subprocess_exec
+
+        It should have been started in a new session so its group can be killed.
+        """
+        self._apply_limits(popen.pid)
+
+        timeout = self.timeout if timeout is None else timeout
+        process = SupervisedProcess(popen, kind, time.time() + timeout if timeout else None, cancel_event)
+        with self.lock:
+            self.processes.append(process)
+            self.spawned += 1
+        self._ensure_watchdog()
+        logger.debug(f"Started {kind} process {popen.pid}")
+        return process
+
+    def kill(self, process, reason):
+        """Kill a process and its whole process group"""
+        with self.lock:
+            if process.done or process.killed_reason:
+                return
+            process.killed_reason = reason
+            self.kills[(process.kind, reason)] = self.kills.get((process.kind, reason), 0) + 1
+
+        logger.warning(f"Killing {process.kind} process {process.pid} ({reason})")
+        PROCESS_KILLS.inc(kind=process.kind, reason=reason)
+        if os.name == 'posix':
+            self._kill_group(process)
+        else:
+            try:
+                process.popen.kill()
+            except OSError:
+                pass
+
+    def release(self, process, returncode=None, cpu_seconds=None):
+        """Forget a process once it has been waited for"""
+        # Hitting the CPU rlimit shows up as SIGXCPU rather than through the watchdog
+        cpu_limited = hasattr(signal, 'SIGXCPU') and returncode == -signal.SIGXCPU
+        with self.lock:
+            if process.done:
+                return
+            process.done = True
+            if process in self.processes:
+                self.processes.remove(process)
+            self.finished += 1
+            if cpu_limited and not process.killed_reason:
+                process.killed_reason = 'cpu_limit'
+                self.kills[(process.kind, 'cpu_limit')] = self.kills.get((process.kind, 'cpu_limit'), 0) + 1
+                PROCESS_KILLS.inc(kind=process.kind, reason='cpu_limit')
+            elif returncode and not process.killed_reason:
+                self.failed += 1
+            if cpu_seconds:
+                self.cpu_seconds_used += cpu_seconds
+
+    def _kill_group(self, process):
+        """Kill whatever the child left running in its process group"""
+        if os.name == 'posix':
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def run(self, cmd, kind, timeout=None, cancel_event=None):
+        """Run cmd to completion and return (process, stderr text, CPU seconds used)
+
+        The returncode is on process.popen and process.killed_reason says whether
+        the supervisor killed it. CPU time comes from wait4() where available; it
+        is None elsewhere.
+        """
+        process = self.spawn(cmd, kind, timeout=timeout, cancel_event=cancel_event,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        popen = process.popen
+        cpu_seconds = None
+        try:
+            stderr = popen.stderr.read().decode('utf-8', errors='replace')
+            popen.stderr.close()
+            if hasattr(os, 'waitid'):
+                # Wait for the exit without reaping, so the group ID cannot have been reused yet
+                os.waitid(os.P_PID, popen.pid, os.WEXITED | os.WNOWAIT)
+                self._kill_group(process)
+            if hasattr(os, 'wait4'):
+                _, status, usage = os.wait4(popen.pid, 0)
+                # Keep Popen from waiting on the already reaped process
+                popen.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                cpu_seconds = usage.ru_utime + usage.ru_stime
+            else:
+                popen.wait()
+        finally:
+            self.release(process, popen.returncode, cpu_seconds)
+        return process, stderr, cpu_seconds
+
+    def record_abort(self, kind, reason):
+        """Count work stopped in-process (embedded yt-dlp) for a timeout or cancellation"""
+        with self.lock:
+            self.kills[(kind, reason)] = self.kills.get((kind, reason), 0) + 1
+        PROCESS_KILLS.inc(kind=kind, reason=reason)
+
+    def stats(self):
+        """Get counts of running, finished and killed processes"""
+        with self.lock:
+            kills = {}
+            for (kind, reason), count in self.kills.items():
+                kills.setdefault(kind, {})[reason] = count
+            return {
+                'running': len(self.processes),
+                'spawned': self.spawned,
+                'finished': self.finished,
+                'failed': self.failed,
+                'timeouts': sum(count for (_, reason), count in self.kills.items() if reason == 'timeout'),
+                'kills': sum(self.kills.values()),
+                'kills_by_kind': kills,
+                'cpu_seconds': round(self.cpu_seconds_used, 3),
+                'limits': {
+                    'timeout': self.timeout,
+                    'cpu_seconds': self.cpu_seconds,
+                    'memory_bytes': self.memory_bytes,
+                    'nice': self.nice,
+                },
+            }
+
+
+# Singleton instance
+_process_supervisor = None
+
+def get_process_supervisor(**kwargs):
+    """Get the singleton ProcessSupervisor instance"""
+    global _process_supervisor
+    if _process_supervisor is None:
+        _process_supervisor = ProcessSupervisor(**kwargs)
+    return _process_supervisor
@@ -0,0 +1,137 @@
+import math
+import time
+import logging
+import threading
+
+from utils.worker_pool import PoolSaturatedError
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedError(PoolSaturatedError):
+    """Raised when an upstream call would have to wait longer than the caller allows"""
+
+
+class RateController:
+    """Token bucket shared by every upstream call, with AIMD adjustment of its rate
+
+    Calls within the budget take a token and go straight through. Each success
+    raises the rate additively and each 429 cuts it multiplicatively and empties
+    the bucket, so callers are spaced out only while the upstream is pushing back.
+    """
+
+    def __init__(self, rate=2.0, burst=5, min_rate=0.2, max_rate=10.0, increase=0.05, decrease=0.5,
+                 decrease_interval=5):
+        self.rate = rate  # tokens added per second
+        self.burst = burst  # bucket capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase  # tokens/second added per successful call
+        self.decrease = decrease  # factor applied to the rate on a 429
+        self.decrease_interval = decrease_interval  # 429s within this many seconds of a cut count once
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, max_wait=None):
+        """Take a token, sleeping until it is due; return the seconds waited
+
+        Raises RateLimitedError instead of waiting longer than max_wait seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                self.rejected += 1
+                raise RateLimitedError(
+                    f"Upstream rate limit reached ({self.rate:.2f} requests/s)",
+                    retry_after=max(1, math.ceil(wait))
+                )
+            # Reserve the token now so concurrent callers queue up behind this one
+            self.tokens -= 1
+            self.acquired += 1
+            if wait > 0:
+                self.delayed += 1
+                self.total_wait += wait
+
+        if wait > 0:
+            logger.debug(f"Delaying upstream call by {wait:.2f}s")
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        """Additive increase after an upstream call went through"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self):
+        """Multiplicative decrease after the upstream answered 429"""
+        with self.lock:
+            self.rate_limited += 1
+            now = time.monotonic()
+            if now - self.last_decrease < self.decrease_interval:
+                return
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_decrease = now
+            logger.warning(f"Upstream rate limited, slowing down to {self.rate:.2f} requests/s")
+
+    def scale(self, factor):
+        """Scale every rate setting, e.g. to split one upstream budget between worker processes"""
+        with self.lock:
+            self.rate *= factor
+            self.min_rate *= factor
+            self.max_rate *= factor
+            self.increase *= factor
+            self.burst = max(1, self.burst * factor)
+            self.tokens = min(self.tokens, self.burst)
+
+    def backoff(self):
+        """Seconds until the next token is available, 0 when a call would go straight through"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def stats(self):
+        """Get the current rate, bucket level and backoff state"""
+        backoff = self.backoff()
+        with self.lock:
+            return {
+                'rate': round(self.rate, 3),
+                'min_rate': self.min_rate,
+                'max_rate': self.max_rate,
+                'tokens': round(self.tokens, 2),
+                'burst': self.burst,
+                'backoff_seconds': round(backoff, 3),
+                'backing_off': backoff > 0,
+                'acquired': self.acquired,
+                'delayed': self.delayed,
+                'rejected': self.rejected,
+                'rate_limited': self.rate_limited,
+                'avg_delay_ms': round(self.total_wait / self.delayed * 1000, 1) if self.delayed else 0.0,
+                'seconds_since_decrease': (round(time.monotonic() - self.last_decrease, 1)
+                                           if self.last_decrease else None),
+            }
+
+
+# Singleton instance
+_rate_controller = None
+
+def get_rate_controller(**kwargs):
+    """Get the singleton RateController instance"""
+    global _rate_controller
+    if _rate_controller is None:
+        _rate_controller = RateController(**kwargs)
+    return _rate_controller
@@ -0,0 +1,171 @@
+import os
+import re
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Finished downloads are named <file_id>.<ext>; anything else is a yt-dlp intermediate
+FINISHED_FILE_RE = re.compile(r'^([a-zA-Z0-9-]+)\.(mp4|mp3)$')
+
+
+class RetentionSweeper:
+    """Deletes stale partial files and enforces age and size quotas on the download folder"""
+
+    def __init__(self, download_folder, download_cache, max_age=24 * 60 * 60, max_bytes=10 * 1024 * 1024 * 1024,
+                 partial_max_age=60 * 60, interval=600, dry_run=False):
+        self.download_folder = download_folder
+        self.download_cache = download_cache
+        self.max_age = max_age  # seconds since a download was last served
+        self.max_bytes = max_bytes  # total size of finished downloads
+        self.partial_max_age = partial_max_age  # seconds since an intermediate file was last written
+        self.interval = interval
+        self.dry_run = dry_run
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.files_deleted = 0
+        self.partials_deleted = 0
+        self.bytes_reclaimed = 0
+        self.last_run = None
+        self.last_report = None
+
+    def _scan(self):
+        """List finished downloads and intermediate files in the download folder"""
+        finished, partials = [], []
+        with os.scandir(self.download_folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                stat = entry.stat()
+                match = FINISHED_FILE_RE.match(entry.name)
+                if match:
+                    file_id = match.group(1)
+                    last_used = max(stat.st_mtime, self.download_cache.last_access(file_id) or 0)
+                    finished.append({'path': entry.path, 'file_id': file_id,
+                                     'size': stat.st_size, 'last_used': last_used})
+                else:
+                    partials.append({'path': entry.path, 'size': stat.st_size, 'last_used': stat.st_mtime})
+        return finished, partials
+
+    def _delete(self, item, dry_run):
+        """Delete one file, returning True if it was (or would have been) removed"""
+        if dry_run:
+            return True
+        try:
+            os.remove(item['path'])
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Could not delete {item['path']}: {e}")
+            return False
+        if 'file_id' in item:
+            self.download_cache.remove(item['file_id'])
+        return True
+
+    def sweep(self, dry_run=None):
+        """Run one retention pass and return a report of what was (or would be) deleted"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        start = time.time()
+        finished, partials = self._scan()
+        deleted = []
+
+        # Stale intermediates from failed or abandoned downloads
+        for item in partials:
+            if start - item['last_used'] > self.partial_max_age and self._delete(item, dry_run):
+                deleted.append(dict(item, reason='partial'))
+
+        # Least recently served first, so size eviction removes the coldest files
+        finished.sort(key=lambda item: item['last_used'])
+        total = sum(item['size'] for item in finished)
+        for item in finished:
+            if start - item['last_used'] > self.max_age:
+                reason = 'age'
+            elif total > self.max_bytes:
+                reason = 'quota'
+            else:
+                continue
+            if self._delete(item, dry_run):
+                total -= item['size']
+                deleted.append(dict(item, reason=reason))
+
+        reclaimed = sum(item['size'] for item in deleted)
+        report = {
+            'dry_run': dry_run,
+            'started_at': start,
+            'duration_ms': round((time.time() - start) * 1000, 1),
+            'files_deleted': sum(1 for item in deleted if item['reason'] != 'partial'),
+            'partials_deleted': sum(1 for item in deleted if item['reason'] == 'partial'),
+            'bytes_reclaimed': reclaimed,
+            'bytes_remaining': total,
+            'deleted': [{'file': os.path.basename(item['path']), 'size': item['size'], 'reason': item['reason']}
+                        for item in deleted],
+        }
+
+        with self.lock:
+            self.runs += 1
+            self.last_run = start
+            self.last_report = report
+            if not dry_run:
+                self.files_deleted += report['files_deleted']
+                self.partials_deleted += report['partials_deleted']
+                self.bytes_reclaimed += reclaimed
+
+        if deleted:
+            logger.info(f"Retention sweep {'(dry run) ' if dry_run else ''}removed {len(deleted)} files, "
+                        f"{reclaimed} bytes")
+        return report
+
+    def _sweep_loop(self):
+        """Background thread function for periodic sweeps"""
+        logger.info(f"Starting retention sweeps every {self.interval} seconds")
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.exception(f"Retention sweep failed: {e}")
+
+    def start(self):
+        """Start the sweeper thread"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sweep_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the sweeper thread"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def stats(self):
+        """Get cumulative sweep metrics"""
+        with self.lock:
+            return {
+                'runs': self.runs,
+                'last_run': self.last_run,
+                'dry_run': self.dry_run,
+                'files_deleted': self.files_deleted,
+                'partials_deleted': self.partials_deleted,
+                'bytes_reclaimed': self.bytes_reclaimed,
+                'max_age': self.max_age,
+                'max_bytes': self.max_bytes,
+                'partial_max_age': self.partial_max_age,
+                'last_report': self.last_report,
+            }
+
+
+# Singleton instance
+_retention_sweeper = None
+
+def get_retention_sweeper(download_folder, download_cache, **kwargs):
+    """Get the singleton RetentionSweeper instance"""
+    global _retention_sweeper
+    if _retention_sweeper is None:
+        _retention_sweeper = RetentionSweeper(download_folder, download_cache, **kwargs)
+    return _retention_sweeper
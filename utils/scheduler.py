@@ -0,0 +1,92 @@
+import time
+import itertools
+import threading
+
+
+class FairScheduler:
+    """Orders queued jobs by priority class, then by per-client weighted fair queuing
+
+    Each client's jobs get virtual finish tags (start + cost / weight), so a client
+    submitting many jobs only gets its weighted share of the workers. Lower priority
+    classes run first; a job's class improves by one for every `aging` seconds it
+    waits, so expensive jobs are never starved.
+    """
+
+    def __init__(self, weights=None, aging=60):
+        self.weights = weights or {}  # client -> weight, default 1
+        self.aging = aging
+        self.virtual_time = 0.0
+        self.client_finish = {}  # client -> finish tag of its last queued job
+        self.entries = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def push(self, item, client=None, priority=0, cost=1.0):
+        """Queue an item for a client with a priority class and expected cost"""
+        with self.lock:
+            weight = self.weights.get(client, 1.0)
+            start = max(self.virtual_time, self.client_finish.get(client, 0.0))
+            finish = start + max(cost, 0.001) / weight
+            self.client_finish[client] = finish
+            self.entries.append({
+                'item': item,
+                'client': client,
+                'priority': priority,
+                'finish': finish,
+                'seq': next(self.counter),
+                'queued_at': time.time(),
+            })
+
+    def _rank(self, entry, now):
+        waited_classes = int((now - entry['queued_at']) // self.aging) if self.aging else 0
+        return (entry['priority'] - waited_classes, entry['finish'], entry['seq'])
+
+    def pop(self):
+        """Remove and return the next item to run, or None if nothing is queued"""
+        with self.lock:
+            if not self.entries:
+                return None
+            now = time.time()
+            entry = min(self.entries, key=lambda entry: self._rank(entry, now))
+            self.entries.remove(entry)
+            self.virtual_time = max(self.virtual_time, entry['finish'])
+            if not self.entries:
+                # Idle: forget history so returning clients start on equal terms
+                self.virtual_time = 0.0
+                self.client_finish.clear()
+            return entry['item']
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Get the number of queued items per client and priority class"""
+        with self.lock:
+            clients, priorities = {}, {}
+            for entry in self.entries:
+                client, priority = str(entry['client']), str(entry['priority'])
+                clients[client] = clients.get(client, 0) + 1
+                priorities[priority] = priorities.get(priority, 0) + 1
+            return {'queued': len(self.entries), 'clients': clients, 'priorities': priorities}
+
+
+class FifoScheduler:
+    """Runs queued jobs in submission order, ignoring client and priority"""
+
+    def __init__(self):
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def push(self, item, client=None, priority=0, cost=1.0):
+        with self.lock:
+            self.entries.append(item)
+
+    def pop(self):
+        with self.lock:
+            return self.entries.pop(0) if self.entries else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {'queued': len(self.entries)}
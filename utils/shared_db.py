@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import weakref
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Every SharedDatabase in this process, so a forked child can reopen them all
+_databases = weakref.WeakSet()
+# Connections inherited from a parent process, kept referenced so the child never closes them
+_inherited = []
+
+
+class SharedDatabase:
+    """SQLite file shared by every worker process, with one connection per process
+
+    The connection is opened on first use in each process. A connection the parent
+    had already opened is never used or closed by a forked child: closing it could
+    checkpoint and remove the WAL the parent is still writing. WAL mode lets readers
+    in one worker run alongside a writer in another.
+    """
+
+    def __init__(self, path, schema=(), timeout=30):
+        self.path = path
+        self.schema = schema  # statements run once per connection, e.g. CREATE TABLE IF NOT EXISTS
+        self.timeout = timeout  # seconds to wait for another process's write lock
+        self.lock = threading.RLock()
+        self.connection = None
+        self.pid = None
+        _databases.add(self)
+
+    def _forget_inherited(self):
+        if self.connection is not None and self.pid != os.getpid():
+            _inherited.append(self.connection)
+            self.connection = None
+
+    def reopen(self):
+        """Drop state inherited from the parent process; the next statement opens a new connection"""
+        # The parent's lock may have been held by one of its threads at fork time
+        self.lock = threading.RLock()
+        self._forget_inherited()
+
+    def _connect(self):
+        self._forget_inherited()
+        if self.connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # Autocommit: each statement is its own transaction unless transaction() is used
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                connection.execute(statement)
+            self.connection = connection
+            self.pid = os.getpid()
+            logger.debug(f"Opened shared database {self.path} in process {self.pid}")
+        return self.connection
+
+    def execute(self, sql, params=()):
+        """Run one statement and return all result rows"""
+        with self.lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """Run several statements atomically across processes; yields the connection"""
+        with self.lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+
+def reopen_shared_databases():
+    """Call in a forked child before it uses any SharedDatabase created by its parent"""
+    for database in list(_databases):
+        database.reopen()
+
+
+def pid_alive(pid):
+    """Check whether a process (e.g. the worker owning a job) is still running"""
+    if os.name != 'posix':
+        # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
@@ -0,0 +1,73 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """An in-flight execution shared by every caller with the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self.calls = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func() unless a call with the same key is in flight, in which case wait for its outcome"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self.calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            logger.debug(f"Waiting on in-flight call for {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        """Get execution and coalescing counters"""
+        with self.lock:
+            return {
+                'in_flight': len(self.calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+            }
+
+
+# Singleton instance
+_single_flight = None
+
+def get_single_flight():
+    """Get the singleton SingleFlight instance"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from utils.shared_db import SharedDatabase, pid_alive
+
+logger = logging.getLogger(__name__)
+
+
+class StreamCache:
+    """Cache of raw elementary streams keyed by (video ID, yt-dlp format ID)
+
+    Every preset is derived locally from these, so a video-only or audio-only
+    stream is fetched from the network at most once while it stays cached.
+    With db_path the index and the pins live in SQLite, shared by every worker
+    process, so one worker never evicts a stream another one is reading.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    # Video IDs come from user supplied URLs and end up in file names
+    VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+    def __init__(self, folder, max_bytes=5 * 1024 * 1024 * 1024, db_path=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(folder, self.INDEX_FILE)
+        self.entries = {}
+        self.pins = {}  # key -> number of jobs currently reading the stream
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+        if db_path:
+            self.db = SharedDatabase(db_path, schema=(
+                'CREATE TABLE IF NOT EXISTS streams (key TEXT PRIMARY KEY, entry TEXT NOT NULL, last_access REAL NOT NULL)',
+                'CREATE TABLE IF NOT EXISTS stream_pins (key TEXT NOT NULL, pid INTEGER NOT NULL)',
+            ))
+
+        os.makedirs(folder, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def _key(video_id, format_id):
+        return f"{video_id}:{format_id}"
+
+    @classmethod
+    def valid_video_id(cls, video_id):
+        """Check that a video ID is safe to use as a cache key and file name"""
+        return isinstance(video_id, str) and bool(cls.VIDEO_ID_PATTERN.match(video_id))
+
+    def _file_path(self, video_id, format_id, ext):
+        if not self.valid_video_id(video_id):
+            raise ValueError(f"Invalid video ID for the stream cache: {video_id!r}")
+        safe_format = re.sub(r'[^\w-]', '_', str(format_id))
+        safe_ext = re.sub(r'[^\w]', '_', ext)
+        path = os.path.join(self.folder, f"{video_id}.{safe_format}.{safe_ext}")
+
+        folder = os.path.realpath(self.folder)
+        if os.path.commonpath([folder, os.path.realpath(path)]) != folder:
+            raise ValueError(f"Stream cache path escapes {self.folder}: {path}")
+        return path
+
+    def _load_index(self):
+        """Load the persisted index, dropping entries whose files are gone"""
+        if self.db is not None:
+            self._refresh()
+            logger.info(f"Loaded {len(self.entries)} cached source streams")
+            return
+
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable stream cache index: {e}")
+            return
+
+        self.entries = {key: entry for key, entry in entries.items() if os.path.exists(entry['path'])}
+        logger.info(f"Loaded {len(self.entries)} cached source streams")
+
+    def _refresh(self):
+        """Replace the in-memory index with the shared one, which other workers also update"""
+        entries = {}
+        for key, entry, last_access in self.db.execute('SELECT key, entry, last_access FROM streams'):
+            entry = json.loads(entry)
+            entry['last_access'] = last_access
+            if os.path.exists(entry['path']):
+                entries[key] = entry
+        self.entries = entries
+
+    def _shared_pins(self):
+        """Keys pinned by any live worker, dropping pins left behind by dead ones"""
+        pinned = set()
+        for key, pid in self.db.execute('SELECT DISTINCT key, pid FROM stream_pins'):
+            if pid_alive(pid):
+                pinned.add(key)
+            else:
+                self.db.execute('DELETE FROM stream_pins WHERE pid = ?', (pid,))
+        return pinned
+
+    def _save_entry(self, key):
+        """Persist one new or changed entry"""
+        if self.db is None:
+            self._save_index()
+            return
+        entry = self.entries[key]
+        self.db.execute('INSERT OR REPLACE INTO streams (key, entry, last_access) VALUES (?, ?, ?)',
+                        (key, json.dumps(entry), entry['last_access']))
+
+    def _forget(self, keys):
+        """Persist the removal of entries already deleted from self.entries"""
+        if not keys:
+            return
+        if self.db is None:
+            self._save_index()
+            return
+        for key in keys:
+            self.db.execute('DELETE FROM streams WHERE key = ?', (key,))
+
+    def _save_index(self):
+        """Persist the index atomically"""
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _evict(self, keep=None):
+        """Remove least recently used streams that no job is reading until the cache fits"""
+        pinned = set(self.pins)
+        if self.db is not None:
+            # Streams cached and read by every worker, not just this one
+            self._refresh()
+            pinned |= self._shared_pins()
+        evicted = []
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in pinned:
+                continue
+            try:
+                os.remove(entry['path'])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict cached stream {key}: {e}")
+                continue
+            del self.entries[key]
+            evicted.append(key)
+            total -= entry['size']
+            self.evictions += 1
+            logger.info(f"Evicted cached stream {key} ({entry['size']} bytes)")
+        self._forget(evicted)
+
+    def _pin(self, key):
+        entry = self.entries.get(key)
+        if entry is None and self.db is not None:
+            # Another worker may have fetched it
+            rows = self.db.execute('SELECT entry FROM streams WHERE key = ?', (key,))
+            if rows:
+                entry = self.entries[key] = json.loads(rows[0][0])
+        if entry and not os.path.exists(entry['path']):
+            del self.entries[key]
+            self._forget([key])
+            entry = None
+        if entry is None:
+            return None
+
+        entry['last_access'] = time.time()
+        self.pins[key] = self.pins.get(key, 0) + 1
+        if self.db is not None:
+            self.db.execute('UPDATE streams SET last_access = ? WHERE key = ?', (entry['last_access'], key))
+            self.db.execute('INSERT INTO stream_pins (key, pid) VALUES (?, ?)', (key, os.getpid()))
+        return entry['path']
+
+    def get(self, video_id, format_id):
+        """Get the path of a cached stream and pin it, or None on a miss
+
+        A pinned stream is not evicted until unpin() is called.
+        """
+        with self.lock:
+            path = self._pin(self._key(video_id, format_id))
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return path
+
+    def pin(self, video_id, format_id):
+        """Pin a stream just stored by put(), without counting a lookup"""
+        with self.lock:
+            return self._pin(self._key(video_id, format_id))
+
+    def put(self, video_id, format_id, file_path):
+        """Move a downloaded stream into the cache and return its cached path"""
+        key = self._key(video_id, format_id)
+        ext = os.path.splitext(file_path)[1].lstrip('.')
+        path = self._file_path(video_id, format_id, ext)
+        entry = {
+            'path': path,
+            'size': os.path.getsize(file_path),
+            'created': time.time(),
+            'last_access': time.time(),
+        }
+
+        with self.lock:
+            os.replace(file_path, path)
+            self.entries[key] = entry
+            self._save_entry(key)
+            self._evict(keep=key)
+
+        logger.info(f"Cached source stream {key} ({entry['size']} bytes)")
+        return path
+
+    def unpin(self, video_id, format_id):
+        """Release a stream pinned by get() or pin()"""
+        key = self._key(video_id, format_id)
+        with self.lock:
+            count = self.pins.get(key, 0) - 1
+            if count > 0:
+                self.pins[key] = count
+            else:
+                self.pins.pop(key, None)
+            if self.db is not None:
+                self.db.execute(
+                    'DELETE FROM stream_pins WHERE rowid IN '
+                    '(SELECT rowid FROM stream_pins WHERE key = ? AND pid = ? LIMIT 1)',
+                    (key, os.getpid())
+                )
+
+    def stats(self):
+        """Get cache hit/miss counters and usage"""
+        with self.lock:
+            if self.db is not None:
+                self._refresh()
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': sum(entry['size'] for entry in self.entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'pinned': len(self.pins),
+            }
+
+
+# Singleton instance
+_stream_cache = None
+
+def get_stream_cache(folder, max_bytes=5 * 1024 * 1024 * 1024, db_path=None):
+    """Get the singleton StreamCache instance"""
+    global _stream_cache
+    if _stream_cache is None:
+        _stream_cache = StreamCache(folder, max_bytes=max_bytes, db_path=db_path)
+    return _stream_cache
@@ -1,3 +1,4 @@
+import re
 import time
 import logging
 import threading
@@ -9,10 +10,12 @@ import stem
 import stem.control
 import stem.process
 import schedule
-import requests
 import random
-from stem import Signal
-from stem.control import Controller
+from stem import Signal, CircStatus, StreamStatus
+from stem.control import Controller, EventType
+
+from utils.http_pool import get_http_pool
+from utils.metrics import TOR_ROTATIONS
 
 # Configure logging
 logging.basicConfig(
@@ -21,8 +24,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Bootstrap progress lines tor logs to stdout, e.g. "Bootstrapped 100% (done): Done"
+BOOTSTRAP_RE = re.compile(r'Bootstrapped (\d+)%(?: \(\w+\))?: (.*)')
+
 class TorController:
-    def __init__(self, tor_port=9050, control_port=9051, password=None):
+    _tor_path = None  # memoised executable path, shared by all instances
+    
+    def __init__(self, tor_port=9050, control_port=9051, password=None, data_dir=None):
         self.tor_port = tor_port
         self.control_port = control_port
         self.password = password or self._generate_password()
@@ -33,7 +41,26 @@ class TorController:
         self.stop_event = threading.Event()
         self.last_ip = None
         self.rotation_count = 0
-        self.tor_data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tor_data')
+        self.controller = None  # persistent control port connection
+        self.circuits = {}  # circuit ID -> exit relay fingerprint, for built general-purpose circuits
+        self.stream_circuit = None  # circuit used by the most recent successful stream
+        self.exit_addresses = {}  # relay fingerprint -> IP address
+        self.circuit_lock = threading.Lock()
+        self.circuit_changed = threading.Condition(self.circuit_lock)
+        self.circuit_wait_timeout = 5  # seconds to wait for a fresh circuit after NEWNYM
+        self.probe_interval = 60  # minimum seconds between external IP probes
+        self.last_probe_time = 0
+        self.last_probe_result = (False, None)
+        self.ready_event = threading.Event()  # set once tor has bootstrapped to 100%
+        self.startup_done = threading.Event()  # set when startup finished, successfully or not
+        self.ready_callbacks = []
+        self.bootstrap_progress = 0
+        self.bootstrap_summary = None
+        self.output_tail = []  # last lines of tor output, for startup error reporting
+        self.attached = False  # tor is run by another process with our ports and password; we only connect to it
+        self.attach_poll_interval = 1  # seconds between control port checks while waiting for that tor
+        self._hashed_password = None
+        self.tor_data_dir = data_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tor_data')
         
         # Create tor data directory if it doesn't exist
         if not os.path.exists(self.tor_data_dir):
@@ -61,6 +88,9 @@ class TorController:
     
     def _get_hashed_password(self):
         """Get the hashed password for Tor control authentication"""
+        if self._hashed_password:
+            return self._hashed_password
+        
         tor_path = self._find_tor_executable()
         if not tor_path:
             raise Exception("Tor executable not found. Please install Tor.")
@@ -72,14 +102,18 @@ class TorController:
                 text=True,
                 check=True
             )
-            hashed_password = result.stdout.strip()
-            return hashed_password
+            # The hash is salted, so only the first one is kept
+            self._hashed_password = result.stdout.strip().splitlines()[-1]
+            return self._hashed_password
         except subprocess.CalledProcessError as e:
             logger.error(f"Error generating hashed password: {e}")
             raise
     
     def _find_tor_executable(self):
         """Find the Tor executable path"""
+        if TorController._tor_path:
+            return TorController._tor_path
+        
         possible_paths = [
             'tor',
             '/usr/bin/tor',
@@ -92,6 +126,7 @@ class TorController:
         for path in possible_paths:
             try:
                 subprocess.run([path, '--version'], capture_output=True, check=True)
+                TorController._tor_path = path
                 return path
             except (subprocess.CalledProcessError, FileNotFoundError):
                 continue
@@ -99,10 +134,13 @@ class TorController:
         return None
     
     def start_tor(self):
-        """Start the Tor process"""
+        """Start the Tor process without waiting for it to bootstrap"""
         if self.is_running:
             logger.info("Tor is already running")
             return
+        if self.attached:
+            logger.info(f"Tor on port {self.tor_port} is run by another process")
+            return
         
         tor_path = self._find_tor_executable()
         if not tor_path:
@@ -117,26 +155,23 @@ class TorController:
             for key, value in config.items():
                 cmd.extend([f'--{key}', value])
             
+            self.ready_event.clear()
+            self.startup_done.clear()
+            self.bootstrap_progress = 0
+            self.bootstrap_summary = None
+            self.output_tail = []
             self.tor_process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True
             )
-            
-            # Wait for Tor to start
-            time.sleep(5)
-            
-            # Check if Tor is running
-            if self.tor_process.poll() is not None:
-                stderr = self.tor_process.stderr.read()
-                raise Exception(f"Failed to start Tor: {stderr}")
-            
             self.is_running = True
-            logger.info("Tor process started successfully")
             
-            # Start IP rotation in a separate thread
-            self.start_ip_rotation()
+            # Follow bootstrap progress from tor's log output
+            output_thread = threading.Thread(target=self._watch_output, args=(self.tor_process,))
+            output_thread.daemon = True
+            output_thread.start()
             
             return True
         except Exception as e:
@@ -144,19 +179,141 @@ class TorController:
             if self.tor_process:
                 self.tor_process.terminate()
                 self.tor_process = None
+            self.is_running = False
             raise
     
+    def _watch_output(self, process):
+        """Read tor's log output, tracking bootstrap progress until the process exits"""
+        bootstrapped = False
+        for line in process.stdout:
+            line = line.rstrip()
+            self.output_tail = (self.output_tail + [line])[-20:]
+            match = BOOTSTRAP_RE.search(line)
+            if not match:
+                continue
+            
+            self.bootstrap_progress = int(match.group(1))
+            self.bootstrap_summary = match.group(2)
+            logger.info(f"Tor bootstrap {self.bootstrap_progress}%: {self.bootstrap_summary}")
+            if self.bootstrap_progress == 100 and not bootstrapped:
+                bootstrapped = True
+                self._on_ready()
+        
+        process.wait()
+        if not bootstrapped and self.tor_process is process:
+            logger.error(f"Tor exited during startup: {' | '.join(self.output_tail[-5:])}")
+            self.tor_process = None
+            self.is_running = False
+        self.startup_done.set()
+    
+    def _on_ready(self, rotate=True):
+        """Finish startup once tor has bootstrapped"""
+        logger.info("Tor process started successfully")
+        
+        # Keep one control connection open and follow circuit events on it
+        try:
+            self._connect_controller()
+        except Exception as e:
+            logger.error(f"Error connecting to Tor control port: {e}")
+        
+        # Start IP rotation in a separate thread; an attached controller leaves it to the process running tor
+        if rotate:
+            self.start_ip_rotation()
+        
+        self.ready_event.set()
+        self.startup_done.set()
+        for callback in self.ready_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Tor ready callback failed: {e}")
+    
+    def on_ready(self, callback):
+        """Register a function to call each time tor finishes starting"""
+        self.ready_callbacks.append(callback)
+    
+    def attach(self):
+        """Use a tor process another process runs with this controller's ports and password
+
+        Gunicorn workers attach to the tor the master's shared services process
+        started, instead of each starting their own on the same ports. Returns at
+        once; the controller becomes ready once that tor has bootstrapped.
+        """
+        if self.attached or self.is_running:
+            return
+        self.attached = True
+        self.ready_event.clear()
+        self.startup_done.clear()
+        attach_thread = threading.Thread(target=self._wait_for_shared_tor)
+        attach_thread.daemon = True
+        attach_thread.start()
+    
+    def _wait_for_shared_tor(self):
+        """Poll the control port until the shared tor has bootstrapped, then connect to it"""
+        while self.attached:
+            try:
+                with Controller.from_port(port=self.control_port) as controller:
+                    controller.authenticate(password=self.password)
+                    phase = controller.get_info('status/bootstrap-phase')
+                progress = re.search(r'PROGRESS=(\d+)', phase)
+                summary = re.search(r'SUMMARY="([^"]*)"', phase)
+                self.bootstrap_progress = int(progress.group(1)) if progress else 0
+                self.bootstrap_summary = summary.group(1) if summary else None
+                if self.bootstrap_progress == 100:
+                    logger.info(f"Attached to shared Tor on port {self.tor_port}")
+                    self._on_ready(rotate=False)
+                    return
+            except (stem.SocketError, stem.ControllerError, stem.connection.AuthenticationFailure) as e:
+                logger.debug(f"Shared Tor on port {self.control_port} not available yet: {e}")
+            time.sleep(self.attach_poll_interval)
+    
+    def wait_until_ready(self, timeout=None):
+        """Wait for a tor startup in progress, returning True if tor is ready"""
+        if self.tor_process is None and not self.attached:
+            return self.ready_event.is_set()
+        self.startup_done.wait(timeout)
+        return self.ready_event.is_set()
+    
+    def startup_status(self):
+        """Get the tor bootstrap state"""
+        return {
+            'running': self.is_running or self.attached,
+            'attached': self.attached,
+            'ready': self.ready_event.is_set(),
+            'bootstrap_progress': self.bootstrap_progress,
+            'bootstrap_summary': self.bootstrap_summary,
+        }
+    
     def stop_tor(self):
         """Stop the Tor process"""
+        if self.attached:
+            # Only disconnect; the process running tor stops it
+            self.attached = False
+            self.ready_event.clear()
+            if self.controller:
+                self.controller.close()
+                self.controller = None
+            return
+        
         if not self.is_running:
             logger.info("Tor is not running")
             return
         
         logger.info("Stopping Tor process...")
         
+        self.ready_event.clear()
+        
         # Stop IP rotation thread
         self.stop_ip_rotation()
         
+        # Close the control connection
+        if self.controller:
+            self.controller.close()
+            self.controller = None
+        with self.circuit_lock:
+            self.circuits.clear()
+            self.stream_circuit = None
+        
         # Terminate Tor process
         if self.tor_process:
             self.tor_process.terminate()
@@ -169,32 +326,134 @@ class TorController:
         self.is_running = False
         logger.info("Tor process stopped")
     
+    def _connect_controller(self):
+        """Open the persistent control connection and subscribe to circuit and stream events"""
+        controller = Controller.from_port(port=self.control_port)
+        controller.authenticate(password=self.password)
+        controller.add_event_listener(self._handle_circuit_event, EventType.CIRC)
+        controller.add_event_listener(self._handle_stream_event, EventType.STREAM)
+        
+        # Seed the state with circuits built before we subscribed
+        with self.circuit_lock:
+            self.circuits = {
+                circ.id: circ.path[-1][0]
+                for circ in controller.get_circuits()
+                if circ.status == CircStatus.BUILT and circ.purpose == 'GENERAL' and circ.path
+            }
+        
+        self.controller = controller
+        logger.info(f"Connected to Tor control port, {len(self.circuits)} circuits built")
+        return controller
+    
+    def _get_controller(self):
+        """Get the persistent control connection, reconnecting if it dropped"""
+        if self.controller is not None and self.controller.is_alive():
+            return self.controller
+        if not self.is_running and not self.attached:
+            return None
+        
+        logger.warning("Tor control connection lost, reconnecting")
+        try:
+            return self._connect_controller()
+        except (stem.SocketError, stem.connection.AuthenticationFailure) as e:
+            logger.error(f"Error connecting to Tor control port: {e}")
+            self.controller = None
+            return None
+    
+    def _handle_circuit_event(self, event):
+        """Track built circuits from CIRC events"""
+        with self.circuit_changed:
+            if event.status == CircStatus.BUILT and event.purpose == 'GENERAL' and event.path:
+                self.circuits[event.id] = event.path[-1][0]
+                self.circuit_changed.notify_all()
+            elif event.status in (CircStatus.CLOSED, CircStatus.FAILED):
+                self.circuits.pop(event.id, None)
+                if self.stream_circuit == event.id:
+                    self.stream_circuit = None
+    
+    def _handle_stream_event(self, event):
+        """Remember which circuit carries our traffic from STREAM events"""
+        if event.status == StreamStatus.SUCCEEDED and event.circ_id:
+            with self.circuit_lock:
+                self.stream_circuit = event.circ_id
+    
+    def get_exit_ip(self):
+        """Get the exit IP of the circuit in use from the tracked circuit state"""
+        with self.circuit_lock:
+            circuit_id = self.stream_circuit if self.stream_circuit in self.circuits else None
+            if circuit_id is None and self.circuits:
+                # Tor puts new streams on the most recently built circuit
+                circuit_id = max(self.circuits, key=int)
+            fingerprint = self.circuits.get(circuit_id)
+        
+        if fingerprint is None:
+            return None
+        
+        address = self.exit_addresses.get(fingerprint)
+        if address is None:
+            controller = self._get_controller()
+            if controller is None:
+                return None
+            try:
+                address = controller.get_network_status(fingerprint).address
+            except Exception as e:
+                logger.debug(f"Could not look up exit relay {fingerprint}: {e}")
+                return None
+            self.exit_addresses[fingerprint] = address
+        return address
+    
+    def circuit_status(self):
+        """Get the tracked circuit state"""
+        with self.circuit_lock:
+            return {
+                'connected': self.controller is not None and self.controller.is_alive(),
+                'built_circuits': len(self.circuits),
+                'stream_circuit': self.stream_circuit,
+                'rotation_count': self.rotation_count,
+                'last_external_probe': self.last_probe_time or None,
+            }
+    
     def renew_tor_ip(self):
         """Request a new Tor circuit and IP address"""
         try:
-            with Controller.from_port(port=self.control_port) as controller:
-                controller.authenticate(password=self.password)
-                controller.signal(Signal.NEWNYM)
-                
-                # Wait for the new circuit to be established
-                time.sleep(2)
-                
-                # Get the new IP address
-                new_ip = self.get_current_ip()
-                if new_ip != self.last_ip:
-                    self.rotation_count += 1
-                    logger.info(f"Tor IP rotated ({self.rotation_count}): {new_ip}")
-                    self.last_ip = new_ip
-                else:
-                    logger.warning("IP rotation did not change the IP address")
-                
-                return new_ip
+            controller = self._get_controller()
+            if controller is None:
+                logger.error("Tor control connection is not available")
+                return None
+            
+            if not controller.is_newnym_available():
+                logger.debug(f"NEWNYM rate limited by Tor for {controller.get_newnym_wait():.1f}s")
+            
+            with self.circuit_lock:
+                known_circuits = set(self.circuits)
+            
+            # Signal Tor to switch to a new circuit
+            controller.signal(Signal.NEWNYM)
+            TOR_ROTATIONS.inc()
+            # Pooled probe connections are left to drain on their old circuit; closing them
+            # on every rotation would leave nothing to reuse. New streams get the new circuit.
+            
+            # Wait for a fresh circuit to be built instead of sleeping a fixed time
+            with self.circuit_changed:
+                self.circuit_changed.wait_for(
+                    lambda: set(self.circuits) - known_circuits,
+                    timeout=self.circuit_wait_timeout
+                )
+                # New streams go on a new circuit from now on
+                self.stream_circuit = None
+            
+            new_ip = self.get_exit_ip()
+            if new_ip != self.last_ip:
+                self.rotation_count += 1
+                logger.info(f"Tor IP rotated ({self.rotation_count}): {new_ip}")
+                self.last_ip = new_ip
+            else:
+                logger.debug("IP rotation did not change the exit IP address")
+            
+            return new_ip
         except stem.SocketError as e:
             logger.error(f"Error connecting to Tor control port: {e}")
             return None
-        except stem.connection.AuthenticationFailure as e:
-            logger.error(f"Authentication failed: {e}")
-            return None
         except Exception as e:
             logger.error(f"Error renewing Tor IP: {e}")
             return None
@@ -202,13 +461,8 @@ class TorController:
     def get_current_ip(self):
         """Get the current IP address through Tor"""
         try:
-            proxies = {
-                'http': f'socks5h://127.0.0.1:{self.tor_port}',
-                'https': f'socks5h://127.0.0.1:{self.tor_port}'
-            }
-            
-            # Use a service that returns your IP address
-            response = requests.get('https://api.ipify.org', proxies=proxies, timeout=10)
+            # Use a service that returns your IP address, over a kept-alive connection
+            response = get_http_pool().get('https://api.ipify.org', proxy=self.get_proxy_url())
             return response.text.strip()
         except Exception as e:
             logger.error(f"Error getting current IP: {e}")
@@ -227,7 +481,7 @@ class TorController:
         logger.info(f"Starting IP rotation every {self.rotation_interval} seconds")
         
         # Get initial IP
-        self.last_ip = self.get_current_ip()
+        self.last_ip = self.get_exit_ip()
         logger.info(f"Initial Tor IP: {self.last_ip}")
         
         while not self.stop_event.is_set():
@@ -277,14 +531,27 @@ class TorController:
     
     def test_connection(self):
         """Test the Tor connection"""
+        if (self.tor_process is not None or self.attached) and not self.ready_event.is_set():
+            return False, None
+        
         try:
-            ip = self.get_current_ip()
-            if ip:
-                logger.info(f"Tor connection successful. Current IP: {ip}")
-                return True, ip
-            else:
-                logger.error("Failed to get IP through Tor")
-                return False, None
+            # Answer from circuit state when we have it
+            if self._get_controller() is not None:
+                ip = self.get_exit_ip()
+                if ip:
+                    return True, ip
+            
+            # Otherwise fall back to an external probe, at a bounded rate
+            now = time.time()
+            if now - self.last_probe_time >= self.probe_interval:
+                self.last_probe_time = now
+                ip = self.get_current_ip()
+                if ip:
+                    logger.info(f"Tor connection successful. Current IP: {ip}")
+                else:
+                    logger.error("Failed to get IP through Tor")
+                self.last_probe_result = (bool(ip), ip)
+            return self.last_probe_result
         except Exception as e:
             logger.error(f"Error testing Tor connection: {e}")
             return False, str(e)
@@ -310,8 +577,6 @@ def init_tor():
         return False
 
 def stop_tor():
-    """Stop Tor"""
-    global _tor_controller
+    """Stop Tor, keeping the controller so a restart reuses its memoised setup"""
     if _tor_controller:
         _tor_controller.stop_tor()
-        _tor_controller = None
@@ -0,0 +1,191 @@
+import os
+import time
+import logging
+import threading
+
+from utils.tor_controller import TorController, get_tor_controller
+
+logger = logging.getLogger(__name__)
+
+
+class TorInstance:
+    """Load and bandwidth accounting for one tor process in the pool"""
+
+    def __init__(self, index, controller):
+        self.index = index
+        self.controller = controller
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.throughput = None  # smoothed bytes per second, None until a transfer has been measured
+
+    def stats(self):
+        return {
+            'index': self.index,
+            'proxy': self.controller.get_proxy_url(),
+            'ready': self.controller.ready_event.is_set(),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'bytes': self.bytes,
+            'busy_seconds': round(self.busy_seconds, 1),
+            'throughput': round(self.throughput) if self.throughput is not None else None,
+            'circuits': self.controller.circuit_status(),
+        }
+
+
+class TorLease:
+    """One in-flight use of a pool instance; release() it when the transfer is done"""
+
+    def __init__(self, pool, instance):
+        self.pool = pool
+        self.instance = instance
+        self.started = time.time()
+        self.released = False
+
+    @property
+    def controller(self):
+        return self.instance.controller
+
+    @property
+    def proxy_url(self):
+        return self.instance.controller.get_proxy_url()
+
+    def release(self, bytes_transferred=0, ok=True):
+        """Return the instance to the pool, recording how much was transferred through it"""
+        self.pool._release(self, bytes_transferred, ok)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release(ok=exc_type is None)
+
+
+class TorPool:
+    """Several tor processes, each with its own ports and data directory, with least-loaded selection"""
+
+    def __init__(self, controllers, smoothing=0.3):
+        self.instances = [TorInstance(index, controller) for index, controller in enumerate(controllers)]
+        self.smoothing = smoothing  # weight of the newest sample in the throughput average
+        self.lock = threading.Lock()
+
+    def _score(self, instance, best_throughput):
+        """Estimated time to finish one more transfer; lower is better"""
+        # Unmeasured instances are assumed to be as fast as the best one, so they get tried
+        throughput = instance.throughput or best_throughput or 1
+        return (instance.in_flight + 1) / throughput
+
+    def acquire(self, exclude=None):
+        """Lease the instance with the least load relative to its measured throughput"""
+        with self.lock:
+            candidates = [instance for instance in self.instances if instance is not exclude] or self.instances
+            ready = [instance for instance in candidates if instance.controller.ready_event.is_set()]
+            candidates = ready or candidates
+            best_throughput = max((instance.throughput or 0 for instance in candidates), default=0)
+            instance = min(candidates, key=lambda instance: (self._score(instance, best_throughput),
+                                                             instance.requests))
+            instance.in_flight += 1
+        return TorLease(self, instance)
+
+    def _release(self, lease, bytes_transferred, ok):
+        elapsed = time.time() - lease.started
+        with self.lock:
+            if lease.released:
+                return
+            lease.released = True
+            instance = lease.instance
+            instance.in_flight -= 1
+            instance.requests += 1
+            instance.busy_seconds += elapsed
+            if not ok:
+                instance.failures += 1
+            if bytes_transferred:
+                instance.bytes += bytes_transferred
+                if elapsed > 0:
+                    rate = bytes_transferred / elapsed
+                    if instance.throughput is None:
+                        instance.throughput = rate
+                    else:
+                        instance.throughput = self.smoothing * rate + (1 - self.smoothing) * instance.throughput
+
+    @property
+    def controllers(self):
+        return [instance.controller for instance in self.instances]
+
+    def start(self):
+        """Start every tor process, returning True if at least one started"""
+        started = False
+        for controller in self.controllers:
+            try:
+                controller.start_tor()
+                started = True
+            except Exception as e:
+                logger.error(f"Failed to start Tor on port {controller.tor_port}: {e}")
+        return started
+
+    def attach(self):
+        """Connect to tor processes another process runs for this pool, instead of starting them"""
+        for controller in self.controllers:
+            controller.attach()
+
+    @property
+    def attached(self):
+        return any(controller.attached for controller in self.controllers)
+
+    def stop(self):
+        """Stop every tor process"""
+        for controller in self.controllers:
+            controller.stop_tor()
+
+    def on_ready(self, callback):
+        """Register a function to call each time an instance finishes starting"""
+        for controller in self.controllers:
+            controller.on_ready(callback)
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until at least one instance is ready, returning True if one is"""
+        if any(controller.ready_event.is_set() for controller in self.controllers):
+            return True
+
+        deadline = None if timeout is None else time.time() + timeout
+        for controller in self.controllers:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if controller.wait_until_ready(timeout=remaining):
+                return True
+        return False
+
+    def renew_all(self):
+        """Request a new circuit on every instance and return the new exit IPs"""
+        return [controller.renew_tor_ip() for controller in self.controllers]
+
+    def stats(self):
+        """Get per-instance load, health and bandwidth"""
+        with self.lock:
+            return [instance.stats() for instance in self.instances]
+
+
+def create_tor_controllers(size, base_port=9050):
+    """Create controllers for `size` tor processes; the first one is the default TorController"""
+    data_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    controllers = [get_tor_controller()]
+    for index in range(1, size):
+        controllers.append(TorController(
+            tor_port=base_port + 2 * index,
+            control_port=base_port + 2 * index + 1,
+            data_dir=os.path.join(data_root, f'tor_data_{index}')
+        ))
+    return controllers
+
+
+# Singleton instance
+_tor_pool = None
+
+def get_tor_pool(size=1):
+    """Get the singleton TorPool instance"""
+    global _tor_pool
+    if _tor_pool is None:
+        _tor_pool = TorPool(create_tor_controllers(size))
+    return _tor_pool
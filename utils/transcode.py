@@ -0,0 +1,128 @@
+import time
+import logging
+
+from utils.ytdlp_engine import FORMAT_PRESETS
+from utils.process_supervisor import get_process_supervisor
+
+logger = logging.getLogger(__name__)
+
+# Codec families (yt-dlp vcodec/acodec prefixes) the MP4 container can carry as-is
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'h265', 'av01', 'vp09', 'vp9')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'opus', 'ac-3', 'ec-3', 'alac', 'flac')
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg cannot produce a derived output"""
+
+
+def _has_video(stream):
+    return stream.get('vcodec') not in (None, 'none')
+
+
+def _has_audio(stream):
+    return stream.get('acodec') not in (None, 'none')
+
+
+def _codec_in(codec, families):
+    codec = (codec or '').lower()
+    return any(codec == family or codec.startswith(f'{family}.') for family in families)
+
+
+def plan_derive(inputs, format_id):
+    """Decide per output stream whether ffmpeg can copy it or has to encode it
+
+    Returns a dict with the input index and 'copy'/'encode' action for the video
+    and audio stream (None when absent), and the overall path: 'copy' when nothing
+    is encoded, 'partial' when only some streams are, 'transcode' otherwise.
+    """
+    video = next((index for index, (_, stream) in enumerate(inputs) if _has_video(stream)), None)
+    audio = next((index for index, (_, stream) in enumerate(inputs) if _has_audio(stream)), None)
+
+    if FORMAT_PRESETS[format_id]['ext'] == 'mp3':
+        # An mp3 source only needs its audio stream copied out
+        audio = 0 if audio is None else audio
+        actions = {'video': None, 'audio': 'copy' if _codec_in(inputs[audio][1].get('acodec'), ('mp3',)) else 'encode'}
+        video = None
+    else:
+        video = 0 if video is None else video
+        actions = {
+            'video': 'copy' if _codec_in(inputs[video][1].get('vcodec'), MP4_VIDEO_CODECS) else 'encode',
+            'audio': None if audio is None else (
+                'copy' if _codec_in(inputs[audio][1].get('acodec'), MP4_AUDIO_CODECS) else 'encode'
+            ),
+        }
+
+    encoded = [kind for kind, action in actions.items() if action == 'encode']
+    copied = [kind for kind, action in actions.items() if action == 'copy']
+    path = 'transcode' if not copied else ('partial' if encoded else 'copy')
+    return {
+        'path': path,
+        'video': actions['video'],
+        'audio': actions['audio'],
+        'video_input': video,
+        'audio_input': audio,
+    }
+
+
+def build_derive_command(inputs, format_id, target, plan=None, threads=2):
+    """Build the ffmpeg command producing a FORMAT_PRESETS output from (path, format dict) inputs"""
+    plan = plan or plan_derive(inputs, format_id)
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y']
+    for path, _ in inputs:
+        cmd.extend(['-i', path])
+    # Caps the encoder and filter threads, so one job cannot take every core
+    cmd.extend(['-threads', str(threads)])
+
+    if FORMAT_PRESETS[format_id]['ext'] == 'mp3':
+        cmd.extend(['-map', f"{plan['audio_input']}:a:0", '-vn'])
+        if plan['audio'] == 'copy':
+            cmd.extend(['-c:a', 'copy', target])
+        else:
+            # Same settings as the preset's FFmpegExtractAudio postprocessor
+            options = FORMAT_PRESETS[format_id]['options']['postprocessors'][0]
+            cmd.extend(['-c:a', 'libmp3lame', '-b:a', f"{options['preferredquality']}k", target])
+        return cmd
+
+    # Video presets: stream copy like yt-dlp's merger, encoding only streams MP4 cannot carry
+    cmd.extend(['-map', f"{plan['video_input']}:v:0"])
+    cmd.extend(['-c:v', 'copy'] if plan['video'] == 'copy' else
+               ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'])
+    if plan['audio_input'] is not None:
+        cmd.extend(['-map', f"{plan['audio_input']}:a:0"])
+        cmd.extend(['-c:a', 'copy'] if plan['audio'] == 'copy' else ['-c:a', 'aac', '-b:a', '160k'])
+    cmd.extend(['-movflags', '+faststart', target])
+    return cmd
+
+
+def derive_output(inputs, format_id, output_path, threads=2, timeout=None, cancel_event=None):
+    """Produce `output_path`.<ext> for a preset from cached streams
+
+    Returns the target path and a report of the path taken ('copy', 'partial' or
+    'transcode'), the per-stream actions and the CPU and wall time ffmpeg used.
+    ffmpeg runs under the process supervisor; timeout overrides its default
+    wall-clock limit and setting cancel_event stops it.
+    """
+    target = f"{output_path}.{FORMAT_PRESETS[format_id]['ext']}"
+    plan = plan_derive(inputs, format_id)
+    cmd = build_derive_command(inputs, format_id, target, plan=plan, threads=threads)
+    logger.debug(f"Deriving {format_id} ({plan['path']}): {' '.join(cmd)}")
+
+    started = time.time()
+    process, stderr, cpu_seconds = get_process_supervisor().run(cmd, 'ffmpeg', timeout=timeout,
+                                                                 cancel_event=cancel_event)
+    if process.killed_reason:
+        raise TranscodeError(f"ffmpeg was stopped while producing {format_id} ({process.killed_reason})")
+    if process.popen.returncode != 0:
+        raise TranscodeError(f"ffmpeg failed to produce {format_id}: {stderr.strip()[-500:]}")
+
+    report = {
+        'path': plan['path'],
+        'video': plan['video'],
+        'audio': plan['audio'],
+        'threads': threads,
+        'cpu_seconds': round(cpu_seconds, 3) if cpu_seconds is not None else None,
+        'wall_seconds': round(time.time() - started, 3),
+    }
+    logger.info(f"Derived {format_id} via {plan['path']} in {report['wall_seconds']}s "
+                f"(CPU {report['cpu_seconds']}s)")
+    return target, report
@@ -0,0 +1,147 @@
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(Exception):
+    """Raised when a worker pool cannot accept more work; retry_after is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Thread pool with a queue-depth limit that rejects work instead of queueing it indefinitely"""
+
+    def __init__(self, name, max_workers, max_queue, smoothing=0.2):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue  # tasks allowed to wait for a free worker
+        self.smoothing = smoothing  # weight of the newest sample in the moving averages
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.created_at = time.time()
+        self.queued = 0
+        self.active = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.avg_wait = None
+        self.max_wait = 0.0
+        self.avg_runtime = None
+
+    def retry_after(self):
+        """Estimate how long until a queue slot frees up, in whole seconds"""
+        runtime = self.avg_runtime or 1.0
+        return max(1, math.ceil(runtime * (self.queued + 1) / self.max_workers))
+
+    def _average(self, current, sample):
+        return sample if current is None else self.smoothing * sample + (1 - self.smoothing) * current
+
+    def _call(self, submitted_at, func, args):
+        started = time.time()
+        wait = started - submitted_at
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.avg_wait = self._average(self.avg_wait, wait)
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            return func(*args)
+        finally:
+            runtime = time.time() - started
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.busy_seconds += runtime
+                self.avg_runtime = self._average(self.avg_runtime, runtime)
+
+    def submit(self, func, *args):
+        """Schedule func(*args) and return a Future, or raise PoolSaturatedError if the queue is full"""
+        with self.lock:
+            if self.active + self.queued >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturatedError(
+                    f"The {self.name} pool is busy ({self.queued} tasks waiting)",
+                    retry_after=self.retry_after()
+                )
+            self.queued += 1
+            self.submitted += 1
+        return self.executor.submit(self._call, time.time(), func, args)
+
+    def stats(self):
+        """Get load, queue wait and utilisation figures"""
+        with self.lock:
+            uptime = max(time.time() - self.created_at, 1e-6)
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'queued': self.queued,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'avg_wait_ms': round(self.avg_wait * 1000, 1) if self.avg_wait is not None else None,
+                'max_wait_ms': round(self.max_wait * 1000, 1),
+                'avg_runtime_ms': round(self.avg_runtime * 1000, 1) if self.avg_runtime is not None else None,
+                'utilisation': round(self.active / self.max_workers, 3),
+                'lifetime_utilisation': round(self.busy_seconds / (uptime * self.max_workers), 3),
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class SlotPool:
+    """Fixed number of slots for long-running work that runs outside a thread pool
+
+    A slot is held for the whole life of the work, e.g. a /stream pipeline, and
+    acquire() rejects instead of waiting once every slot is taken.
+    """
+
+    def __init__(self, name, size, retry_after=10):
+        self.name = name
+        self.size = size
+        self.retry_after = retry_after  # seconds suggested to rejected callers
+        self.lock = threading.Lock()
+        self.active = 0
+        self.acquired = 0
+        self.rejected = 0
+
+    def acquire(self):
+        """Take a slot, or raise PoolSaturatedError if all are in use; returns a release function"""
+        with self.lock:
+            if self.active >= self.size:
+                self.rejected += 1
+                raise PoolSaturatedError(f"The {self.name} pool is busy ({self.active} running)",
+                                         retry_after=self.retry_after)
+            self.active += 1
+            self.acquired += 1
+
+        released = []
+
+        def release():
+            with self.lock:
+                if released:
+                    return
+                released.append(True)
+                self.active -= 1
+
+        return release
+
+    def stats(self):
+        """Get slot usage figures"""
+        with self.lock:
+            return {
+                'size': self.size,
+                'active': self.active,
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'utilisation': round(self.active / self.size, 3),
+            }
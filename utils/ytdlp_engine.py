@@ -0,0 +1,378 @@
+import os
+import time
+import logging
+import threading
+
+import yt_dlp
+from yt_dlp.utils import YoutubeDLError, DownloadCancelled
+
+from utils.worker_pool import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Audio stream every preset prefers, so the audio fetched for one preset is reused by the others
+PREFERRED_AUDIO = 'bestaudio[acodec^=mp4a]'
+
+# Format presets offered by the UI, expressed as YoutubeDL options. priority is the
+# scheduling class (lower runs first) and kbps a typical bitrate for size estimates.
+# Video presets prefer H.264/AAC streams, which go into MP4 with a plain stream copy.
+FORMAT_PRESETS = {
+    'mp4-hd': {
+        'ext': 'mp4',
+        'priority': 2,
+        'kbps': 4500,
+        'options': {
+            'format': (f'bestvideo[height<=1080][vcodec^=avc1]+{PREFERRED_AUDIO}/'
+                       'bestvideo[height<=1080]+bestaudio/best[height<=1080]'),
+            'merge_output_format': 'mp4',
+        },
+    },
+    'mp4-sd': {
+        'ext': 'mp4',
+        'priority': 1,
+        'kbps': 1200,
+        'options': {
+            'format': (f'bestvideo[height<=480][vcodec^=avc1]+{PREFERRED_AUDIO}/'
+                       'bestvideo[height<=480]+bestaudio/best[height<=480]'),
+            'merge_output_format': 'mp4',
+        },
+    },
+    'mp3': {
+        'ext': 'mp3',
+        'priority': 0,
+        'kbps': 192,
+        'options': {
+            'format': f'{PREFERRED_AUDIO}/bestaudio/best',
+            'final_ext': 'mp3',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }],
+        },
+    },
+}
+
+
+class YtDlpError(Exception):
+    """Raised when an embedded yt-dlp extraction or download fails"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        # Mirrors CalledProcessError.stderr so callers can inspect the output
+        self.stderr = message
+
+    @property
+    def is_rate_limited(self):
+        return "HTTP Error 429" in self.stderr or "Too Many Requests" in self.stderr
+
+    @property
+    def is_bad_request(self):
+        return "HTTP Error 400" in self.stderr or "Bad Request" in self.stderr
+
+
+class DownloadAborted(Exception):
+    """Raised when a download was stopped for a timeout or cancellation; retrying will not help"""
+
+    def __init__(self, reason):
+        super().__init__(f"Download {reason}")
+        self.reason = reason  # 'timeout' or 'cancelled'
+
+
+class _YtDlpLogger:
+    """Routes yt-dlp output into the application log"""
+
+    def debug(self, msg):
+        logger.debug(msg)
+
+    def info(self, msg):
+        logger.debug(msg)
+
+    def warning(self, msg):
+        logger.warning(msg)
+
+    def error(self, msg):
+        logger.error(msg)
+
+
+# Options for resolving playlists and channels to their entries without visiting each video
+FLAT_OPTIONS = {
+    'extract_flat': 'in_playlist',
+    'noplaylist': False,
+}
+
+
+# Stage reported for each yt-dlp postprocessor
+POSTPROCESSOR_STAGES = {
+    'Merger': 'merge',
+    'ExtractAudio': 'transcode',
+    'VideoConvertor': 'transcode',
+    'VideoRemuxer': 'remux',
+}
+
+
+class YtDlpEngine:
+    def __init__(self, metadata_workers=4, metadata_queue=16, media_workers=2, media_queue=8,
+                 progress_interval=0.5, ffmpeg_threads=2, socket_timeout=30, download_timeout=3600):
+        self.progress_interval = progress_interval  # minimum seconds between download progress reports
+        self.ffmpeg_threads = ffmpeg_threads  # thread cap for ffmpeg run by merge/convert postprocessors
+        self.socket_timeout = socket_timeout  # seconds before a stalled connection fails
+        self.download_timeout = download_timeout  # wall-clock limit for one download, None for no limit
+        # Separate pools so a burst of downloads cannot starve quick metadata lookups
+        self.metadata_pool = BoundedExecutor('metadata', metadata_workers, metadata_queue)
+        self.media_pool = BoundedExecutor('media', media_workers, media_queue)
+        self._local = threading.local()
+        self._selector = None  # YoutubeDL instance used only to parse format specs
+        self._selector_lock = threading.Lock()
+
+    def _base_options(self, proxy):
+        """Options shared by every YoutubeDL instance"""
+        options = {
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'noplaylist': True,
+            'cachedir': False,
+            'updatetime': False,  # keep the download time as mtime, retention ages files by it
+            'logger': _YtDlpLogger(),
+            'http_headers': {'User-Agent': USER_AGENT},
+            'socket_timeout': self.socket_timeout,
+            'progress_hooks': [self._progress_hook],
+            'postprocessor_hooks': [self._postprocessor_hook],
+            'postprocessor_args': {'default': ['-threads', str(self.ffmpeg_threads)]},
+        }
+        if proxy:
+            options['proxy'] = proxy
+        return options
+
+    def _get_instance(self, key, proxy):
+        """Get a warm YoutubeDL instance owned by the current worker thread"""
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+
+        ydl = instances.get((key, proxy))
+        if ydl is None:
+            options = self._base_options(proxy)
+            if key in FORMAT_PRESETS:
+                options.update(FORMAT_PRESETS[key]['options'])
+            elif key == 'flat':
+                options.update(FLAT_OPTIONS)
+            logger.debug(f"Creating YoutubeDL instance for {key} (proxy: {proxy})")
+            ydl = yt_dlp.YoutubeDL(options)
+            instances[(key, proxy)] = ydl
+        return ydl
+
+    def _report(self, stage, percent=None, speed=None, eta=None):
+        """Send progress to the callback of the job running on this worker thread"""
+        callback = getattr(self._local, 'progress', None)
+        if callback is not None:
+            callback(stage, percent, speed, eta)
+
+    def _progress_hook(self, d):
+        """yt-dlp download progress hook, also where timeouts and cancellation stop a download"""
+        now = time.time()
+        cancel_event = getattr(self._local, 'cancel_event', None)
+        if cancel_event is not None and cancel_event.is_set():
+            self._local.aborted = 'cancelled'
+            raise DownloadCancelled('cancelled')
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is not None and now > deadline:
+            self._local.aborted = 'timeout'
+            raise DownloadCancelled('timeout')
+
+        if d['status'] == 'downloading' and now - getattr(self._local, 'last_report', 0) < self.progress_interval:
+            return
+        self._local.last_report = now
+
+        # Merged formats are downloaded one after the other; report progress across all of them
+        info = d.get('info_dict') or {}
+        format_ids = [f.get('format_id') for f in info.get('requested_formats') or []]
+        index = format_ids.index(info.get('format_id')) if info.get('format_id') in format_ids else 0
+        count = max(len(format_ids), 1)
+
+        if d['status'] == 'finished':
+            fraction = 1.0
+        else:
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            fraction = d.get('downloaded_bytes', 0) / total if total else 0.0
+        percent = (index + min(fraction, 1.0)) / count * 100
+        self._report('download', percent, d.get('speed'), d.get('eta'))
+
+    def _postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook"""
+        if d['status'] == 'started':
+            self._report(POSTPROCESSOR_STAGES.get(d.get('postprocessor'), 'postprocess'))
+
+    def _run(self, pool, func, *args):
+        """Run a job on a worker pool and wait for its result, raising PoolSaturatedError if it is full"""
+        return pool.submit(func, *args).result()
+
+    def _extract_info(self, url, proxy, referer):
+        ydl = self._get_instance('info', proxy)
+        if referer:
+            ydl.params['http_headers']['Referer'] = referer
+        try:
+            info = ydl.extract_info(url, download=False)
+        except YoutubeDLError as e:
+            raise YtDlpError(str(e)) from e
+        return ydl.sanitize_info(info)
+
+    def _extract_entries(self, url, proxy, referer, limit):
+        ydl = self._get_instance('flat', proxy)
+        if referer:
+            ydl.params['http_headers']['Referer'] = referer
+        ydl.params['playlistend'] = limit
+        try:
+            info = ydl.extract_info(url, download=False)
+        except YoutubeDLError as e:
+            raise YtDlpError(str(e)) from e
+
+        info = ydl.sanitize_info(info)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            # A single video: the URL itself is the only entry
+            return [{'id': info.get('id'), 'url': info.get('webpage_url') or url, 'title': info.get('title')}]
+
+        entries = []
+        for entry in info.get('entries') or []:
+            if not entry or not (entry.get('url') or entry.get('id')):
+                continue
+            entries.append({
+                'id': entry.get('id'),
+                'url': entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}",
+                'title': entry.get('title'),
+            })
+        return entries[:limit] if limit else entries
+
+    def _download(self, url, format_id, output_path, proxy, referer, info, progress, stream=None,
+                  cancel_event=None):
+        self._local.progress = progress
+        self._local.last_report = 0
+        self._local.cancel_event = cancel_event
+        self._local.deadline = time.time() + self.download_timeout if self.download_timeout else None
+        self._local.aborted = None
+        try:
+            if cancel_event is not None and cancel_event.is_set():
+                raise DownloadAborted('cancelled')
+            return self._download_with_instance(url, format_id, output_path, proxy, referer, info, stream)
+        except (YoutubeDLError, YtDlpError):
+            # The DownloadCancelled raised by the progress hook may arrive wrapped
+            if self._local.aborted:
+                raise DownloadAborted(self._local.aborted)
+            raise
+        finally:
+            self._local.progress = None
+            self._local.cancel_event = None
+            self._local.deadline = None
+
+    def _download_with_instance(self, url, format_id, output_path, proxy, referer, info, stream=None):
+        ydl = self._get_instance(format_id if stream is None else 'stream', proxy)
+        if referer:
+            ydl.params['http_headers']['Referer'] = referer
+        # The instance is only used by this worker thread, so the template can be swapped per job
+        ydl.params['outtmpl']['default'] = f'{output_path}.%(ext)s'
+        if stream is not None:
+            ydl.format_selector = ydl.build_format_selector(stream['format_id'])
+
+        result = None
+        if info is not None:
+            # Same approach as --load-info-json: re-run format selection on the known info dict
+            try:
+                result = ydl.process_ie_result(ydl.sanitize_info(dict(info), remove_private_keys=True), download=True)
+            except DownloadCancelled:
+                raise
+            except YoutubeDLError as e:
+                logger.warning(f"Download from cached info failed, extracting again: {e}")
+
+        if result is None:
+            try:
+                result = ydl.extract_info(url, download=True)
+            except YoutubeDLError as e:
+                raise YtDlpError(str(e)) from e
+
+        result = ydl.sanitize_info(result)
+        downloads = result.get('requested_downloads') or [{}]
+        filepath = downloads[-1].get('filepath')
+        if not filepath or not os.path.exists(filepath):
+            ext = stream['ext'] if stream is not None else FORMAT_PRESETS[format_id]['ext']
+            filepath = f"{output_path}.{ext}"
+        result['filepath'] = filepath
+        return result
+
+    def extract_info(self, url, proxy=None, referer=None):
+        """Extract video metadata, equivalent to `yt-dlp -j`"""
+        return self._run(self.metadata_pool, self._extract_info, url, proxy, referer)
+
+    def extract_entries(self, url, proxy=None, referer=None, limit=None):
+        """Resolve a playlist or channel URL to its video entries with one flat extraction"""
+        return self._run(self.metadata_pool, self._extract_entries, url, proxy, referer, limit)
+
+    def download(self, url, format_id, output_path, proxy=None, referer=None, info=None, progress=None,
+                 cancel_event=None):
+        """Download a video using one of FORMAT_PRESETS to `output_path`.<ext>
+
+        Passing the info dict from a previous extract_info() skips extraction. The
+        returned info dict has the final file location in 'filepath'. progress is
+        called as progress(stage, percent, speed, eta) while the job runs. Setting
+        cancel_event, or running past download_timeout, raises DownloadAborted.
+
+        The preset's merge or audio extraction runs in yt-dlp's own ffmpeg
+        postprocessors, outside the process supervisor, and cancellation cannot
+        stop it. The app therefore downloads streams with download_stream() and
+        builds presets with transcode.derive_output().
+        """
+        if format_id not in FORMAT_PRESETS:
+            raise ValueError(f"Unknown format preset: {format_id}")
+        return self._run(self.media_pool, self._download, url, format_id, output_path, proxy, referer, info,
+                         progress, None, cancel_event)
+
+    def select_streams(self, info, format_id):
+        """Get the format dicts yt-dlp would download for a preset, one per elementary stream"""
+        formats = info.get('formats') or []
+        with self._selector_lock:
+            if self._selector is None:
+                self._selector = yt_dlp.YoutubeDL(self._base_options(None))
+            selector = self._selector.build_format_selector(FORMAT_PRESETS[format_id]['options']['format'])
+            # Same context YoutubeDL.process_video_result passes to the selector
+            selected = list(selector({
+                'formats': formats,
+                'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+                'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                       or all(f.get('acodec') == 'none' for f in formats)),
+            }))
+
+        if not selected:
+            raise YtDlpError(f"Requested format is not available for preset {format_id}")
+        return selected[0].get('requested_formats') or [selected[0]]
+
+    def download_stream(self, url, stream, output_path, proxy=None, referer=None, info=None, progress=None,
+                        cancel_event=None):
+        """Download one format dict from select_streams() to `output_path`.<ext>
+
+        Nothing is merged or converted. The returned info dict has the file
+        location in 'filepath'.
+        """
+        return self._run(self.media_pool, self._download, url, 'stream', output_path, proxy, referer, info,
+                         progress, stream, cancel_event)
+
+    def pool_stats(self):
+        """Get queue wait and utilisation figures for each worker pool"""
+        return {'metadata': self.metadata_pool.stats(), 'media': self.media_pool.stats()}
+
+    def shutdown(self):
+        """Stop the worker pools"""
+        self.metadata_pool.shutdown()
+        self.media_pool.shutdown()
+
+
+# Singleton instance
+_ytdlp_engine = None
+
+def get_ytdlp_engine(**kwargs):
+    """Get the singleton YtDlpEngine instance"""
+    global _ytdlp_engine
+    if _ytdlp_engine is None:
+        _ytdlp_engine = YtDlpEngine(**kwargs)
+    return _ytdlp_engine
@@ -0,0 +1,45 @@
+import io
+import zipfile
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that hands written bytes back to the generator"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        """Remove and return everything written since the last drain"""
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(files, chunk_size=64 * 1024):
+    """Yield a ZIP archive of (name, path or bytes) pairs while it is being written
+
+    Entries are stored uncompressed (media is already compressed) with data
+    descriptors, so nothing is staged on disk and memory use stays at about one
+    chunk. `files` may be a generator that blocks until the next file is ready.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, source in files:
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                with open(source, 'rb') as src, archive.open(name, 'w', force_zip64=True) as dest:
+                    chunk = src.read(chunk_size)
+                    while chunk:
+                        dest.write(chunk)
+                        yield from buffer.drain()
+                        chunk = src.read(chunk_size)
+            yield from buffer.drain()
+    yield from buffer.drain()